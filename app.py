@@ -1,38 +1,76 @@
 import os
+import sys
 import logging
+import subprocess
+import click
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import inspect, text
 from sqlalchemy.orm import DeclarativeBase
+from branches import BranchSession, load_branches, create_branch_schemas
+from log_setup import configure_logging, init_request_logging
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
+# Structured logging through a background queue (see log_setup.py)
+configure_logging()
 
 class Base(DeclarativeBase):
     pass
 
-db = SQLAlchemy(model_class=Base)
+db = SQLAlchemy(model_class=Base, session_options={'class_': BranchSession})
 
 # Create the app
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "your-secret-key-for-development")
+init_request_logging(app)
 
 # Configure SQLite database  
 basedir = os.path.abspath(os.path.dirname(__file__))
 app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{os.path.join(basedir, 'market_system.db')}"
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
+# Branch partitions and their read-only reporting replicas (see branches.py and replicas.py)
+(app.config["MARKET_BRANCH_NAMES"], app.config["SQLALCHEMY_BINDS"],
+ app.config["MARKET_REPLICA_URLS"]) = load_branches(basedir)
+
 # Initialize the app with the extension
 db.init_app(app)
 
-# Import routes after app creation to avoid circular imports
-from routes import *
+def upgrade_schema(engine=None, tables=None):
+    """Add columns and indexes introduced after a database was first created"""
+    engine = engine or db.engine
+    schema = (engine.get_execution_options().get('schema_translate_map') or {}).get(None)
+    inspector = inspect(engine)
+    quote = engine.dialect.identifier_preparer.quote
+    with engine.begin() as conn:
+        for table in tables or db.metadata.sorted_tables:
+            if not inspector.has_table(table.name, schema=schema):
+                continue
+            existing = {column['name'] for column in inspector.get_columns(table.name, schema=schema)}
+            for column in table.columns:
+                if column.name not in existing:
+                    column_type = column.type.compile(dialect=engine.dialect)
+                    table_name = f"{quote(schema)}.{quote(table.name)}" if schema else quote(table.name)
+                    conn.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {quote(column.name)} {column_type}"))
+                    logging.info(f"Added column {table.name}.{column.name}")
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
 
-with app.app_context():
-    # Import models
-    from models import User, Product, Sale, SaleItem
+def init_db():
+    """Create tables, apply schema upgrades and create the default admin user"""
+    from models import User
     
     # Create all tables
     db.create_all()
+    upgrade_schema()
+    create_branch_schemas(db, upgrade_schema)
+    
+    # Replay sales left in the journal by a previous run
+    from sale_journal import recover_journals
+    recover_journals()
+    
+    # Jobs that were running when the server stopped will never finish
+    from jobs import mark_interrupted_jobs
+    mark_interrupted_jobs()
     
     # Create default admin user if not exists
     admin_user = User.query.filter_by(username='admin').first()
@@ -40,11 +78,72 @@ with app.app_context():
         from werkzeug.security import generate_password_hash
         admin = User(
             username='admin',
-            password_hash=generate_password_hash('admin123')
+            password_hash=generate_password_hash('admin123'),
+            head_office=True
         )
         db.session.add(admin)
         db.session.commit()
         logging.info("Default admin user created: admin/admin123")
+    elif not User.query.filter_by(head_office=True).first():
+        # Databases from before the head_office flag: keep one user able to manage branches
+        admin_user.head_office = True
+        db.session.commit()
+        logging.info("Default admin user marked as head office")
+
+@app.cli.command('init-db')
+def init_db_command():
+    """Create or upgrade the database schema (run once per deploy, not per worker)."""
+    init_db()
+    click.echo('Database schema is up to date.')
+
+# Modules that are imported on first use and must not be loaded at boot
+LAZY_MODULES = ('escpos', 'usb', 'serial', 'charset_normalizer', 'qrcode', 'pandas', 'reportlab', 'PIL', 'openpyxl')
+BOOT_IMPORT_BUDGET_MS = 1500
+
+@app.cli.command('boot-report')
+@click.option('--budget-ms', default=BOOT_IMPORT_BUDGET_MS, show_default=True,
+              help='Fail if importing the app takes longer than this.')
+@click.option('--top', default=15, show_default=True, help='Number of slowest modules to list.')
+def boot_report_command(budget_ms, top):
+    """Measure how long importing the app takes and which modules it loads."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'],
+                            cwd=basedir, capture_output=True, text=True)
+    if result.returncode != 0:
+        click.echo(result.stderr[-2000:], err=True)
+        raise SystemExit(1)
+    
+    timings = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        if not self_us.strip().isdigit():
+            continue  # header line
+        # top-level imports have a single space of indentation
+        timings.append((name.strip(), int(self_us), int(cumulative_us), len(name) - len(name.lstrip()) <= 1))
+    
+    total_ms = sum(self_us for _, self_us, _, _ in timings) / 1000
+    loaded = sorted({name.split('.')[0] for name, _, _, _ in timings})
+    eager = [module for module in LAZY_MODULES if module in loaded]
+    
+    click.echo(f"Import time: {total_ms:.0f} ms (budget {budget_ms} ms), {len(timings)} modules")
+    click.echo("Slowest top-level imports:")
+    for name, _, cumulative_us, _ in sorted((t for t in timings if t[3]), key=lambda t: -t[2])[:top]:
+        click.echo(f"  {cumulative_us / 1000:8.1f} ms  {name}")
+    click.echo("Packages loaded at boot: " + ", ".join(loaded))
+    
+    if eager:
+        click.echo(f"FAIL: loaded at boot but should be lazy: {', '.join(eager)}", err=True)
+    if total_ms > budget_ms:
+        click.echo(f"FAIL: import time exceeds the {budget_ms} ms budget", err=True)
+    if eager or total_ms > budget_ms:
+        raise SystemExit(1)
+
+# Import routes after app creation to avoid circular imports
+from routes import *
+import backup  # flask backup / backups / restore
 
 if __name__ == '__main__':
+    with app.app_context():
+        init_db()
     app.run(host='0.0.0.0', port=5000, debug=True)
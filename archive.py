@@ -0,0 +1,213 @@
+"""
+أرشفة المبيعات القديمة
+الأشهر المغلقة تنقل إلى قواعد بيانات شهرية للقراءة فقط، وتبقى قاعدة البيانات الحية صغيرة
+التقارير وإعادة الطباعة تقرأ من القاعدة الحية ومن الأرشيفات المتداخلة مع الفترة المطلوبة فقط
+"""
+
+import logging
+import os
+import stat
+import threading
+from datetime import datetime
+
+import click
+import sqlalchemy as sa
+from sqlalchemy.orm import Session, selectinload
+
+from app import app, db
+from models import Product, Sale, SaleItem, SaleArchive
+from branches import current_branch, branch_context
+from read_models import sale_rows
+from render_cache import bump_versions
+
+# كل أرشيف يحفظ مساره الكامل في SaleArchive، فالأرشيفات المنشأة في مكان سابق تبقى مقروءة
+ARCHIVE_DIR = os.path.join(app.instance_path, 'archives')
+
+# الأشهر الأحدث من ذلك تبقى في القاعدة الحية (تحتاجها توقعات المخزون)
+KEEP_MONTHS = 13
+
+ARCHIVE_TABLES = [Product.__table__, Sale.__table__, SaleItem.__table__]
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def month_start(year, month):
+    return datetime(year, month, 1)
+
+
+def next_month(start):
+    return datetime(start.year + (start.month == 12), start.month % 12 + 1, 1)
+
+
+def archive_path(start, branch=None):
+    return os.path.join(ARCHIVE_DIR, branch or current_branch(), f"sales_{start:%Y_%m}.db")
+
+
+def _archive_engine(path):
+    """محرك قراءة فقط لملف أرشيف، يفتح عند أول استخدام ويعاد استخدامه"""
+    with _engines_lock:
+        engine = _engines.get(path)
+        if engine is None:
+            engine = sa.create_engine(f"sqlite:///file:{path}?mode=ro&uri=true")
+            _engines[path] = engine
+        return engine
+
+
+def archive_month(start, vacuum=False):
+    """نقل مبيعات شهر مغلق إلى ملف أرشيف ثم حذفها من القاعدة الحية"""
+    end = next_month(start)
+    if end > month_start(datetime.now().year, datetime.now().month):
+        return False, "لا يمكن أرشفة شهر لم يغلق بعد"
+    if SaleArchive.query.filter_by(period_start=start).first():
+        return False, f"الشهر {start:%Y-%m} مؤرشف بالفعل"
+
+    sale_table, item_table, product_table = Sale.__table__, SaleItem.__table__, Product.__table__
+    in_period = (sale_table.c.sale_date >= start) & (sale_table.c.sale_date < end)
+    period_ids = sa.select(sale_table.c.id).where(in_period)
+
+    hot = db.session.connection(bind_arguments={'mapper': Sale})
+    sales = [dict(row._mapping) for row in hot.execute(
+        sa.select(sale_table).where(in_period).order_by(sale_table.c.id))]
+    if not sales:
+        return False, f"لا توجد مبيعات في {start:%Y-%m}"
+    items = [dict(row._mapping) for row in hot.execute(
+        sa.select(item_table).where(item_table.c.sale_id.in_(period_ids)))]
+    products = [dict(row._mapping) for row in hot.execute(
+        sa.select(product_table).where(product_table.c.id.in_(
+            sa.select(item_table.c.product_id).where(item_table.c.sale_id.in_(period_ids)))))]
+
+    path = archive_path(start)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = path + '.tmp'
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+
+    # كتابة الأرشيف في ملف مؤقت ثم التحقق منه قبل الحذف من القاعدة الحية
+    writer = sa.create_engine(f"sqlite:///{temp_path}")
+    try:
+        db.metadata.create_all(writer, tables=ARCHIVE_TABLES)
+        with writer.begin() as conn:
+            if products:
+                conn.execute(product_table.insert(), products)
+            conn.execute(sale_table.insert(), sales)
+            if items:
+                conn.execute(item_table.insert(), items)
+        with writer.connect() as conn:
+            archived = conn.execute(sa.select(sa.func.count()).select_from(sale_table)).scalar()
+            integrity = conn.execute(sa.text("PRAGMA integrity_check")).scalar()
+    finally:
+        writer.dispose()
+
+    if archived != len(sales) or integrity != 'ok':
+        os.remove(temp_path)
+        return False, f"فشل التحقق من أرشيف {start:%Y-%m}"
+
+    os.replace(temp_path, path)
+    os.chmod(path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+
+    db.session.add(SaleArchive(
+        period_start=start,
+        period_end=end,
+        path=path,
+        sale_count=len(sales),
+        first_sale_id=sales[0]['id'],
+        last_sale_id=sales[-1]['id'],
+        total_amount=sum(sale['total_amount'] or 0 for sale in sales)
+    ))
+    hot.execute(item_table.delete().where(item_table.c.sale_id.in_(period_ids)))
+    hot.execute(sale_table.delete().where(in_period))
+    bump_versions(db.session, {'sales'})
+    db.session.commit()
+
+    engine = db.session.get_bind(mapper=Sale)
+    if vacuum and engine.dialect.name == 'sqlite':
+        with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            conn.execute(sa.text("VACUUM"))
+
+    logging.info(f"Archived {len(sales)} sales for {start:%Y-%m} to {path}")
+    return True, f"تم أرشفة {len(sales)} عملية بيع لشهر {start:%Y-%m}"
+
+
+def overlapping_archives(start=None, end=None):
+    """الأرشيفات التي تتداخل مع الفترة المطلوبة فقط"""
+    query = SaleArchive.query
+    if start:
+        query = query.filter(SaleArchive.period_end > start)
+    if end:
+        query = query.filter(SaleArchive.period_start <= end)
+    return query.order_by(SaleArchive.period_start.desc()).all()
+
+
+def _load_archived(archive, start=None, end=None, sale_id=None):
+    if not os.path.exists(archive.path):
+        logging.error(f"Archive file missing: {archive.path}")
+        return []
+    with Session(_archive_engine(archive.path)) as session:
+        query = session.query(Sale).options(selectinload(Sale.items).selectinload(SaleItem.product))
+        if sale_id is not None:
+            query = query.filter(Sale.id == sale_id)
+        if start:
+            query = query.filter(Sale.sale_date >= start)
+        if end:
+            query = query.filter(Sale.sale_date <= end)
+        sales = query.all()
+        # الكائنات تبقى قابلة للقراءة بعد إغلاق الجلسة لأن العلاقات محملة مسبقاً
+        session.expunge_all()
+        return sales
+
+
+def archive_sessions(start=None, end=None):
+    """(سجل الأرشيف، جلسة قراءة لملفه) لكل أرشيف متداخل مع الفترة؛ الملفات المفقودة تسجل وتتخطى"""
+    for archive in overlapping_archives(start, end):
+        if not os.path.exists(archive.path):
+            logging.error(f"Archive file missing: {archive.path}")
+            continue
+        with Session(_archive_engine(archive.path)) as session:
+            yield archive, session
+
+
+def archived_sales(start=None, end=None):
+    """صفوف مبيعات الأرشيف في الفترة المطلوبة (نفس أعمدة read_models.sale_rows)"""
+    sales = []
+    for _, session in archive_sessions(start, end):
+        sales.extend(sale_rows(start, end, session))
+    return sales
+
+
+def find_sale(sale_id):
+    """البحث عن بيع في القاعدة الحية ثم في الأرشيف الذي يغطي رقمه"""
+    sale = db.session.get(Sale, sale_id, options=[selectinload(Sale.items).selectinload(SaleItem.product)])
+    if sale is not None:
+        return sale, False
+    archive = SaleArchive.query.filter(
+        SaleArchive.first_sale_id <= sale_id, SaleArchive.last_sale_id >= sale_id
+    ).first()
+    if archive is None:
+        return None, False
+    found = _load_archived(archive, sale_id=sale_id)
+    return (found[0], True) if found else (None, False)
+
+
+@app.cli.command('archive-sales')
+@click.option('--keep-months', default=KEEP_MONTHS, show_default=True,
+              help='Number of recent months to keep in the live database.')
+@click.option('--branch', default=None, help='Branch code (defaults to every branch).')
+@click.option('--vacuum', is_flag=True, help='Reclaim space in the live database afterwards.')
+def archive_sales_command(keep_months, branch, vacuum):
+    """Move closed months of sales into read-only monthly archives."""
+    from branches import branch_names
+    now = datetime.now()
+    cutoff_index = now.year * 12 + now.month - 1 - keep_months
+    cutoff = month_start(cutoff_index // 12, cutoff_index % 12 + 1)
+
+    for code in ([branch] if branch else list(branch_names())):
+        with branch_context(code):
+            # الأشهر التي بها مبيعات فقط، بدلاً من المرور على كل شهر منذ أقدم بيع
+            year, month = sa.extract('year', Sale.sale_date), sa.extract('month', Sale.sale_date)
+            months = db.session.execute(sa.select(year, month).where(Sale.sale_date < cutoff)
+                                        .group_by(year, month).order_by(year, month)).all()
+            for year_value, month_value in months:
+                success, message = archive_month(month_start(int(year_value), int(month_value)), vacuum=vacuum)
+                click.echo(f"[{code}] {message}", err=not success)
+            db.session.remove()
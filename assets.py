@@ -0,0 +1,193 @@
+"""
+الملفات الثابتة المحلية ذات البصمة
+المكتبات الخارجية (Bootstrap، Font Awesome، html5-qrcode) تنسخ محلياً بدلاً من تحميلها من CDN في كل صفحة
+ثم تبنى نسخة من كل ملف باسم يحتوي بصمة محتواه مع نسخ مضغوطة مسبقاً (gzip/brotli)،
+فتخزن في المتصفح بلا انتهاء ولا تطلب مرة أخرى حتى يتغير محتواها
+
+    flask vendor-assets   # تحميل المكتبات إلى static/vendor (مرة واحدة، تحتاج إنترنت)
+    flask build-assets    # بناء static/dist و manifest.json (بعد كل تعديل في static)
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import re
+import shutil
+import threading
+import urllib.request
+
+import click
+from flask import url_for
+
+from app import app
+
+try:
+    import brotli
+except ImportError:  # الضغط بـ brotli اختياري
+    brotli = None
+
+STATIC_DIR = os.path.join(app.root_path, 'static')
+VENDOR_DIR = os.path.join(STATIC_DIR, 'vendor')
+DIST_DIR = os.path.join(STATIC_DIR, 'dist')
+MANIFEST_PATH = os.path.join(DIST_DIR, 'manifest.json')
+
+# المجلدات التي تبنى منها الملفات ذات البصمة
+SOURCE_DIRS = ('css', 'js', 'vendor')
+
+# الأنواع التي يفيد ضغطها (woff2 و png مضغوطة أصلاً)
+COMPRESSIBLE = ('.css', '.js', '.svg', '.ttf', '.json', '.map')
+
+IMMUTABLE_CACHE = 'public, max-age=31536000, immutable'
+
+_FONT_AWESOME = 'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.0.0'
+
+# المسار المحلي داخل static/vendor ← رابط النسخة المثبتة (يستخدم أيضاً قبل تشغيل vendor-assets)
+VENDOR_ASSETS = {
+    'bootstrap/bootstrap.rtl.min.css': 'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.rtl.min.css',
+    'bootstrap/bootstrap.bundle.min.js': 'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/js/bootstrap.bundle.min.js',
+    'fontawesome/css/all.min.css': f'{_FONT_AWESOME}/css/all.min.css',
+    'html5-qrcode/html5-qrcode.min.js': 'https://unpkg.com/html5-qrcode@2.3.8/html5-qrcode.min.js',
+}
+for _font in ('fa-brands-400', 'fa-regular-400', 'fa-solid-900', 'fa-v4compatibility'):
+    for _ext in ('woff2', 'ttf'):
+        VENDOR_ASSETS[f'fontawesome/webfonts/{_font}.{_ext}'] = f'{_FONT_AWESOME}/webfonts/{_font}.{_ext}'
+
+CSS_URL = re.compile(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)')
+
+_manifest = None
+_manifest_lock = threading.Lock()
+
+
+def load_manifest():
+    global _manifest
+    with _manifest_lock:
+        if _manifest is None:
+            try:
+                with open(MANIFEST_PATH, encoding='utf-8') as f:
+                    _manifest = json.load(f)
+            except FileNotFoundError:
+                _manifest = {}
+            except ValueError as e:
+                logging.error(f"Invalid asset manifest: {str(e)}")
+                _manifest = {}
+        return _manifest
+
+
+def asset_url(path):
+    """رابط الملف الثابت: النسخة ذات البصمة إن وجدت، وإلا الملف الأصلي أو رابط CDN للمكتبات غير المنسوخة"""
+    hashed = load_manifest().get(path)
+    if hashed:
+        return url_for('asset', filename=hashed)
+    if path.startswith('vendor/') and not os.path.exists(os.path.join(STATIC_DIR, path)):
+        cdn = VENDOR_ASSETS.get(path[len('vendor/'):])
+        if cdn:
+            return cdn
+    return url_for('static', filename=path)
+
+
+app.add_template_global(asset_url)
+
+
+def asset_file(filename, accept_encoding):
+    """اختيار النسخة المضغوطة المناسبة؛ يرجع (المسار، الترميز، نوع المحتوى) أو None"""
+    path = os.path.normpath(os.path.join(DIST_DIR, filename))
+    if not path.startswith(DIST_DIR + os.sep) or not os.path.isfile(path):
+        return None
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    accepted = {part.split(';')[0].strip() for part in (accept_encoding or '').split(',')}
+    for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if encoding in accepted and os.path.isfile(path + suffix):
+            return path + suffix, encoding, mimetype
+    return path, None, mimetype
+
+
+def _fingerprint(relative, data):
+    digest = hashlib.sha256(data).hexdigest()[:12]
+    root, ext = os.path.splitext(relative)
+    return f"{root}.{digest}{ext}"
+
+
+def _rewrite_css(relative, data, manifest):
+    """تحويل روابط url(...) النسبية في CSS إلى أسماء الملفات ذات البصمة"""
+    base = os.path.dirname(relative)
+
+    def replace(match):
+        quote, target = match.group(1), match.group(2)
+        if target.startswith(('data:', 'http:', 'https:', '/', '#')):
+            return match.group(0)
+        clean = target.split('?')[0].split('#')[0]
+        suffix = target[len(clean):]
+        resolved = os.path.normpath(os.path.join(base, clean)).replace(os.sep, '/')
+        hashed = manifest.get(resolved)
+        if not hashed:
+            return match.group(0)
+        new_target = os.path.relpath(hashed, base or '.').replace(os.sep, '/')
+        return f"url({quote}{new_target}{suffix}{quote})"
+
+    return CSS_URL.sub(replace, data.decode('utf-8')).encode('utf-8')
+
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+    if path.endswith(COMPRESSIBLE):
+        with open(path + '.gz', 'wb') as f:
+            f.write(gzip.compress(data, compresslevel=9, mtime=0))
+        if brotli is not None:
+            with open(path + '.br', 'wb') as f:
+                f.write(brotli.compress(data, quality=11))
+
+
+def build_assets():
+    """بناء static/dist وإرجاع manifest {المسار الأصلي: المسار ذو البصمة}"""
+    sources = []
+    for directory in SOURCE_DIRS:
+        for root, _, files in os.walk(os.path.join(STATIC_DIR, directory)):
+            for name in files:
+                full = os.path.join(root, name)
+                sources.append(os.path.relpath(full, STATIC_DIR).replace(os.sep, '/'))
+
+    shutil.rmtree(DIST_DIR, ignore_errors=True)
+    manifest = {}
+    # ملفات CSS أخيراً حتى تشير روابطها (الخطوط والصور) إلى الأسماء ذات البصمة
+    for relative in sorted(sources, key=lambda path: (path.endswith('.css'), path)):
+        with open(os.path.join(STATIC_DIR, relative), 'rb') as f:
+            data = f.read()
+        if relative.endswith('.css'):
+            data = _rewrite_css(relative, data, manifest)
+        hashed = _fingerprint(relative, data)
+        _write(os.path.join(DIST_DIR, hashed), data)
+        manifest[relative] = hashed
+
+    with open(MANIFEST_PATH, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+    global _manifest
+    with _manifest_lock:
+        _manifest = manifest
+    return manifest
+
+
+@app.cli.command('vendor-assets')
+def vendor_assets_command():
+    """Download the pinned third-party CSS/JS/fonts into static/vendor."""
+    for relative, url in VENDOR_ASSETS.items():
+        path = os.path.join(VENDOR_DIR, relative)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with urllib.request.urlopen(url, timeout=30) as response:
+            data = response.read()
+        with open(path, 'wb') as f:
+            f.write(data)
+        click.echo(f"{relative} ({len(data)} bytes)")
+
+
+@app.cli.command('build-assets')
+def build_assets_command():
+    """Fingerprint and precompress static files into static/dist."""
+    manifest = build_assets()
+    click.echo(f"Built {len(manifest)} assets into {DIST_DIR}"
+               + ("" if brotli else " (brotli not installed: gzip only)"))
@@ -0,0 +1,183 @@
+"""
+التحقق من هوية المستخدمين والأجهزة
+المتصفح يستخدم جلسة Flask، وأجهزة المسح ونقاط البيع تستخدم رمز API طويل الأمد في ترويسة Authorization
+الرموز تحفظ كبصمة HMAC سريعة (الرمز عشوائي وطويل فلا حاجة لـ pbkdf2) مع ذاكرة مؤقتة للتحقق
+"""
+
+import hashlib
+import hmac
+import logging
+import secrets
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+from functools import wraps
+
+import click
+from flask import current_app, g, jsonify, redirect, request, session, url_for
+
+from app import app, db
+from models import DeviceToken, User
+from branches import DEFAULT_BRANCH, branch_names
+
+TOKEN_PREFIX = 'mkt_'
+
+# مدة الاحتفاظ بنتيجة التحقق في الذاكرة؛ الإلغاء من عامل آخر يسري خلالها
+TOKEN_CACHE_TTL = 60
+
+# تحديث آخر استخدام مرة كل فترة بدلاً من الكتابة في كل طلب
+LAST_USED_INTERVAL = 300
+
+DeviceIdentity = namedtuple('DeviceIdentity', 'token_id name user_id username branch')
+
+
+def _token_key():
+    return (current_app.config.get('DEVICE_TOKEN_KEY') or current_app.secret_key).encode()
+
+
+def hash_token(token):
+    return hmac.new(_token_key(), token.encode(), hashlib.sha256).hexdigest()
+
+
+class DeviceTokenCache:
+    def __init__(self, ttl=TOKEN_CACHE_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def get(self, token_hash):
+        with self._lock:
+            entry = self._entries.get(token_hash)
+            if entry is None or entry[1] < time.monotonic():
+                self._entries.pop(token_hash, None)
+                return None
+            return entry[0]
+
+    def put(self, token_hash, identity):
+        with self._lock:
+            self._entries[token_hash] = (identity, time.monotonic() + self.ttl)
+
+    def evict(self, token_hash):
+        with self._lock:
+            self._entries.pop(token_hash, None)
+
+
+# ذاكرة التحقق العامة للعملية
+token_cache = DeviceTokenCache()
+
+_last_used = {}
+
+
+def issue_device_token(user, name, branch_code=None):
+    """إنشاء رمز جهاز جديد وإرجاع (السجل، الرمز) - الرمز لا يحفظ ولا يعرض إلا مرة واحدة"""
+    token = TOKEN_PREFIX + secrets.token_urlsafe(32)
+    device = DeviceToken(
+        name=name,
+        token_hash=hash_token(token),
+        user_id=user.id,
+        branch_code=branch_code
+    )
+    db.session.add(device)
+    db.session.commit()
+    return device, token
+
+
+def revoke_device_token(device):
+    """إلغاء رمز جهاز وحذفه من ذاكرة التحقق فوراً"""
+    if device.revoked_at is not None:
+        return False, "الرمز ملغي بالفعل"
+    device.revoked_at = datetime.utcnow()
+    db.session.commit()
+    token_cache.evict(device.token_hash)
+    return True, f"تم إلغاء رمز الجهاز {device.name}"
+
+
+def _load_identity(token_hash):
+    device = DeviceToken.query.filter_by(token_hash=token_hash, revoked_at=None).first()
+    if device is None:
+        return None
+    branch = device.branch_code or device.user.branch_code or DEFAULT_BRANCH
+    return DeviceIdentity(device.id, device.name, device.user_id, device.user.username, branch)
+
+
+def _touch(identity):
+    now = time.monotonic()
+    if now - _last_used.get(identity.token_id, 0) < LAST_USED_INTERVAL:
+        return
+    _last_used[identity.token_id] = now
+    try:
+        DeviceToken.query.filter_by(id=identity.token_id).update({'last_used_at': datetime.utcnow()})
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"خطأ في تحديث آخر استخدام للجهاز: {str(e)}")
+
+
+def authenticate_device(authorization):
+    """التحقق من ترويسة Authorization: Bearer <token> وإرجاع هوية الجهاز أو None"""
+    if not authorization or not authorization.startswith('Bearer '):
+        return None
+    token = authorization[7:].strip()
+    if not token.startswith(TOKEN_PREFIX):
+        return None
+
+    token_hash = hash_token(token)
+    identity = token_cache.get(token_hash)
+    if identity is None:
+        identity = _load_identity(token_hash)
+        if identity is None:
+            return None
+        token_cache.put(token_hash, identity)
+    _touch(identity)
+    return identity
+
+
+def login_required(view=None, *, api=False, devices=False):
+    """استبدال فحص الجلسة المكرر في كل مسار
+
+    api: الرد بـ 401 JSON بدلاً من التحويل لصفحة الدخول
+    devices: قبول رموز الأجهزة إلى جانب جلسة المتصفح
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            authorization = request.headers.get('Authorization')
+            if devices and authorization:
+                identity = authenticate_device(authorization)
+                if identity is not None:
+                    g.user_id = identity.user_id
+                    g.device = identity
+                    g.branch = identity.branch if identity.branch in branch_names() else DEFAULT_BRANCH
+                    return view(*args, **kwargs)
+            elif 'user_id' in session:
+                g.user_id = session['user_id']
+                return view(*args, **kwargs)
+
+            if api or request.accept_mimetypes.best == 'application/json':
+                return jsonify({'error': 'غير مصرح'}), 401
+            return redirect(url_for('login'))
+        return wrapped
+
+    return decorator(view) if view is not None else decorator
+
+
+@app.cli.command('assign-branch')
+@click.argument('username')
+@click.option('--branch', help='Branch code the user works in (default: unchanged).')
+@click.option('--head-office/--no-head-office', default=None,
+              help='Allow switching branches and consolidated reports (default: unchanged).')
+def assign_branch_command(username, branch, head_office):
+    """Set a user's branch and head-office access; takes effect at the next sign-in."""
+    user = User.query.filter_by(username=username).first()
+    if user is None:
+        raise click.ClickException(f"No user named {username}")
+    if branch is not None:
+        if branch not in branch_names():
+            raise click.ClickException(f"Unknown branch {branch}; configured: {', '.join(branch_names())}")
+        user.branch_code = None if branch == DEFAULT_BRANCH else branch
+    if head_office is not None:
+        user.head_office = head_office
+    db.session.commit()
+    click.echo(f"{user.username}: branch {user.branch_code or DEFAULT_BRANCH}, "
+               f"head office {'yes' if user.head_office else 'no'}")
@@ -0,0 +1,323 @@
+"""
+النسخ الاحتياطي أثناء العمل
+- SQLite: نسخة عبر backup API على دفعات صغيرة من الصفحات، فالكتابة (البيع) لا تنتظر إلا دفعة واحدة
+- كل نسخة تفحص بـ PRAGMA integrity_check ثم تضغط (gzip) وتحذف النسخ الأقدم من MARKET_BACKUP_KEEP
+- النسخة المطابقة لآخر نسخة (لم تتغير البيانات) لا تحفظ مرة أخرى
+- Postgres: pg_dump بصيغة custom (مضغوطة) يكتب مباشرة في الملف
+- أرشيفات المبيعات الشهرية وملفات PDF لتقارير Z لا تتغير، فتنسخ مرة واحدة إلى backups/archives و backups/z_reports
+- يوميات البيع (ومرفوضاتها) تتغير، فتحفظ في كل تشغيل كملف journals-<الوقت>.tar.gz
+
+    flask backup                    # نسخة الآن لكل قواعد البيانات
+    flask backup --interval 60      # نسخة كل 60 دقيقة (عملية تعمل باستمرار)
+    flask backups                   # عرض النسخ
+    flask restore <file>            # استرجاع نسخة (أوقف نقاط البيع أولاً)
+"""
+
+import glob
+import gzip
+import hashlib
+import logging
+import os
+import shutil
+import sqlite3
+import subprocess
+import tarfile
+import time
+from datetime import datetime
+from io import BytesIO
+
+import click
+import sqlalchemy as sa
+
+from app import app, db
+from branches import DEFAULT_BRANCH, bind_key, branch_context, branch_names
+
+BACKUP_DIR = os.environ.get('MARKET_BACKUP_DIR') or os.path.join(app.instance_path, 'backups')
+BACKUP_KEEP = int(os.environ.get('MARKET_BACKUP_KEEP', 14))
+
+# صفحات SQLite في كل خطوة (4 كيلوبايت للصفحة) والانتظار بين الخطوات
+PAGES_PER_STEP = 256
+STEP_SLEEP = 0.005
+
+
+def backup_targets():
+    """{الاسم: رابط قاعدة البيانات} - الفروع التي تشترك في نفس قاعدة Postgres تنسخ مرة واحدة"""
+    targets = {}
+    seen = set()
+    for code in branch_names():
+        engine = db.engine if code == DEFAULT_BRANCH else db.engines[bind_key(code)]
+        url = engine.url.render_as_string(hide_password=False)
+        if url not in seen:
+            seen.add(url)
+            targets[code] = engine.url
+    return targets
+
+
+def _snapshot_path(name, suffix):
+    return os.path.join(BACKUP_DIR, f"{name}-{datetime.now().strftime('%Y%m%d-%H%M%S')}{suffix}")
+
+
+def list_snapshots(name=None):
+    pattern = f"{name}-*" if name else '*'
+    return sorted(path for path in glob.glob(os.path.join(BACKUP_DIR, pattern))
+                  if path.endswith(('.db.gz', '.dump', '.tar.gz')))
+
+
+def _digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def integrity_check(path):
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        result = conn.execute('PRAGMA integrity_check').fetchone()[0]
+    finally:
+        conn.close()
+    return result == 'ok', result
+
+
+def online_copy(source_path, target_path, pages=PAGES_PER_STEP, sleep=STEP_SLEEP):
+    """نسخ قاعدة SQLite وهي تعمل؛ القفل يؤخذ لكل خطوة فقط"""
+    source = sqlite3.connect(source_path)
+    target = sqlite3.connect(target_path)
+    try:
+        source.backup(target, pages=pages, sleep=sleep)
+    finally:
+        target.close()
+        source.close()
+
+
+def backup_sqlite(name, url):
+    """يرجع (نجاح، رسالة)"""
+    source_path = url.database
+    temp_path = _snapshot_path(name, '.db.tmp')
+    try:
+        started = time.perf_counter()
+        online_copy(source_path, temp_path)
+        copy_ms = (time.perf_counter() - started) * 1000
+
+        ok, result = integrity_check(temp_path)
+        if not ok:
+            return False, f"[{name}] فشل فحص النسخة: {result}"
+
+        # نفس محتوى آخر نسخة: لا داعي لحفظها
+        digest = _digest(temp_path)
+        digest_path = os.path.join(BACKUP_DIR, f".{name}.sha256")
+        if os.path.exists(digest_path) and list_snapshots(name):
+            with open(digest_path) as f:
+                if f.read().strip() == digest:
+                    return True, f"[{name}] لا تغييرات منذ آخر نسخة"
+
+        final_path = temp_path[:-len('.tmp')] + '.gz'
+        with open(temp_path, 'rb') as src, gzip.open(final_path + '.part', 'wb', compresslevel=6) as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        os.replace(final_path + '.part', final_path)
+        with open(digest_path, 'w') as f:
+            f.write(digest)
+        return True, f"[{name}] {os.path.basename(final_path)} ({copy_ms:.0f} ms)"
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def backup_postgres(name, url):
+    """pg_dump مباشرة إلى الملف والتحقق منه بـ pg_restore --list"""
+    final_path = _snapshot_path(name, '.dump')
+    dsn = url.set(drivername='postgresql').render_as_string(hide_password=False)
+    try:
+        with open(final_path + '.part', 'wb') as out:
+            result = subprocess.run(['pg_dump', '--format=custom', '--dbname', dsn], stdout=out,
+                                    stderr=subprocess.PIPE)
+        if result.returncode != 0:
+            return False, f"[{name}] pg_dump: {result.stderr.decode(errors='replace').strip()}"
+        check = subprocess.run(['pg_restore', '--list', final_path + '.part'], capture_output=True)
+        if check.returncode != 0:
+            return False, f"[{name}] فشل فحص النسخة: {check.stderr.decode(errors='replace').strip()}"
+        os.replace(final_path + '.part', final_path)
+        return True, f"[{name}] {os.path.basename(final_path)}"
+    except OSError as e:
+        return False, f"[{name}] {str(e)}"
+    finally:
+        if os.path.exists(final_path + '.part'):
+            os.remove(final_path + '.part')
+
+
+def copy_once(source_path, target_path, check=False):
+    """نسخ ملف لا يتغير إذا لم يكن منسوخاً من قبل؛ يرجع True إذا نسخ الآن"""
+    if os.path.exists(target_path):
+        return False
+    os.makedirs(os.path.dirname(target_path), exist_ok=True)
+    try:
+        shutil.copyfile(source_path, target_path + '.part')
+        if check:
+            ok, result = integrity_check(target_path + '.part')
+            if not ok:
+                raise ValueError(f"فشل فحص {os.path.basename(source_path)}: {result}")
+        os.replace(target_path + '.part', target_path)
+    finally:
+        if os.path.exists(target_path + '.part'):
+            os.remove(target_path + '.part')
+    return True
+
+
+def backup_archives():
+    """نسخ أرشيفات المبيعات الجديدة (المسار من سجل الأرشيف، فتشمل الأرشيفات في مكانها القديم)"""
+    from models import SaleArchive
+    copied, missing = 0, 0
+    for code in branch_names():
+        with branch_context(code):
+            paths = db.session.scalars(sa.select(SaleArchive.path)).all()
+            db.session.remove()
+        for path in paths:
+            if not os.path.exists(path):
+                missing += 1
+                logging.error(f"Archive file missing, not backed up: {path}")
+                continue
+            copied += copy_once(path, os.path.join(BACKUP_DIR, 'archives', code, os.path.basename(path)), check=True)
+    if missing:
+        return False, f"[archives] {copied} نسخ جديدة، {missing} ملفات غير موجودة"
+    return True, f"[archives] {copied} نسخ جديدة"
+
+
+def backup_z_reports():
+    from day_close import Z_REPORT_DIR
+    copied = 0
+    for path in glob.glob(os.path.join(Z_REPORT_DIR, '*', '*.pdf')):
+        code = os.path.basename(os.path.dirname(path))
+        copied += copy_once(path, os.path.join(BACKUP_DIR, 'z_reports', code, os.path.basename(path)))
+    return True, f"[z_reports] {copied} نسخ جديدة"
+
+
+def backup_journals():
+    """لقطة من يوميات البيع وملفات المرفوضات؛ لا تحفظ إذا كانت كلها فارغة"""
+    from sale_journal import JOURNAL_DIR
+    files = {}
+    paths = glob.glob(os.path.join(JOURNAL_DIR, '*.log')) + glob.glob(os.path.join(JOURNAL_DIR, '*.rejected'))
+    for path in sorted(paths):
+        # القراءة كاملة أولاً: اليومية قد تفرغ أثناء النسخ، والسطر الأخير غير المكتمل يتجاهل عند الاسترجاع
+        with open(path, 'rb') as f:
+            files[os.path.basename(path)] = f.read()
+    if not any(files.values()):
+        return True, "[journals] لا توجد سجلات"
+
+    final_path = _snapshot_path('journals', '.tar.gz')
+    try:
+        with tarfile.open(final_path + '.part', 'w:gz') as tar:
+            for name, data in files.items():
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                info.mtime = time.time()
+                tar.addfile(info, BytesIO(data))
+        os.replace(final_path + '.part', final_path)
+    finally:
+        if os.path.exists(final_path + '.part'):
+            os.remove(final_path + '.part')
+    return True, f"[journals] {os.path.basename(final_path)}"
+
+
+def rotate(name, keep=BACKUP_KEEP):
+    for path in list_snapshots(name)[:-keep] if keep > 0 else []:
+        os.remove(path)
+
+
+def run_backups():
+    """نسخة لكل قاعدة بيانات ثم الأرشيفات وتقارير Z واليوميات؛ يرجع [(نجاح، رسالة)]"""
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    results = []
+    for name, url in backup_targets().items():
+        try:
+            if url.get_backend_name() == 'sqlite':
+                result = backup_sqlite(name, url)
+            elif url.get_backend_name() == 'postgresql':
+                result = backup_postgres(name, url)
+            else:
+                result = (False, f"[{name}] نوع قاعدة البيانات غير مدعوم: {url.get_backend_name()}")
+        except Exception as e:
+            result = (False, f"[{name}] {str(e)}")
+        if result[0]:
+            rotate(name)
+        else:
+            logging.error(f"Backup failed: {result[1]}")
+        results.append(result)
+
+    for name, backup_files in (('archives', backup_archives), ('z_reports', backup_z_reports),
+                               ('journals', backup_journals)):
+        try:
+            result = backup_files()
+        except Exception as e:
+            result = (False, f"[{name}] {str(e)}")
+        if not result[0]:
+            logging.error(f"Backup failed: {result[1]}")
+        results.append(result)
+    rotate('journals')
+    return results
+
+
+def restore_snapshot(path, name):
+    """استرجاع نسخة في قاعدة البيانات الحية؛ يرجع (نجاح، رسالة)"""
+    url = backup_targets().get(name)
+    if url is None:
+        return False, f"لا توجد قاعدة بيانات باسم {name}"
+
+    if path.endswith('.dump'):
+        dsn = url.set(drivername='postgresql').render_as_string(hide_password=False)
+        result = subprocess.run(['pg_restore', '--clean', '--if-exists', '--dbname', dsn, path], capture_output=True)
+        if result.returncode != 0:
+            return False, f"pg_restore: {result.stderr.decode(errors='replace').strip()}"
+        return True, f"تم استرجاع {os.path.basename(path)}"
+
+    temp_path = path[:-len('.gz')] + '.restore'
+    try:
+        with gzip.open(path, 'rb') as src, open(temp_path, 'wb') as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        ok, result = integrity_check(temp_path)
+        if not ok:
+            return False, f"النسخة تالفة: {result}"
+        # الكتابة فوق القاعدة الحية بنفس backup API (في خطوة واحدة حتى لا تظهر نسخة نصف مسترجعة)
+        db.engines[None if name == DEFAULT_BRANCH else bind_key(name)].dispose()
+        online_copy(temp_path, url.database, pages=-1, sleep=0)
+        return True, f"تم استرجاع {os.path.basename(path)}"
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+@app.cli.command('backup')
+@click.option('--interval', default=0, help='Repeat every N minutes instead of running once.')
+def backup_command(interval):
+    """Take verified, compressed snapshots of every database while the app keeps running."""
+    while True:
+        results = run_backups()
+        for success, message in results:
+            click.echo(message, err=not success)
+        if not interval:
+            if not all(success for success, _ in results):
+                raise SystemExit(1)
+            return
+        time.sleep(interval * 60)
+
+
+@app.cli.command('backups')
+def backups_command():
+    """List the stored snapshots."""
+    for path in list_snapshots():
+        size = os.path.getsize(path) / (1024 * 1024)
+        click.echo(f"{os.path.basename(path)}  {size:.1f} MB")
+
+
+@app.cli.command('restore')
+@click.argument('snapshot')
+@click.option('--database', default=None, help='Database name (defaults to the snapshot name prefix).')
+@click.confirmation_option(prompt='This overwrites the live database. Stop the tills first. Continue?')
+def restore_command(snapshot, database):
+    """Restore a snapshot into the live database after checking its integrity."""
+    path = snapshot if os.path.exists(snapshot) else os.path.join(BACKUP_DIR, snapshot)
+    name = database or os.path.basename(path).rsplit('-', 2)[0]
+    success, message = restore_snapshot(path, name)
+    click.echo(message, err=not success)
+    if not success:
+        raise SystemExit(1)
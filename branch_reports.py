@@ -0,0 +1,94 @@
+"""
+تقارير الإدارة المجمعة لكل الفروع
+كل فرع يحسب ملخصه داخل قسم بياناته (والأرشيفات الشهرية المتداخلة مع الفترة) بالتوازي ثم تدمج النتائج
+"""
+
+from datetime import timedelta
+
+from app import db
+from models import Product, Sale, SaleItem
+from branches import fan_out, branch_names
+from live_updates import LOW_STOCK_THRESHOLD
+from archive import archive_sessions
+
+
+def _period_rollup(session, start=None, end=None, with_totals=True):
+    """عدد المبيعات وإجماليها والأصناف حسب الفئة في الفترة (استعلامات تجميع فقط)"""
+    items = session.query(
+        Product.category,
+        db.func.coalesce(db.func.sum(SaleItem.quantity), 0),
+        db.func.coalesce(db.func.sum(SaleItem.total_price), 0)
+    ).join(Sale, Sale.id == SaleItem.sale_id).join(Product, Product.id == SaleItem.product_id)
+    sales = session.query(
+        db.func.count(Sale.id), db.func.coalesce(db.func.sum(Sale.total_amount), 0)
+    )
+
+    if start:
+        sales = sales.filter(Sale.sale_date >= start)
+        items = items.filter(Sale.sale_date >= start)
+    if end:
+        sales = sales.filter(Sale.sale_date <= end)
+        items = items.filter(Sale.sale_date <= end)
+
+    count, revenue = sales.one() if with_totals else (0, 0)
+    categories = {
+        category: {'quantity': int(quantity), 'revenue': float(total)}
+        for category, quantity, total in items.group_by(Product.category).all()
+    }
+    return count, float(revenue), categories
+
+
+def _archived_rollup(start=None, end=None):
+    """نفس الملخص من أرشيفات الأشهر المتداخلة مع الفترة
+
+    الشهر الداخل كله في الفترة يؤخذ عدده وإجماليه من سجل SaleArchive، والشهر الجزئي يحسب من ملفه؛
+    الفئات تحسب من الملف دائماً لأن السجل لا يحفظها
+    """
+    count, revenue, categories = 0, 0.0, {}
+    for archive, session in archive_sessions(start, end):
+        # period_end حصري و end آخر ثانية في اليوم
+        full = ((start is None or archive.period_start >= start) and
+                (end is None or archive.period_end - timedelta(seconds=1) <= end))
+        archived = _period_rollup(session, start, end, with_totals=not full)
+        if full:
+            archived = (archive.sale_count, archive.total_amount, archived[2])
+        count += archived[0]
+        revenue += archived[1]
+        _merge_categories(categories, archived[2])
+    return count, revenue, categories
+
+
+def _merge_categories(target, categories):
+    for category, row in categories.items():
+        merged = target.setdefault(category, {'quantity': 0, 'revenue': 0.0})
+        merged['quantity'] += row['quantity']
+        merged['revenue'] += row['revenue']
+
+
+def branch_rollup(start=None, end=None):
+    """ملخص مبيعات الفرع الحالي في الفترة المحددة (القاعدة الحية والأرشيفات)"""
+    count, revenue, categories = _period_rollup(db.session, start, end)
+    archived_count, archived_revenue, archived_categories = _archived_rollup(start, end)
+    _merge_categories(categories, archived_categories)
+    return {
+        'total_sales': count + archived_count,
+        'total_revenue': revenue + archived_revenue,
+        'items_sold': sum(row['quantity'] for row in categories.values()),
+        'categories': categories,
+        'low_stock_products': Product.query.filter(Product.quantity <= LOW_STOCK_THRESHOLD).count()
+    }
+
+
+def consolidated_report(start=None, end=None):
+    """تشغيل الملخص على كل الفروع بالتوازي ودمج النتائج"""
+    names = branch_names()
+    per_branch = fan_out(lambda code: branch_rollup(start, end), names)
+
+    totals = {'total_sales': 0, 'total_revenue': 0.0, 'items_sold': 0, 'low_stock_products': 0, 'categories': {}}
+    for rollup in per_branch.values():
+        for key in ('total_sales', 'total_revenue', 'items_sold', 'low_stock_products'):
+            totals[key] += rollup[key]
+        _merge_categories(totals['categories'], rollup['categories'])
+
+    branches = [dict(rollup, code=code, name=names[code]) for code, rollup in per_branch.items()]
+    return branches, totals
@@ -0,0 +1,178 @@
+"""
+دعم الفروع المتعددة
+كل فرع له قسم بيانات مستقل (ملف SQLite أو مخطط Postgres) للمنتجات والمبيعات
+والمستخدمون يبقون في قاعدة البيانات الرئيسية مع تحديد فرع كل مستخدم
+
+الإعداد عبر متغير البيئة MARKET_BRANCHES (JSON)، مثال:
+    {"alex": {"name": "فرع الإسكندرية"},
+     "giza": {"name": "فرع الجيزة", "url": "postgresql://market@db/market", "schema": "giza"}}
+الفرع بدون url يستخدم ملف market_<code>.db بجوار قاعدة البيانات الرئيسية
+و "replica_url" اختياري لنسخة Postgres للقراءة فقط تستخدمها التقارير (انظر replicas.py)
+"""
+
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import sqlalchemy as sa
+from flask import current_app, g, has_app_context
+from flask_sqlalchemy.session import Session
+
+# الفرع الافتراضي يستخدم قاعدة البيانات الرئيسية
+DEFAULT_BRANCH = 'main'
+DEFAULT_BRANCH_NAME = 'الفرع الرئيسي'
+
+# الجداول المقسمة حسب الفرع؛ باقي الجداول مشتركة في قاعدة البيانات الرئيسية
+BRANCH_TABLES = {'product', 'product_tombstone', 'sale', 'sale_item', 'sale_archive', 'data_version', 'customer',
+                 'day_close', 'price_change'}
+
+
+def bind_key(code):
+    return f"branch_{code}"
+
+
+def load_branches(basedir):
+    """قراءة إعداد الفروع وإرجاع (أسماء الفروع، إعدادات SQLALCHEMY_BINDS، روابط نسخ القراءة)"""
+    names = {DEFAULT_BRANCH: DEFAULT_BRANCH_NAME}
+    binds = {}
+    replicas = {}
+    if os.environ.get('MARKET_REPLICA_URL'):
+        replicas[DEFAULT_BRANCH] = os.environ['MARKET_REPLICA_URL']
+    raw = os.environ.get('MARKET_BRANCHES', '').strip()
+    if not raw:
+        return names, binds, replicas
+
+    try:
+        config = json.loads(raw)
+    except ValueError as e:
+        logging.error(f"Invalid MARKET_BRANCHES setting: {str(e)}")
+        return names, binds, replicas
+
+    for code, options in config.items():
+        if code == DEFAULT_BRANCH:
+            continue
+        options = options or {}
+        names[code] = options.get('name', code)
+        bind = {'url': options.get('url') or f"sqlite:///{os.path.join(basedir, f'market_{code}.db')}"}
+        if options.get('schema'):
+            # كل الجداول تكتب في مخطط الفرع دون تغيير النماذج
+            bind['execution_options'] = {'schema_translate_map': {None: options['schema']}}
+        binds[bind_key(code)] = bind
+        if options.get('replica_url'):
+            replicas[code] = options['replica_url']
+    return names, binds, replicas
+
+
+def current_branch():
+    """رمز الفرع الحالي للطلب أو المهمة"""
+    if has_app_context():
+        return g.get('branch', DEFAULT_BRANCH)
+    return DEFAULT_BRANCH
+
+
+def branch_names():
+    return current_app.config.get('MARKET_BRANCH_NAMES', {DEFAULT_BRANCH: DEFAULT_BRANCH_NAME})
+
+
+def _table_name(mapper, clause):
+    if mapper is not None:
+        return sa.inspect(mapper).local_table.name
+    if isinstance(clause, sa.Table):
+        return clause.name
+    if isinstance(clause, sa.UpdateBase) and isinstance(clause.table, sa.Table):
+        return clause.table.name
+    return None
+
+
+class BranchSession(Session):
+    """جلسة توجه جداول الفروع إلى قسم بيانات الفرع الحالي"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None:
+            code = current_branch()
+            table = _table_name(mapper, clause)
+            # الاستعلامات غير المرتبطة بجدول (مثل func) تذهب لقسم الفرع
+            shared = table is not None and table not in BRANCH_TABLES
+            if shared:
+                code = DEFAULT_BRANCH
+            # مسارات التقارير تقرأ بيانات الفرع من نسخة القراءة؛ الكتابة (flush أو UPDATE) والجداول
+            # المشتركة (المستخدمون، العمليات الخلفية) تبقى على الأساسية
+            if (not shared and has_app_context() and g.get('read_replica') and isinstance(clause, sa.Select)
+                    and not self._flushing):
+                from replicas import replica_engine
+                replica = replica_engine(code)
+                if replica is not None:
+                    return replica
+            if code != DEFAULT_BRANCH:
+                return self._db.engines[bind_key(code)]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def branch_engine(db, code):
+    return db.engine if code == DEFAULT_BRANCH else db.engines[bind_key(code)]
+
+
+def create_branch_schemas(db, upgrade_schema):
+    """إنشاء جداول الفروع في كل قسم بيانات وتحديثها"""
+    tables = [table for table in db.metadata.sorted_tables if table.name in BRANCH_TABLES]
+    for code in branch_names():
+        if code == DEFAULT_BRANCH:
+            continue
+        engine = branch_engine(db, code)
+        schema = (engine.get_execution_options().get('schema_translate_map') or {}).get(None)
+        if schema:
+            with engine.begin() as conn:
+                conn.execute(sa.schema.CreateSchema(schema, if_not_exists=True))
+        db.metadata.create_all(engine, tables=tables)
+        upgrade_schema(engine, tables)
+
+
+@contextmanager
+def branch_context(code):
+    """تشغيل كود خارج الطلب (مهمة أو خيط) على بيانات فرع معين"""
+    previous = g.get('branch', DEFAULT_BRANCH)
+    g.branch = code
+    try:
+        yield
+    finally:
+        g.branch = previous
+
+
+def fan_out(func, codes=None, max_workers=8):
+    """تشغيل func(code) على كل فرع بالتوازي وإرجاع {code: result}"""
+    app = current_app._get_current_object()
+    codes = list(codes or branch_names())
+    read_replica = g.get('read_replica', False)
+
+    def run(code):
+        with app.app_context():
+            g.branch = code
+            g.read_replica = read_replica
+            try:
+                return func(code)
+            finally:
+                from app import db
+                db.session.remove()
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(codes)) or 1) as executor:
+        results = executor.map(run, codes)
+        return dict(zip(codes, results))
+
+
+class BranchLocal:
+    """نسخة منفصلة من كائن التخزين المؤقت لكل فرع (التوقعات، الكتالوج، اللوحة)"""
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._instances = {}
+
+    def for_branch(self, code):
+        instance = self._instances.get(code)
+        if instance is None:
+            instance = self._instances.setdefault(code, self._factory(code))
+        return instance
+
+    def __getattr__(self, name):
+        return getattr(self.for_branch(current_branch()), name)
@@ -0,0 +1,192 @@
+"""
+إضافة المنتجات بالجملة
+- أكواد المنتجات تؤخذ من عداد في جدول id_sequence: كل عملية (عامل gunicorn) تحجز مجموعة أرقام مرة واحدة
+  وتوزعها من الذاكرة، فلا تتكرر الأكواد بين العمال ولا يحتاج كل منتج لقراءة من قاعدة البيانات
+- المنتجات تدخل بأمر INSERT واحد (executemany) في معاملة واحدة، ورموز QR تولد بعدها في عملية خلفية
+
+    flask bulk-create-products products.csv     # الأعمدة: name, price, quantity, category[, product_id]
+"""
+
+import csv
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+import click
+import sqlalchemy as sa
+from sqlalchemy.exc import IntegrityError
+
+from app import app, db
+from models import IdSequence, Product
+from branches import DEFAULT_BRANCH, branch_context, current_branch
+from render_cache import bump_versions
+
+# عدد الأرقام التي تحجزها العملية في كل مرة
+ID_BLOCK_SIZE = int(os.environ.get('MARKET_ID_BLOCK', 100))
+
+PRODUCT_ID_FORMAT = 'P{:07d}'
+
+# أقصى عدد منتجات في طلب واحد
+MAX_BULK_PRODUCTS = 5000
+
+# حجم كل جزء من الأكواد عند التحقق من وجودها (حد متغيرات SQLite)
+CODE_CHUNK = 500
+
+
+class BlockAllocator:
+    """توزيع أرقام متتالية من مجموعات محجوزة في جدول id_sequence"""
+
+    def __init__(self, name, block_size=ID_BLOCK_SIZE):
+        self.name = name
+        self.block_size = block_size
+        self.reset()
+
+    def reset(self):
+        # العملية الابنة بعد fork لا تستخدم المجموعة المحجوزة للأب
+        self._lock = threading.Lock()
+        self._next = self._end = 0
+
+    def _reserve(self, count):
+        """حجز count رقم في معاملة مستقلة؛ يرجع أول رقم محجوز"""
+        table = IdSequence.__table__
+        engine = db.session.get_bind(mapper=IdSequence)
+        for attempt in range(2):
+            try:
+                with engine.begin() as conn:
+                    updated = conn.execute(table.update().where(table.c.name == self.name)
+                                           .values(next_value=table.c.next_value + count)).rowcount
+                    if not updated:
+                        conn.execute(table.insert().values(name=self.name, next_value=1 + count))
+                        return 1
+                    # القراءة بعد التحديث في نفس المعاملة ترى قيمتنا نحن (الصف مقفل حتى commit)
+                    return conn.execute(sa.select(table.c.next_value).where(table.c.name == self.name)).scalar() - count
+            except IntegrityError:
+                # عمليتان أنشأتا العداد في نفس الوقت
+                if attempt:
+                    raise
+
+    def allocate(self, count):
+        values = []
+        with self._lock:
+            while len(values) < count:
+                if self._next >= self._end:
+                    size = max(self.block_size, count - len(values))
+                    self._next = self._reserve(size)
+                    self._end = self._next + size
+                take = min(count - len(values), self._end - self._next)
+                values.extend(range(self._next, self._next + take))
+                self._next += take
+        return values
+
+
+product_codes = BlockAllocator('product_id')
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=product_codes.reset)
+
+
+def existing_codes(codes):
+    taken = set()
+    for start in range(0, len(codes), CODE_CHUNK):
+        taken.update(db.session.execute(sa.select(Product.product_id)
+                                        .where(Product.product_id.in_(codes[start:start + CODE_CHUNK]))).scalars())
+    return taken
+
+
+def new_product_ids(count):
+    """أكواد منتجات جديدة؛ الأكواد المستخدمة بالفعل (من استيراد Excel مثلاً) تتخطى"""
+    codes = []
+    while len(codes) < count:
+        candidates = [PRODUCT_ID_FORMAT.format(value) for value in product_codes.allocate(count - len(codes))]
+        taken = existing_codes(candidates)
+        codes.extend(code for code in candidates if code not in taken)
+    return codes
+
+
+def validate_product(row, index):
+    """يرجع (قيم المنتج، رسالة الخطأ)"""
+    name = str(row.get('name') or '').strip()
+    category = str(row.get('category') or '').strip()
+    product_id = str(row.get('product_id') or '').strip() or None
+    if not name:
+        return None, f"صف {index}: اسم المنتج مطلوب"
+    if not category:
+        return None, f"صف {index}: الفئة مطلوبة"
+    try:
+        price = float(row.get('price'))
+        quantity = int(row.get('quantity') or 0)
+    except (TypeError, ValueError):
+        return None, f"صف {index}: السعر أو الكمية غير صحيحة"
+    if price < 0 or quantity < 0:
+        return None, f"صف {index}: السعر والكمية لا يكونان بالسالب"
+    return {'product_id': product_id, 'name': name, 'price': price, 'quantity': quantity,
+            'category': category}, None
+
+
+def bulk_create_products(rows, source=None, first_row=1):
+    """إضافة منتجات في معاملة واحدة؛ يرجع (الأكواد المضافة، الأخطاء) - عند أي خطأ لا يضاف شيء"""
+    if len(rows) > MAX_BULK_PRODUCTS:
+        return [], [f"الحد الأقصى {MAX_BULK_PRODUCTS} منتج في المرة الواحدة"]
+
+    products, errors = [], []
+    for index, row in enumerate(rows, start=first_row):
+        values, error = validate_product(row, index)
+        if error:
+            errors.append(error)
+        else:
+            products.append(values)
+
+    given = Counter(product['product_id'] for product in products if product['product_id'])
+    duplicates = {code for code, count in given.items() if count > 1} | existing_codes(list(given))
+    errors.extend(f"الكود {code} مستخدم بالفعل" for code in sorted(duplicates))
+    if errors or not products:
+        return [], errors
+
+    generated = iter(new_product_ids(sum(1 for product in products if not product['product_id'])))
+    now = datetime.utcnow()
+    for product in products:
+        product['product_id'] = product['product_id'] or next(generated)
+        product.update(date_added=now, created_at=now, updated_at=now, excel_source=source)
+
+    db.session.execute(sa.insert(Product), products)
+    # الإدخال بالجملة لا يمر على after_flush، فنزيد إصدار المنتجات هنا
+    bump_versions(db.session, {'products'})
+    db.session.commit()
+
+    from live_updates import dashboard_publisher
+    dashboard_publisher.refresh()
+    queue_missing_qr_codes()
+    return [product['product_id'] for product in products], []
+
+
+def queue_missing_qr_codes():
+    """توليد رموز QR للمنتجات التي ليس لها رمز في الخلفية"""
+    from jobs import job_runner
+    try:
+        job_runner.submit('regenerate_qr', {'missing_only': True}, dedupe_key=f"qr:{current_branch()}:missing")
+    except Exception as e:
+        logging.error(f"Could not queue QR generation: {str(e)}")
+
+
+@app.cli.command('bulk-create-products')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--branch', default=None, help='Branch code (defaults to the main branch).')
+def bulk_create_products_command(path, branch):
+    """Create products from a CSV file (name, price, quantity, category[, product_id])."""
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        rows = list(csv.DictReader(f))
+    with branch_context(branch or DEFAULT_BRANCH):
+        created = 0
+        started = time.perf_counter()
+        for start in range(0, len(rows), MAX_BULK_PRODUCTS):
+            codes, errors = bulk_create_products(rows[start:start + MAX_BULK_PRODUCTS], os.path.basename(path),
+                                                 first_row=start + 1)
+            for error in errors:
+                click.echo(error, err=True)
+            if errors:
+                raise SystemExit(1)
+            created += len(codes)
+        click.echo(f"Created {created} products in {(time.perf_counter() - started) * 1000:.0f} ms")
@@ -0,0 +1,220 @@
+"""
+صيغة الكتالوج الثنائية المضغوطة لأجهزة المسح المحمولة
+ملف عمودي بأطوال مسبقة مع فهرس مرتب لرموز المنتجات للبحث الثنائي
+لا يعتمد على التطبيق أو قاعدة البيانات حتى يمكن استخدامه كمكتبة عميل
+
+التخطيط (little-endian، كل كتلة تبدأ على حد 4 بايت):
+    الرأس:    magic 'MKCT' | version u16 | flags u16 | row_count u32 | column_count u16 | reserved u16
+    الدليل:   لكل عمود: name 16s | type u8 | pad 3 | offset u32 | length u32
+    الأعمدة:  مرتبة حسب product_id (ترتيب بايتات UTF-8)
+
+أنواع الأعمدة:
+    COL_U32 / COL_I32: مصفوفة أعداد بطول row_count
+    COL_STR:  إزاحات u32 (row_count + 1) ثم نصوص UTF-8 متتالية
+    COL_DICT: رموز u16 لكل صف، حشو إلى 4 بايت، عدد القاموس u32، ثم عمود COL_STR للقاموس
+"""
+
+import gzip
+import struct
+import sys
+import urllib.error
+import urllib.request
+from array import array
+
+MAGIC = b'MKCT'
+FORMAT_VERSION = 1
+
+COL_U32 = 1
+COL_I32 = 2
+COL_STR = 3
+COL_DICT = 4
+
+HEADER = struct.Struct('<4sHHIHH')
+DIRECTORY_ENTRY = struct.Struct('<16sB3xII')
+
+# الأعمدة بالترتيب المخزن؛ السعر بالقروش لتجنب الأعداد العشرية
+COLUMNS = (
+    ('product_id', COL_STR),
+    ('id', COL_U32),
+    ('name', COL_STR),
+    ('price_cents', COL_I32),
+    ('quantity', COL_I32),
+    ('category', COL_DICT),
+)
+
+
+class CatalogFormatError(ValueError):
+    pass
+
+
+def _pad4(data):
+    return data + b'\0' * (-len(data) % 4)
+
+
+def _int_array(typecode, values):
+    arr = array(typecode, values)
+    if sys.byteorder != 'little':
+        arr.byteswap()
+    return arr.tobytes()
+
+
+def _encode_strings(values):
+    encoded = [value.encode('utf-8') for value in values]
+    offsets = [0]
+    for item in encoded:
+        offsets.append(offsets[-1] + len(item))
+    return _int_array('I', offsets) + b''.join(encoded)
+
+
+def _encode_dict(values):
+    dictionary = {}
+    codes = [dictionary.setdefault(value, len(dictionary)) for value in values]
+    if len(dictionary) > 0xFFFF:
+        raise CatalogFormatError("too many distinct categories for a u16 dictionary")
+    return (_pad4(_int_array('H', codes))
+            + _int_array('I', [len(dictionary)])
+            + _encode_strings(list(dictionary)))
+
+
+def encode_catalog(products):
+    """products: تسلسل من (product_id, id, name, price, quantity, category)"""
+    rows = sorted(products, key=lambda row: row[0].encode('utf-8'))
+    columns = {
+        'product_id': _encode_strings([row[0] for row in rows]),
+        'id': _int_array('I', [row[1] for row in rows]),
+        'name': _encode_strings([row[2] for row in rows]),
+        'price_cents': _int_array('i', [int(round(row[3] * 100)) for row in rows]),
+        'quantity': _int_array('i', [row[4] for row in rows]),
+        'category': _encode_dict([row[5] or '' for row in rows]),
+    }
+
+    offset = HEADER.size + DIRECTORY_ENTRY.size * len(COLUMNS)
+    directory = []
+    blocks = []
+    for name, col_type in COLUMNS:
+        block = _pad4(columns[name])
+        directory.append(DIRECTORY_ENTRY.pack(name.encode('ascii'), col_type, offset, len(columns[name])))
+        blocks.append(block)
+        offset += len(block)
+
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, 0, len(rows), len(COLUMNS), 0)
+    return header + b''.join(directory) + b''.join(blocks)
+
+
+def _read_int_array(typecode, buffer, offset, count):
+    arr = array(typecode)
+    arr.frombytes(buffer[offset:offset + arr.itemsize * count])
+    if sys.byteorder != 'little':
+        arr.byteswap()
+    return arr
+
+
+class _StringColumn:
+    def __init__(self, buffer, offset, count):
+        self._buffer = buffer
+        self._offsets = _read_int_array('I', buffer, offset, count + 1)
+        self._data_start = offset + 4 * (count + 1)
+
+    def raw(self, index):
+        start = self._data_start + self._offsets[index]
+        end = self._data_start + self._offsets[index + 1]
+        return bytes(self._buffer[start:end])
+
+    def __getitem__(self, index):
+        return self.raw(index).decode('utf-8')
+
+
+class _DictColumn:
+    def __init__(self, buffer, offset, count):
+        self._codes = _read_int_array('H', buffer, offset, count)
+        dict_offset = offset + 2 * count + (-2 * count % 4)
+        dict_count = _read_int_array('I', buffer, dict_offset, 1)[0]
+        strings = _StringColumn(buffer, dict_offset + 4, dict_count)
+        self._values = [strings[i] for i in range(dict_count)]
+
+    def __getitem__(self, index):
+        return self._values[self._codes[index]]
+
+
+class CatalogReader:
+    """قراءة ملف الكتالوج الثنائي والبحث فيه دون تحويل كل الصفوف"""
+
+    def __init__(self, data):
+        if data[:2] == b'\x1f\x8b':
+            data = gzip.decompress(data)
+        self._buffer = memoryview(data)
+        if len(data) < HEADER.size:
+            raise CatalogFormatError("catalog file is truncated")
+        magic, version, _flags, self.row_count, column_count, _ = HEADER.unpack_from(self._buffer, 0)
+        if magic != MAGIC:
+            raise CatalogFormatError("not a catalog file")
+        if version != FORMAT_VERSION:
+            raise CatalogFormatError(f"unsupported catalog version {version}")
+
+        self._columns = {}
+        for i in range(column_count):
+            raw_name, col_type, offset, _length = DIRECTORY_ENTRY.unpack_from(
+                self._buffer, HEADER.size + i * DIRECTORY_ENTRY.size)
+            name = raw_name.rstrip(b'\0').decode('ascii')
+            if col_type == COL_STR:
+                self._columns[name] = _StringColumn(self._buffer, offset, self.row_count)
+            elif col_type == COL_DICT:
+                self._columns[name] = _DictColumn(self._buffer, offset, self.row_count)
+            elif col_type in (COL_U32, COL_I32):
+                typecode = 'I' if col_type == COL_U32 else 'i'
+                self._columns[name] = _read_int_array(typecode, self._buffer, offset, self.row_count)
+            # الأعمدة غير المعروفة تتجاهل للتوافق مع الإصدارات الأحدث
+
+    def __len__(self):
+        return self.row_count
+
+    def row(self, index):
+        columns = self._columns
+        return {
+            'id': columns['id'][index],
+            'product_id': columns['product_id'][index],
+            'name': columns['name'][index],
+            'price': columns['price_cents'][index] / 100,
+            'quantity': columns['quantity'][index],
+            'category': columns['category'][index],
+        }
+
+    def find_index(self, product_id):
+        """بحث ثنائي في فهرس product_id المرتب"""
+        target = str(product_id).encode('utf-8')
+        codes = self._columns['product_id']
+        low, high = 0, self.row_count
+        while low < high:
+            mid = (low + high) // 2
+            if codes.raw(mid) < target:
+                low = mid + 1
+            else:
+                high = mid
+        if low < self.row_count and codes.raw(low) == target:
+            return low
+        return None
+
+    def lookup(self, product_id):
+        index = self.find_index(product_id)
+        return None if index is None else self.row(index)
+
+    def __iter__(self):
+        for index in range(self.row_count):
+            yield self.row(index)
+
+
+def fetch_catalog(url, etag=None, headers=None, timeout=30):
+    """تحميل الكتالوج من الخادم؛ يعيد (None, etag) إذا لم يتغير منذ آخر تحميل"""
+    request = urllib.request.Request(url, headers=dict(headers or {}))
+    request.add_header('Accept-Encoding', 'gzip')
+    if etag:
+        request.add_header('If-None-Match', etag)
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            data = response.read()
+            new_etag = response.headers.get('ETag')
+    except urllib.error.HTTPError as e:
+        if e.code == 304:
+            return None, etag
+        raise
+    return CatalogReader(data), new_etag
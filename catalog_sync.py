@@ -0,0 +1,212 @@
+"""
+مزامنة كتالوج المنتجات مع نقاط البيع
+لقطة كاملة + تغييرات منذ مؤشر مبني على Product.updated_at وسجل المنتجات المحذوفة
+"""
+
+import gzip
+import hashlib
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from app import db
+from models import Product, ProductTombstone
+from catalog_format import encode_catalog
+from branches import BranchLocal
+
+try:
+    import zstandard
+except ImportError:  # الضغط بـ zstd اختياري
+    zstandard = None
+
+# رقم إصدار صيغة المزامنة - يتغير عند تغيير شكل البيانات المرسلة
+CATALOG_SYNC_VERSION = 1
+
+# مدة الاحتفاظ بسجل المحذوفات؛ الأجهزة الأقدم من ذلك تعيد تحميل اللقطة كاملة
+TOMBSTONE_RETENTION_DAYS = 30
+
+# هامش زمني لالتقاط المعاملات التي سُجلت قبل المؤشر لكنها حُفظت بعده
+SYNC_OVERLAP = timedelta(seconds=5)
+
+
+def serialize_product(product):
+    """تحويل المنتج لنفس الشكل الذي يعيده get_product_by_qr"""
+    return {
+        'id': product.id,
+        'product_id': product.product_id,
+        'name': product.name,
+        'price': product.price,
+        'quantity': product.quantity,
+        'category': product.category
+    }
+
+
+def format_cursor(timestamp):
+    return timestamp.isoformat() if timestamp else ''
+
+
+def parse_cursor(cursor):
+    """قراءة المؤشر المرسل من الجهاز (ValueError إذا كان غير صالح)"""
+    if not cursor:
+        return None
+    return datetime.fromisoformat(cursor)
+
+
+def build_snapshot():
+    """لقطة كاملة من الكتالوج مع المؤشر الحالي"""
+    products = Product.query.order_by(Product.id).all()
+    latest = max((product.updated_at for product in products if product.updated_at), default=None)
+    latest_tombstone = db.session.query(db.func.max(ProductTombstone.deleted_at)).scalar()
+    if latest_tombstone and (latest is None or latest_tombstone > latest):
+        latest = latest_tombstone
+
+    return {
+        'version': CATALOG_SYNC_VERSION,
+        'cursor': format_cursor(latest or datetime.utcnow()),
+        'products': [serialize_product(product) for product in products]
+    }
+
+
+def build_changes(since):
+    """التغييرات منذ المؤشر: المنتجات المعدلة ورموز المنتجات المحذوفة"""
+    horizon = datetime.utcnow() - timedelta(days=TOMBSTONE_RETENTION_DAYS)
+    if since is None or since < horizon:
+        # سجل المحذوفات لا يغطي هذه الفترة
+        return {'version': CATALOG_SYNC_VERSION, 'full_resync': True}
+
+    window_start = since - SYNC_OVERLAP
+    updated = Product.query.filter(Product.updated_at >= window_start).order_by(Product.updated_at).all()
+    deleted = ProductTombstone.query.filter(ProductTombstone.deleted_at >= window_start).all()
+
+    latest = since
+    for product in updated:
+        if product.updated_at and product.updated_at > latest:
+            latest = product.updated_at
+    for tombstone in deleted:
+        if tombstone.deleted_at > latest:
+            latest = tombstone.deleted_at
+
+    # منتج حُذف ثم أعيد إنشاؤه بنفس الرمز يبقى في قائمة التحديث فقط
+    live_codes = {product.product_id for product in updated}
+
+    return {
+        'version': CATALOG_SYNC_VERSION,
+        'full_resync': False,
+        'cursor': format_cursor(latest),
+        'updated': [serialize_product(product) for product in updated],
+        'deleted': [tombstone.product_id for tombstone in deleted
+                    if tombstone.product_id not in live_codes]
+    }
+
+
+def record_tombstone(product):
+    """تسجيل حذف المنتج ضمن نفس المعاملة وحذف السجلات القديمة"""
+    db.session.add(ProductTombstone(product_pk=product.id, product_id=product.product_id))
+    try:
+        horizon = datetime.utcnow() - timedelta(days=TOMBSTONE_RETENTION_DAYS)
+        ProductTombstone.query.filter(ProductTombstone.deleted_at < horizon).delete()
+    except Exception as e:
+        logging.error(f"خطأ في تنظيف سجل المنتجات المحذوفة: {str(e)}")
+
+
+class BinaryCatalogCache:
+    """ملف الكتالوج الثنائي في الذاكرة، يحدث من المنتجات المتغيرة فقط"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rows = {}                  # Product.id -> صف الكتالوج
+        self._product_watermark = None   # أحدث updated_at تمت قراءته
+        self._tombstone_watermark = None
+        self._encoded = {}               # الترميز -> (البيانات، ETag)
+        self._raw = None
+        self._digest = None
+
+    @staticmethod
+    def _row(product):
+        return (product.product_id, product.id, product.name,
+                product.price, product.quantity, product.category)
+
+    def _load_all(self):
+        products = db.session.execute(
+            db.select(Product.id, Product.product_id, Product.name, Product.price,
+                      Product.quantity, Product.category, Product.updated_at)
+        ).all()
+        self._rows = {product.id: self._row(product) for product in products}
+        self._product_watermark = max((p.updated_at for p in products if p.updated_at), default=None)
+        self._tombstone_watermark = db.session.query(db.func.max(ProductTombstone.deleted_at)).scalar()
+        return True
+
+    def _apply_changes(self):
+        """دمج المنتجات المعدلة والمحذوفة منذ آخر بناء؛ يعيد True عند وجود تغيير"""
+        if self._raw is None:
+            return self._load_all()
+
+        latest_product = db.session.query(db.func.max(Product.updated_at)).scalar()
+        latest_tombstone = db.session.query(db.func.max(ProductTombstone.deleted_at)).scalar()
+        if latest_product == self._product_watermark and latest_tombstone == self._tombstone_watermark:
+            return False
+
+        changed = False
+        if latest_tombstone != self._tombstone_watermark:
+            query = ProductTombstone.query
+            if self._tombstone_watermark:
+                query = query.filter(ProductTombstone.deleted_at >= self._tombstone_watermark - SYNC_OVERLAP)
+            for tombstone in query:
+                if self._rows.pop(tombstone.product_pk, None) is not None:
+                    changed = True
+            self._tombstone_watermark = latest_tombstone
+
+        if latest_product != self._product_watermark:
+            query = db.select(Product.id, Product.product_id, Product.name, Product.price,
+                              Product.quantity, Product.category)
+            if self._product_watermark:
+                query = query.where(Product.updated_at >= self._product_watermark - SYNC_OVERLAP)
+            for product in db.session.execute(query):
+                row = self._row(product)
+                if self._rows.get(product.id) != row:
+                    self._rows[product.id] = row
+                    changed = True
+            self._product_watermark = latest_product
+
+        return changed
+
+    def _encode(self, encoding):
+        if encoding == 'gzip':
+            data = gzip.compress(self._raw, compresslevel=6, mtime=0)
+        elif encoding == 'zstd':
+            data = zstandard.ZstdCompressor(level=10).compress(self._raw)
+        else:
+            data = self._raw
+        etag = f"{self._digest}-{encoding}" if encoding != 'identity' else self._digest
+        self._encoded[encoding] = (data, etag)
+        return self._encoded[encoding]
+
+    def get(self, encoding='identity'):
+        """إعادة (البيانات، ETag) بالترميز المطلوب"""
+        if encoding == 'zstd' and zstandard is None:
+            encoding = 'gzip'
+        with self._lock:
+            try:
+                if self._apply_changes():
+                    self._raw = encode_catalog(self._rows.values())
+                    self._digest = hashlib.sha1(self._raw).hexdigest()[:20]
+                    self._encoded = {}
+            except Exception as e:
+                logging.error(f"خطأ في تحديث الكتالوج الثنائي: {str(e)}")
+                if self._raw is None:
+                    raise
+            return self._encoded.get(encoding) or self._encode(encoding)
+
+
+# نسخة الكتالوج الثنائي العامة (نسخة لكل فرع)
+binary_catalog = BranchLocal(lambda code: BinaryCatalogCache())
+
+
+def negotiate_encoding(accept_encoding):
+    """اختيار أفضل ضغط يدعمه الجهاز"""
+    accepted = {item.split(';')[0].strip().lower() for item in (accept_encoding or '').split(',')}
+    if 'zstd' in accepted and zstandard is not None:
+        return 'zstd'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return 'identity'
@@ -0,0 +1,131 @@
+"""
+دليل العملاء
+- كل عميل يعرف برقم هاتفه بعد توحيده (أرقام فقط، الصيغة المحلية 01xxxxxxxxx)
+- الاسم يحفظ أيضاً بصيغة موحدة (بدون تشكيل، أ/إ/آ ← ا، ة ← ه، ى ← ي) للبحث ببداية الاسم عبر الفهرس
+- عدد المشتريات وإجماليها يحدثان مع كل بيع، فصفحة العميل لا تحتاج لجمع كل مبيعاته
+"""
+
+import re
+
+import click
+import sqlalchemy as sa
+
+from app import app, db
+from models import Customer, Sale
+from branches import branch_context, branch_names
+
+SEARCH_LIMIT = 10
+
+_TASHKEEL = re.compile('[\u0610-\u061a\u0640\u064b-\u065f\u0670\u06d6-\u06ed]')
+_LETTERS = str.maketrans({
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا',
+    'ى': 'ي', 'ئ': 'ي', 'ؤ': 'و', 'ة': 'ه',
+})
+_DIGITS = str.maketrans('٠١٢٣٤٥٦٧٨٩۰۱۲۳۴۵۶۷۸۹', '01234567890123456789')
+
+# أعلى حرف ممكن، لتحويل البحث بالبداية إلى نطاق على الفهرس
+_PREFIX_END = '\U0010ffff'
+
+
+def normalize_name(name):
+    """صيغة الاسم المستخدمة في البحث"""
+    name = _TASHKEEL.sub('', name or '').translate(_LETTERS).lower()
+    return ' '.join(name.split())
+
+
+def normalize_phone(phone):
+    """أرقام الهاتف فقط بالصيغة المحلية (+20 / 0020 تحذف)"""
+    digits = re.sub(r'\D', '', (phone or '').translate(_DIGITS))
+    if digits.startswith('00'):
+        digits = digits[2:]
+    if digits.startswith('20') and len(digits) == 12:
+        digits = '0' + digits[2:]
+    return digits
+
+
+def find_or_create_customer(session, name, phone):
+    """العميل صاحب رقم الهاتف (ينشأ عند أول بيع)؛ البيع بدون رقم هاتف لا يربط بعميل"""
+    phone_key = normalize_phone(phone)
+    if not phone_key:
+        return None
+    customer = session.scalars(sa.select(Customer).where(Customer.phone_key == phone_key)).first()
+    if customer is None:
+        customer = Customer(name=(name or '').strip() or phone_key, name_key=normalize_name(name) or phone_key,
+                            phone=phone.strip(), phone_key=phone_key)
+        session.add(customer)
+    elif name and customer.name == customer.phone_key:
+        # عميل سجل برقمه فقط ثم عرف اسمه
+        customer.name = name.strip()
+        customer.name_key = normalize_name(name)
+    return customer
+
+
+def record_purchase(customer, sale):
+    """تحديث إجماليات العميل داخل معاملة البيع (تعبيرات SQL حتى لا تضيع زيادات متزامنة)"""
+    sale.customer = customer
+    if customer.id is None:
+        customer.sale_count = 1
+        customer.total_spent = sale.total_amount
+        customer.first_purchase_at = sale.sale_date
+    else:
+        customer.sale_count = Customer.sale_count + 1
+        customer.total_spent = Customer.total_spent + sale.total_amount
+    customer.last_purchase_at = sale.sale_date
+
+
+def search_customers(query, limit=SEARCH_LIMIT):
+    """الإكمال التلقائي: بداية رقم الهاتف إذا كان البحث أرقاماً، وإلا بداية الاسم"""
+    phone_key = normalize_phone(query)
+    if phone_key and phone_key == re.sub(r'\s', '', query.translate(_DIGITS)).lstrip('+'):
+        column, prefix = Customer.phone_key, phone_key
+    else:
+        column, prefix = Customer.name_key, normalize_name(query)
+    if not prefix:
+        return []
+    # نطاق بدلاً من LIKE حتى يستخدم الفهرس في كل قواعد البيانات
+    return (Customer.query
+            .filter(column >= prefix, column < prefix + _PREFIX_END)
+            .order_by(Customer.last_purchase_at.desc())
+            .limit(limit)
+            .all())
+
+
+def customer_payload(customer):
+    return {
+        'id': customer.id,
+        'name': customer.name,
+        'phone': customer.phone,
+        'sale_count': customer.sale_count,
+        'total_spent': customer.total_spent,
+    }
+
+
+def backfill_customers(batch_size=1000):
+    """ربط المبيعات السابقة (ذات رقم هاتف) بالعملاء للفرع الحالي؛ يرجع عدد المبيعات المربوطة"""
+    linked = 0
+    last_id = 0
+    while True:
+        sales = (Sale.query
+                 .filter(Sale.id > last_id, Sale.customer_id.is_(None), Sale.customer_phone.isnot(None))
+                 .order_by(Sale.id)
+                 .limit(batch_size)
+                 .all())
+        if not sales:
+            return linked
+        last_id = sales[-1].id
+        for sale in sales:
+            customer = find_or_create_customer(db.session, sale.customer_name, sale.customer_phone)
+            if customer is not None:
+                record_purchase(customer, sale)
+                linked += 1
+        db.session.commit()
+
+
+@app.cli.command('backfill-customers')
+@click.option('--branch', default=None, help='Branch code (defaults to every branch).')
+def backfill_customers_command(branch):
+    """Create customers from past sales and link those sales to them."""
+    for code in ([branch] if branch else list(branch_names())):
+        with branch_context(code):
+            click.echo(f"[{code}] linked {backfill_customers()} sales")
+            db.session.remove()
@@ -0,0 +1,210 @@
+"""
+إغلاق اليوم وتقرير Z
+- إغلاق يوم انتهى يحسب إجمالياته مرة واحدة (حسب طريقة الدفع والفئة والكاشير، عدد الأصناف، أول وآخر فاتورة)
+  ويحفظها في سجل DayClose لا يعدل ولا يحذف، مع نسخة PDF
+- تقارير الأيام المغلقة تعرض من هذا السجل بدلاً من جمع المبيعات من جديد، وتخزن في المتصفح بلا انتهاء
+- أي تعديل على مبيعات يوم مغلق يرفض (إلا تاريخ الطباعة وربط العميل)
+
+اليوم هنا هو التاريخ المخزن في Sale.sale_date (UTC)، ولا يغلق إلا بعد انتهائه
+"""
+
+import hashlib
+import json
+import logging
+import os
+from datetime import date, datetime, timedelta
+
+import click
+import sqlalchemy as sa
+from sqlalchemy.exc import IntegrityError
+
+from app import app, db
+from models import DayClose, Product, Sale, SaleItem, User
+from branches import BranchSession, branch_context, branch_names, current_branch
+
+Z_REPORT_DIR = os.path.join(app.instance_path, 'z_reports')
+
+# أعمدة يسمح بتغييرها في مبيعات يوم مغلق (لا تغير الأرقام)
+EDITABLE_AFTER_CLOSE = {'print_date', 'invoice_path', 'customer_id'}
+
+
+class DayClosedError(ValueError):
+    pass
+
+
+def day_range(business_date):
+    start = datetime.combine(business_date, datetime.min.time())
+    return start, start + timedelta(days=1)
+
+
+def build_report(business_date):
+    """إجماليات اليوم من المبيعات (للفرع الحالي)"""
+    start, end = day_range(business_date)
+    in_day = sa.and_(Sale.sale_date >= start, Sale.sale_date < end)
+
+    sale_count, total_amount, first_sale_id, last_sale_id = db.session.execute(
+        sa.select(sa.func.count(Sale.id), sa.func.coalesce(sa.func.sum(Sale.total_amount), 0),
+                  sa.func.min(Sale.id), sa.func.max(Sale.id)).where(in_day)).one()
+    item_count = db.session.execute(
+        sa.select(sa.func.coalesce(sa.func.sum(SaleItem.quantity), 0)).join(Sale).where(in_day)).scalar()
+
+    payment = sa.func.coalesce(Sale.payment_method, 'نقدي')
+    by_payment = db.session.execute(
+        sa.select(payment, sa.func.count(Sale.id), sa.func.sum(Sale.total_amount))
+        .where(in_day).group_by(payment).order_by(payment)).all()
+
+    category = sa.func.coalesce(Product.category, 'غير مصنف')
+    by_category = db.session.execute(
+        sa.select(category, sa.func.sum(SaleItem.quantity), sa.func.sum(SaleItem.total_price))
+        .select_from(SaleItem).join(Sale).outerjoin(Product, Product.id == SaleItem.product_id)
+        .where(in_day).group_by(category).order_by(sa.func.sum(SaleItem.total_price).desc())).all()
+
+    by_cashier = db.session.execute(
+        sa.select(Sale.cashier_id, sa.func.count(Sale.id), sa.func.sum(Sale.total_amount))
+        .where(in_day).group_by(Sale.cashier_id).order_by(Sale.cashier_id)).all()
+    # المستخدمون في قاعدة البيانات الرئيسية، فأسماؤهم تقرأ باستعلام منفصل
+    cashier_ids = [cashier_id for cashier_id, _, _ in by_cashier if cashier_id is not None]
+    usernames = dict(db.session.execute(sa.select(User.id, User.username).where(User.id.in_(cashier_ids))).all()) \
+        if cashier_ids else {}
+
+    return {
+        'business_date': business_date.isoformat(),
+        'branch': current_branch(),
+        'sale_count': sale_count,
+        'item_count': int(item_count),
+        'total_amount': round(float(total_amount), 2),
+        'first_sale_id': first_sale_id,
+        'last_sale_id': last_sale_id,
+        'by_payment': [{'method': method, 'sale_count': count, 'total': round(total, 2)}
+                       for method, count, total in by_payment],
+        'by_category': [{'category': name, 'quantity': int(quantity), 'total': round(total, 2)}
+                        for name, quantity, total in by_category],
+        'by_cashier': [{'cashier_id': cashier_id,
+                        'cashier': usernames.get(cashier_id, 'غير محدد' if cashier_id is None else f'#{cashier_id}'),
+                        'sale_count': count, 'total': round(total, 2)}
+                       for cashier_id, count, total in by_cashier],
+    }
+
+
+def z_report_pdf_path(close):
+    return os.path.join(Z_REPORT_DIR, current_branch(), f"z_{close.business_date.isoformat()}.pdf")
+
+
+def z_report_pdf(close):
+    """ملف PDF لتقرير Z؛ يرسم مرة واحدة من السجل الثابت ثم يعاد استخدامه"""
+    path = z_report_pdf_path(close)
+    if not os.path.exists(path):
+        from utils import generate_z_report_pdf
+        generate_z_report_pdf(json.loads(close.report), path + '.part')
+        os.replace(path + '.part', path)
+    return path
+
+
+def close_day(business_date, user_id=None):
+    """إغلاق يوم منتهٍ وحفظ تقرير Z؛ يرجع (نجاح، رسالة)"""
+    if business_date >= datetime.utcnow().date():
+        return False, "لا يمكن إغلاق يوم لم ينته بعد"
+    if DayClose.query.filter_by(business_date=business_date).first():
+        return False, f"يوم {business_date} مغلق بالفعل"
+
+    # مبيعات اليومية التي لم تدخل قاعدة البيانات بعد يجب أن تدخل قبل حساب الإجماليات:
+    # يومية هذه العملية، ثم يوميات عمليات توقفت (حتى لو كانت اليومية معطلة الآن)
+    from sale_journal import journal_enabled, sale_journal
+    journal = sale_journal.for_branch(current_branch())
+    if journal_enabled():
+        journal.drain()
+    journal.recover()
+    # يوميات عمليات أخرى ما زالت تعمل: لا يغلق اليوم قبل أن تدخل مبيعاته
+    pending = journal.unapplied_sales(db.session, business_date)
+    if pending:
+        return False, f"{pending} فاتورة من يوم {business_date} لم تدخل قاعدة البيانات بعد، أعد المحاولة بعد قليل"
+
+    report = build_report(business_date)
+    report_json = json.dumps(report, ensure_ascii=False, sort_keys=True)
+    close = DayClose(
+        business_date=business_date,
+        closed_by=user_id,
+        sale_count=report['sale_count'],
+        item_count=report['item_count'],
+        total_amount=report['total_amount'],
+        first_sale_id=report['first_sale_id'],
+        last_sale_id=report['last_sale_id'],
+        report=report_json,
+        checksum=hashlib.sha256(report_json.encode('utf-8')).hexdigest()
+    )
+    db.session.add(close)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return False, f"يوم {business_date} مغلق بالفعل"
+
+    try:
+        z_report_pdf(close)
+    except Exception as e:
+        # السجل هو المرجع؛ ملف PDF يعاد إنشاؤه عند أول تحميل
+        logging.error(f"Z-report PDF for {business_date} failed: {str(e)}")
+    return True, f"تم إغلاق يوم {business_date}: {close.sale_count} فاتورة بإجمالي {close.total_amount:.2f} جنيه"
+
+
+def unclosed_days(limit=31):
+    """الأيام المنتهية التي بها مبيعات ولم تغلق بعد (الأحدث أولاً)"""
+    today = datetime.utcnow().date()
+    day = sa.func.date(Sale.sale_date)
+    rows = db.session.execute(sa.select(day).where(Sale.sale_date < day_range(today)[0])
+                              .group_by(day).order_by(day.desc()).limit(limit)).scalars()
+    days = [value if isinstance(value, date) else date.fromisoformat(value) for value in rows]
+    if not days:
+        return []
+    closed = set(db.session.execute(sa.select(DayClose.business_date)
+                                    .where(DayClose.business_date.in_(days))).scalars())
+    return [value for value in days if value not in closed]
+
+
+@sa.event.listens_for(DayClose, 'before_update')
+@sa.event.listens_for(DayClose, 'before_delete')
+def _day_close_is_immutable(mapper, connection, target):
+    raise DayClosedError("تقرير إغلاق اليوم لا يعدل ولا يحذف")
+
+
+@sa.event.listens_for(BranchSession, 'before_flush')
+def _block_closed_day_writes(session, flush_context, instances):
+    """رفض تغيير مبيعات يوم مغلق؛ مبيعات اليوم الحالي لا تحتاج أي استعلام"""
+    today = datetime.utcnow().date()
+    dates = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, SaleItem):
+            sale = obj.sale
+        elif isinstance(obj, Sale):
+            sale = obj
+            if obj in session.dirty and obj not in session.deleted:
+                state = sa.inspect(obj)
+                # الأعمدة فقط: تغيير علاقة (sale.customer) يظهر في عمودها (customer_id) عند flush،
+                # وتغيير الأصناف يفحص من كائنات SaleItem نفسها
+                changed = {attr.key for attr in state.mapper.column_attrs
+                           if state.attrs[attr.key].history.has_changes()}
+                if changed <= EDITABLE_AFTER_CLOSE:
+                    continue
+        else:
+            continue
+        if sale is not None and sale.sale_date is not None and sale.sale_date.date() < today:
+            dates.add(sale.sale_date.date())
+    if not dates:
+        return
+    closed = session.execute(sa.select(DayClose.business_date).where(DayClose.business_date.in_(dates))).scalars().first()
+    if closed is not None:
+        raise DayClosedError(f"يوم {closed} مغلق ولا يمكن تعديل مبيعاته")
+
+
+@app.cli.command('close-days')
+@click.option('--date', 'business_date', default=None, help='Close this date (YYYY-MM-DD) instead of every open day.')
+@click.option('--branch', default=None, help='Branch code (defaults to every branch).')
+def close_days_command(business_date, branch):
+    """Close finished business days and store their Z-reports."""
+    for code in ([branch] if branch else list(branch_names())):
+        with branch_context(code):
+            days = [date.fromisoformat(business_date)] if business_date else sorted(unclosed_days(limit=366))
+            for day in days:
+                success, message = close_day(day)
+                click.echo(f"[{code}] {message}", err=not success)
+            db.session.remove()
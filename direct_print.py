@@ -7,28 +7,35 @@ import subprocess
 import platform
 import os
 import logging
-import tempfile
-from datetime import datetime
-from escpos.printer import Usb, Serial, Network, File
-from escpos.exceptions import Error as EscposError
-import charset_normalizer
+
+from print_transport import print_transport, send_to_printer
+
+# صفحات الترميز العربية في ملفات تعريف طابعات ESC/POS
+ARABIC_CODEPAGES = ('CP864', 'CP720', 'CP1256', 'ISO_8859-6')
 
 class DirectPrintSystem:
     def __init__(self):
         self.system = platform.system()
         self.arabic_supported = False
         self.printer = None
+        # raster: الإيصال الحراري يرسم كصورة (العربية صحيحة على أي طابعة)، text: نص خام
+        self.receipt_mode = os.environ.get('MARKET_RECEIPT_MODE', 'raster')
         
     def detect_arabic_support(self, test_text="مرحبا"):
         """كشف دعم اللغة العربية في الطابعة"""
+        # الطباعة عبر نظام التشغيل تدعم UTF-8
+        if self.printer is None:
+            return True
+        # الطابعة الحرارية تحتاج صفحة ترميز عربية في ملف تعريفها
+        # ملف التعريف في python-escpos يرفع KeyError للخصائص غير الموجودة بدلاً من AttributeError
         try:
-            # اختبار تشفير النص العربي
-            arabic_bytes = test_text.encode('utf-8')
-            # إذا تم التشفير بنجاح، فالطابعة تدعم UTF-8
+            codepages = self.printer.profile.get_code_pages() or {}
+        except (KeyError, AttributeError):
+            codepages = {}
+        if any(codepage in codepages for codepage in ARABIC_CODEPAGES):
             return True
-        except UnicodeEncodeError:
-            logging.warning("الطابعة لا تدعم UTF-8، سيتم استخدام النسخة الإنجليزية")
-            return False
+        logging.warning("الطابعة لا تدعم صفحة ترميز عربية، سيتم استخدام النسخة الإنجليزية")
+        return False
     
     def find_printers(self):
         """العثور على الطابعات المتاحة"""
@@ -62,6 +69,10 @@ class DirectPrintSystem:
     
     def setup_thermal_printer(self, printer_type="usb", **kwargs):
         """إعداد طابعة حرارية ESC/POS"""
+        # مكتبة escpos (ومعها pyusb و pyserial) تحمل عند أول إعداد للطابعة فقط
+        from escpos.printer import Usb, Serial, Network, File
+        from escpos.exceptions import Error as EscposError
+        
         try:
             if printer_type == "usb":
                 # USB thermal printer
@@ -192,16 +203,25 @@ class DirectPrintSystem:
             return False, "لم يتم إعداد الطابعة"
             
         try:
+            if self.receipt_mode == 'raster':
+                # رسم الإيصال كصورة نقطية وإرساله بأوامر ESC/POS النقطية
+                from receipt_raster import receipt_renderer, receipt_lines
+                image = receipt_renderer.render(receipt_lines(sale_data))
+                logging.debug("طباعة الفاتورة كصورة (%.1f ms)", receipt_renderer.last_render_ms)
+                self.printer.image(image, impl='bitImageRaster')
+                self.printer.cut()
+                return True, "تم طباعة الفاتورة بنجاح"
+            
             # كشف دعم العربية
             self.arabic_supported = self.detect_arabic_support()
             
             # إنشاء النص حسب دعم اللغة
             if self.arabic_supported:
                 receipt_text = self.generate_arabic_invoice(sale_data)
-                logging.info("طباعة الفاتورة بالعربية")
+                logging.debug("طباعة الفاتورة بالعربية")
             else:
                 receipt_text = self.generate_english_invoice(sale_data)
-                logging.info("طباعة الفاتورة بالإنجليزية")
+                logging.debug("طباعة الفاتورة بالإنجليزية")
             
             # طباعة الإيصال
             self.printer.text(receipt_text)
@@ -223,32 +243,19 @@ class DirectPrintSystem:
             if self.arabic_supported:
                 invoice_text = self.generate_arabic_invoice(sale_data)
                 encoding = 'utf-8'
-                logging.info("طباعة الفاتورة بالعربية")
+                logging.debug("طباعة الفاتورة بالعربية")
             else:
                 invoice_text = self.generate_english_invoice(sale_data)
                 encoding = 'ascii'
-                logging.info("طباعة الفاتورة بالإنجليزية")
-            
-            # إنشاء ملف مؤقت
-            with tempfile.NamedTemporaryFile(mode='w', delete=False, 
-                                           encoding=encoding, suffix='.txt') as temp_file:
-                temp_file.write(invoice_text)
-                temp_file_path = temp_file.name
-            
-            # طباعة الملف حسب نظام التشغيل
-            success = False
-            if self.system == "Windows":
-                success = self._print_windows(temp_file_path, printer_name)
-            elif self.system == "Linux":
-                success = self._print_linux(temp_file_path, printer_name)
-            elif self.system == "Darwin":  # macOS
-                success = self._print_macos(temp_file_path, printer_name)
+                logging.debug("طباعة الفاتورة بالإنجليزية")
             
-            # حذف الملف المؤقت
-            os.unlink(temp_file_path)
+            # إرسال النص مباشرة لأمر الطباعة بدون ملف مؤقت
+            result = send_to_printer(invoice_text.encode(encoding, errors='replace'), printer_name)
             
-            if success:
+            if result.success:
                 return True, "تم إرسال الفاتورة للطباعة"
+            elif result.timed_out:
+                return False, "انتهت مهلة إرسال الفاتورة للطباعة"
             else:
                 return False, "فشل في إرسال الفاتورة للطباعة"
                 
@@ -256,57 +263,14 @@ class DirectPrintSystem:
             logging.error(f"خطأ في الطباعة: {str(e)}")
             return False, f"خطأ في الطباعة: {str(e)}"
     
-    def _print_windows(self, file_path, printer_name=None):
-        """طباعة على Windows"""
-        try:
-            if printer_name:
-                cmd = ["print", f"/D:{printer_name}", file_path]
-            else:
-                cmd = ["print", file_path]
-            
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            return result.returncode == 0
-            
-        except Exception as e:
-            logging.error(f"Windows print error: {str(e)}")
-            return False
-    
-    def _print_linux(self, file_path, printer_name=None):
-        """طباعة على Linux"""
-        try:
-            if printer_name:
-                cmd = ["lp", "-d", printer_name, file_path]
-            else:
-                cmd = ["lp", file_path]
-            
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            return result.returncode == 0
-            
-        except Exception as e:
-            logging.error(f"Linux print error: {str(e)}")
-            return False
-    
-    def _print_macos(self, file_path, printer_name=None):
-        """طباعة على macOS"""
-        try:
-            if printer_name:
-                cmd = ["lpr", "-P", printer_name, file_path]
-            else:
-                cmd = ["lpr", file_path]
-            
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            return result.returncode == 0
-            
-        except Exception as e:
-            logging.error(f"macOS print error: {str(e)}")
-            return False
-    
     def get_system_info(self):
         """معلومات النظام والطابعات"""
         return {
             "system": self.system,
             "printers": self.find_printers(),
-            "arabic_support": self.arabic_supported
+            "arabic_support": self.arabic_supported or self.receipt_mode == 'raster',
+            "receipt_mode": self.receipt_mode,
+            "print_transport": print_transport.name
         }
 
 # إنشاء مثيل النظام العام
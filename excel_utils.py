@@ -1,12 +1,17 @@
-import pandas as pd
 import os
 from datetime import datetime
 from models import Product, db
 from utils import generate_qr_code
+from read_models import product_rows, product_count
 import logging
 
-def import_products_from_excel(file_path):
-    """Import products from Excel file"""
+def import_products_from_excel(file_path, progress=None):
+    """Import products from Excel file
+
+    progress: optional jobs.JobProgress; its checkpoints commit the rows imported so far
+    """
+    import pandas as pd
+    
     try:
         # Read Excel file
         df = pd.read_excel(file_path)
@@ -23,6 +28,9 @@ def import_products_from_excel(file_path):
         error_count = 0
         error_messages = []
         
+        if progress:
+            progress.start(len(df))
+        
         for index, row in df.iterrows():
             try:
                 # Check if product already exists
@@ -66,7 +74,12 @@ def import_products_from_excel(file_path):
             except Exception as e:
                 error_count += 1
                 error_messages.append(f"السطر {index + 2}: {str(e)}")
+                if progress:
+                    progress.advance(error=error_messages[-1])
                 continue
+            
+            if progress:
+                progress.advance()
         
         # Commit all changes
         db.session.commit()
@@ -80,12 +93,16 @@ def import_products_from_excel(file_path):
         return True, result_message
         
     except Exception as e:
+        if progress and isinstance(e, progress.interrupts):
+            raise
         db.session.rollback()
         logging.error(f"Excel import error: {str(e)}")
         return False, f"خطأ في قراءة ملف الإكسيل: {str(e)}"
 
-def export_products_to_excel(file_path=None):
+def export_products_to_excel(file_path=None, progress=None):
     """Export products to Excel file"""
+    import pandas as pd
+    
     try:
         if not file_path:
             file_path = f"static/exports/products_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
@@ -93,12 +110,15 @@ def export_products_to_excel(file_path=None):
         # Ensure export directory exists
         os.makedirs(os.path.dirname(file_path), exist_ok=True)
         
-        # Get all products
-        products = Product.query.all()
+        # Column rows in batches instead of ORM objects (see read_models)
+        if progress:
+            progress.start(product_count())
         
         # Create DataFrame
         data = []
-        for product in products:
+        for product in product_rows():
+            if progress:
+                progress.advance()
             data.append({
                 'Product ID': product.product_id,
                 'Product Name': product.name,
@@ -133,11 +153,15 @@ def export_products_to_excel(file_path=None):
         return True, file_path
         
     except Exception as e:
+        if progress and isinstance(e, progress.interrupts):
+            raise
         logging.error(f"Excel export error: {str(e)}")
         return False, f"خطأ في تصدير الملف: {str(e)}"
 
 def validate_excel_file(file_path):
     """Validate Excel file format"""
+    import pandas as pd
+    
     try:
         df = pd.read_excel(file_path)
         required_columns = ['Product ID', 'Product Name', 'Price', 'Quantity', 'Date Added']
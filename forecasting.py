@@ -0,0 +1,179 @@
+"""
+توقع نفاد المخزون ونقاط إعادة الطلب
+يحسب سرعة البيع اليومية لكل منتج من سجل SaleItem دفعة واحدة باستخدام NumPy
+"""
+
+import math
+import threading
+import time
+import logging
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import func, select
+
+from app import db
+from models import Product, Sale, SaleItem
+from branches import BranchLocal
+
+
+class StockForecaster:
+    def __init__(self, history_days=365, short_window=7, long_window=28,
+                 smoothing=0.3, lead_time_days=3, cover_days=14,
+                 service_z=1.65, refresh_interval=60):
+        self.history_days = history_days
+        self.short_window = short_window
+        self.long_window = long_window
+        self.smoothing = smoothing
+        self.lead_time_days = lead_time_days
+        self.cover_days = cover_days
+        self.service_z = service_z
+        self.refresh_interval = refresh_interval
+
+        self._lock = threading.Lock()
+        self._history = np.zeros((0, history_days), dtype=np.float32)
+        self._row_of = {}               # Product.id -> رقم الصف في المصفوفة
+        self._last_day = None           # آخر يوم يمثله العمود الأخير
+        self._last_item_id = 0          # آخر SaleItem تمت معالجته
+        self._last_refresh = 0.0
+        self._report = []
+        self._ewma_weights = self._build_ewma_weights()
+
+    def _build_ewma_weights(self):
+        """أوزان التنعيم الأسي لكل عمود (الأحدث في النهاية)"""
+        ages = np.arange(self.history_days - 1, -1, -1, dtype=np.float32)
+        weights = self.smoothing * (1 - self.smoothing) ** ages
+        return (weights / weights.sum()).astype(np.float32)
+
+    def _ensure_rows(self, product_ids):
+        """إضافة صفوف للمنتجات الجديدة"""
+        new_ids = [pid for pid in product_ids if pid not in self._row_of]
+        if not new_ids:
+            return
+        start = self._history.shape[0]
+        for offset, pid in enumerate(new_ids):
+            self._row_of[pid] = start + offset
+        extra = np.zeros((len(new_ids), self.history_days), dtype=np.float32)
+        self._history = np.vstack([self._history, extra])
+
+    def _advance_to(self, today):
+        """إزاحة نافذة الأيام عند بداية يوم جديد"""
+        if self._last_day is None:
+            self._last_day = today
+            return
+        shift = (today - self._last_day).days
+        if shift <= 0:
+            return
+        if shift >= self.history_days:
+            self._history[:] = 0
+        else:
+            self._history[:, :-shift] = self._history[:, shift:]
+            self._history[:, -shift:] = 0
+        self._last_day = today
+
+    def _ingest_sales(self, today):
+        """قراءة عناصر البيع الجديدة فقط وإضافتها للمصفوفة"""
+        first_day = today - timedelta(days=self.history_days - 1)
+        day_col = func.date(Sale.sale_date)
+        rows = db.session.execute(
+            select(SaleItem.product_id, day_col, func.sum(SaleItem.quantity), func.max(SaleItem.id))
+            .join(Sale, Sale.id == SaleItem.sale_id)
+            .where(SaleItem.id > self._last_item_id)
+            .where(Sale.sale_date >= datetime.combine(first_day, datetime.min.time()))
+            .group_by(SaleItem.product_id, day_col)
+        ).all()
+        if not rows:
+            return
+
+        self._ensure_rows({row[0] for row in rows})
+        row_idx = np.fromiter((self._row_of[row[0]] for row in rows), dtype=np.int64, count=len(rows))
+        col_idx = np.fromiter(
+            ((datetime.strptime(str(row[1]), '%Y-%m-%d').date() - first_day).days for row in rows),
+            dtype=np.int64, count=len(rows)
+        )
+        qty = np.fromiter((row[2] or 0 for row in rows), dtype=np.float32, count=len(rows))
+        valid = (col_idx >= 0) & (col_idx < self.history_days)
+        np.add.at(self._history, (row_idx[valid], col_idx[valid]), qty[valid])
+        self._last_item_id = max(self._last_item_id, max(row[3] for row in rows))
+
+    def _compute(self, stock_rows):
+        """حساب السرعة وأيام النفاد وكميات إعادة الطلب لكل المنتجات معاً"""
+        if not stock_rows:
+            return []
+        self._ensure_rows([row.id for row in stock_rows])
+        rows = np.fromiter((self._row_of[row.id] for row in stock_rows), dtype=np.int64, count=len(stock_rows))
+        stock = np.fromiter((row.quantity for row in stock_rows), dtype=np.float32, count=len(stock_rows))
+        # الإحصاءات تحسب على المصفوفة كاملة ثم تنتقى صفوف المنتجات الحالية
+        recent = self._history[:, -self.long_window:]
+        short_mean = self._history[:, -self.short_window:].mean(axis=1)[rows]
+        long_mean = recent.mean(axis=1)[rows]
+        long_std = recent.std(axis=1)[rows]
+        ewma = (self._history @ self._ewma_weights)[rows]
+
+        # السرعة: الأعلى بين التنعيم الأسي ومتوسط النافذتين لتجنب التفاؤل عند تسارع البيع
+        velocity = np.maximum(ewma, (short_mean + long_mean) / 2)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            days_left = np.where(velocity > 0, stock / velocity, np.inf)
+
+        horizon = self.lead_time_days + self.cover_days
+        safety = self.service_z * long_std * math.sqrt(self.lead_time_days)
+        reorder_point = velocity * self.lead_time_days + safety
+        reorder_qty = np.ceil(np.maximum(velocity * horizon + safety - stock, 0))
+
+        report = []
+        for i, row in enumerate(stock_rows):
+            report.append({
+                'id': row.id,
+                'product_id': row.product_id,
+                'name': row.name,
+                'category': row.category,
+                'quantity': int(stock[i]),
+                'velocity': float(velocity[i]),
+                'days_left': float(days_left[i]),
+                'reorder_point': float(reorder_point[i]),
+                'reorder_qty': int(reorder_qty[i]),
+                'needs_reorder': bool(stock[i] <= reorder_point[i]),
+            })
+        return report
+
+    def refresh(self, force=False):
+        """تحديث التوقعات تدريجياً من المبيعات الجديدة"""
+        now = time.monotonic()
+        with self._lock:
+            if not force and self._report and now - self._last_refresh < self.refresh_interval:
+                return self._report
+            try:
+                today = datetime.now().date()
+                self._advance_to(today)
+                self._ingest_sales(today)
+                stock_rows = db.session.execute(
+                    select(Product.id, Product.product_id, Product.name, Product.category, Product.quantity)
+                ).all()
+                self._report = self._compute(stock_rows)
+                self._last_refresh = now
+            except Exception as e:
+                logging.error(f"خطأ في حساب توقعات المخزون: {str(e)}")
+            return self._report
+
+    def invalidate(self):
+        """طلب إعادة الحساب في الطلب التالي (مثلاً بعد تعديل المخزون)"""
+        self._last_refresh = 0.0
+
+    def low_stock_report(self, sort_by='days_left', descending=False, only_at_risk=True):
+        """تقرير المنتجات المعرضة للنفاد مرتباً حسب العمود المطلوب"""
+        report = self.refresh()
+        if only_at_risk:
+            report = [row for row in report
+                      if row['needs_reorder'] or row['days_left'] <= self.lead_time_days + self.cover_days]
+        if sort_by not in ('days_left', 'velocity', 'reorder_qty', 'quantity', 'name', 'category'):
+            sort_by = 'days_left'
+        return sorted(report, key=lambda row: row[sort_by], reverse=descending)
+
+    def at_risk_count(self):
+        """عدد المنتجات التي ستنفد قبل وصول طلبية جديدة"""
+        return sum(1 for row in self.refresh()
+                   if row['days_left'] <= self.lead_time_days or row['quantity'] == 0)
+
+
+# مثيل التوقعات العام (نسخة لكل فرع)
+stock_forecaster = BranchLocal(lambda code: StockForecaster())
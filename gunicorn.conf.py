@@ -0,0 +1,25 @@
+# Gunicorn settings: gunicorn -c gunicorn.conf.py main:app
+import multiprocessing
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+
+# Import the app once in the master; workers share its memory copy-on-write
+# and fork without re-importing Flask, SQLAlchemy and the routes
+preload_app = True
+
+
+def when_ready(server):
+    # Schema setup runs once in the master instead of in every worker
+    from app import app, init_db
+    with app.app_context():
+        init_db()
+
+
+def post_fork(server, worker):
+    # Connections opened by the master must not be shared with workers
+    from app import app, db
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
@@ -0,0 +1,255 @@
+"""
+تشغيل العمليات الطويلة في الخلفية (استيراد المنتجات، التصدير، إعادة توليد رموز QR)
+- الطلب ينشئ سجل Job ويعود فوراً، والعملية تنفذ في مجموعة خيوط محدودة العدد
+- التقدم (عدد الصفوف والأخطاء) يحفظ في جدول job كل PROGRESS_INTERVAL صف، وصفحة الاستيراد تقرؤه دورياً
+- الإلغاء يطلب من الصفحة ويتوقف التنفيذ عند أول نقطة حفظ بعده
+- نفس الملف (أو نفس التصدير) لا يعمل مرتين في نفس الوقت: فهرس فريد على dedupe_key للعمليات النشطة
+"""
+
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from flask import g, url_for
+import sqlalchemy as sa
+from sqlalchemy.exc import IntegrityError
+
+from app import app, db
+from models import Job, PriceChange, Product
+from branches import branch_context, current_branch
+
+JOB_WORKERS = int(os.environ.get('MARKET_JOB_WORKERS', 2))
+
+# عدد الصفوف بين كل حفظ للتقدم (والتحقق من طلب الإلغاء)
+PROGRESS_INTERVAL = 100
+
+# عدد أخطاء الصفوف المحفوظة في سجل العملية
+MAX_STORED_ERRORS = 50
+
+ACTIVE_STATUSES = ('queued', 'running')
+
+JOB_DIR = os.path.join(app.instance_path, 'jobs')
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobFailed(Exception):
+    pass
+
+
+class JobProgress:
+    """تقدم عملية جارية؛ كل نقطة حفظ تعمل commit للجلسة (ومعها ما أنجزته العملية حتى الآن)"""
+
+    # استثناءات يجب ألا تعالجها دالة العملية نفسها
+    interrupts = (JobCancelled,)
+
+    def __init__(self, job):
+        self.job = job
+        self.processed = 0
+        self.errors = []
+        self.error_count = 0
+
+    def start(self, total):
+        self.job.total_rows = total
+        self.checkpoint()
+
+    def advance(self, count=1, error=None):
+        self.processed += count
+        if error:
+            self.error_count += 1
+            if len(self.errors) < MAX_STORED_ERRORS:
+                self.errors.append(error)
+        if self.processed % PROGRESS_INTERVAL == 0:
+            self.checkpoint()
+
+    def checkpoint(self, check_cancel=True):
+        self.job.processed_rows = self.processed
+        self.job.error_count = self.error_count
+        self.job.errors = json.dumps(self.errors, ensure_ascii=False)
+        db.session.commit()
+        # بعد commit يعاد تحميل السجل، فيظهر طلب الإلغاء من الطلبات الأخرى
+        if check_cancel and self.job.cancel_requested:
+            raise JobCancelled()
+
+
+def _import_products(params, progress):
+    from excel_utils import import_products_from_excel
+    success, message = import_products_from_excel(params['path'], progress)
+    if not success:
+        raise JobFailed(message)
+    return message, None
+
+
+def _export_products(params, progress):
+    from excel_utils import export_products_to_excel
+    os.makedirs(JOB_DIR, exist_ok=True)
+    path = os.path.join(JOB_DIR, f"products_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{progress.job.id}.xlsx")
+    from replicas import replica_reads
+    # التصدير يقرأ كل المنتجات، فيقرأ من نسخة القراءة إن وجدت
+    with replica_reads():
+        success, result = export_products_to_excel(path, progress)
+    if not success:
+        raise JobFailed(result)
+    return f"تم تصدير {progress.processed} منتج", path
+
+
+def _regenerate_qr_codes(params, progress):
+    from utils import generate_qr_code
+    if params.get('missing_only'):
+        # بعد الإضافة بالجملة: المنتجات التي ليس لها رمز فقط
+        return _generate_missing_qr_codes(progress)
+    if params.get('price_change_id'):
+        # بعد تغيير الأسعار: المنتجات المشمولة بالتغيير فقط
+        from pricing import scope_product_ids
+        ids = scope_product_ids(db.session.get(PriceChange, params['price_change_id']))
+    else:
+        ids = [product_id for (product_id,) in db.session.query(Product.id).order_by(Product.id)]
+    progress.start(len(ids))
+    for start in range(0, len(ids), PROGRESS_INTERVAL):
+        for product in Product.query.filter(Product.id.in_(ids[start:start + PROGRESS_INTERVAL])).all():
+            error = None
+            try:
+                path = generate_qr_code(product)
+                # لا نعدل المنتج إلا إذا تغير المسار حتى لا يظهر كتعديل في مزامنة الكتالوج
+                if product.qr_code_path != path:
+                    product.qr_code_path = path
+            except Exception as e:
+                error = f"{product.product_id}: {str(e)}"
+            progress.advance(error=error)
+    return f"تم توليد {progress.processed - progress.error_count} رمز QR", None
+
+
+def _generate_missing_qr_codes(progress):
+    from utils import generate_qr_code
+    attempted = set()
+    while True:
+        # منتجات أضيفت أثناء تنفيذ العملية تلتقط في الدورة التالية (طلب جديد لن ينشئ عملية ثانية)
+        ids = [product_id for product_id in db.session.execute(
+            sa.select(Product.id).where(Product.qr_code_path.is_(None)).order_by(Product.id)).scalars()
+            if product_id not in attempted]
+        if not ids:
+            break
+        attempted.update(ids)
+        progress.start(progress.processed + len(ids))
+        for start in range(0, len(ids), PROGRESS_INTERVAL):
+            for product in Product.query.filter(Product.id.in_(ids[start:start + PROGRESS_INTERVAL])).all():
+                error = None
+                try:
+                    product.qr_code_path = generate_qr_code(product)
+                except Exception as e:
+                    error = f"{product.product_id}: {str(e)}"
+                progress.advance(error=error)
+    return f"تم توليد {progress.processed - progress.error_count} رمز QR", None
+
+
+# نوع العملية ← الدالة المنفذة؛ تستقبل (params, progress) وترجع (رسالة، مسار الملف الناتج)
+JOB_HANDLERS = {
+    'import_products': _import_products,
+    'export_products': _export_products,
+    'regenerate_qr': _regenerate_qr_codes,
+}
+
+
+class JobRunner:
+    def __init__(self, max_workers=JOB_WORKERS):
+        self.max_workers = max_workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        # الخيوط تنشأ عند أول عملية (بعد fork في gunicorn)
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='job')
+            return self._executor
+
+    def submit(self, kind, params=None, dedupe_key=None):
+        """إنشاء عملية وجدولتها؛ يرجع (job، أنشئت؟) - إذا كانت نفس العملية نشطة ترجع هي"""
+        job = Job(kind=kind, params=json.dumps(params or {}, ensure_ascii=False), dedupe_key=dedupe_key,
+                  branch_code=current_branch(), user_id=g.get('user_id'))
+        db.session.add(job)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            existing = Job.query.filter(Job.dedupe_key == dedupe_key, Job.status.in_(ACTIVE_STATUSES)).first()
+            if existing is not None:
+                return existing, False
+            raise
+        self._pool().submit(self._run, job.id)
+        return job, True
+
+    def cancel(self, job):
+        """طلب إلغاء عملية؛ يرجع (نجاح، رسالة)"""
+        if job.status not in ACTIVE_STATUSES:
+            return False, "العملية انتهت بالفعل"
+        job.cancel_requested = True
+        db.session.commit()
+        return True, "تم طلب إلغاء العملية"
+
+    def _run(self, job_id):
+        with app.app_context():
+            job = db.session.get(Job, job_id)
+            try:
+                if job.cancel_requested:
+                    raise JobCancelled()
+                job.status = 'running'
+                job.started_at = datetime.utcnow()
+                db.session.commit()
+
+                progress = JobProgress(job)
+                with branch_context(job.branch_code):
+                    job.message, job.result_path = JOB_HANDLERS[job.kind](json.loads(job.params or '{}'), progress)
+                    progress.checkpoint(check_cancel=False)
+                job.status = 'done'
+            except JobCancelled:
+                db.session.rollback()
+                job.status = 'cancelled'
+                job.message = "تم إلغاء العملية"
+            except Exception as e:
+                db.session.rollback()
+                logging.error(f"Job {job_id} ({job.kind}) failed: {str(e)}")
+                job.status = 'failed'
+                job.message = str(e)
+            finally:
+                job.finished_at = datetime.utcnow()
+                db.session.commit()
+                db.session.remove()
+
+
+# منفذ العمليات العام للعملية (process)
+job_runner = JobRunner()
+
+
+def job_payload(job):
+    """حالة العملية لصفحة التقدم"""
+    percent = 100 if job.status == 'done' else 0
+    if job.total_rows and job.status != 'done':
+        percent = min(99, job.processed_rows * 100 // job.total_rows)
+    return {
+        'id': job.id,
+        'kind': job.kind,
+        'status': job.status,
+        'total_rows': job.total_rows,
+        'processed_rows': job.processed_rows,
+        'error_count': job.error_count,
+        'errors': json.loads(job.errors or '[]')[:10],
+        'message': job.message,
+        'percent': percent,
+        'download_url': url_for('download_job_result', job_id=job.id) if job.result_path else None,
+    }
+
+
+def mark_interrupted_jobs():
+    """العمليات التي كانت تعمل عند توقف الخادم لن تكتمل أبداً"""
+    count = (Job.query.filter(Job.status.in_(ACTIVE_STATUSES))
+             .update({'status': 'failed', 'message': 'توقف الخادم أثناء تنفيذ العملية',
+                      'finished_at': datetime.utcnow()}, synchronize_session=False))
+    db.session.commit()
+    if count:
+        logging.info(f"Marked {count} interrupted jobs as failed")
@@ -0,0 +1,200 @@
+"""
+تحديثات لوحة التحكم المباشرة عبر Server-Sent Events
+ناشر واحد داخل العملية يحتفظ بملخص اليوم ويوزع التغييرات على كل اللوحات المفتوحة
+"""
+
+import json
+import logging
+import queue
+import threading
+import time
+from datetime import datetime
+
+from app import app, db
+from models import Product, Sale
+from branches import BranchLocal, branch_context, DEFAULT_BRANCH
+
+# حد المخزون القليل المستخدم في لوحة التحكم وصفحة المنتجات
+LOW_STOCK_THRESHOLD = 5
+
+RECENT_SALES_LIMIT = 5
+
+
+def sale_summary(sale):
+    """ملخص البيع كما يعرض في جدول آخر المبيعات"""
+    return {
+        'id': sale.id,
+        'customer_name': sale.customer_name,
+        'total_amount': sale.total_amount,
+        'sale_date': sale.sale_date,
+        'print_date': sale.print_date
+    }
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M')
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+class DashboardPublisher:
+    def __init__(self, branch=DEFAULT_BRANCH, reconcile_interval=30, keepalive_interval=15, max_queue=100):
+        self.branch = branch
+        self.reconcile_interval = reconcile_interval
+        self.keepalive_interval = keepalive_interval
+        self.max_queue = max_queue
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._snapshot = None
+        self._loaded_at = 0.0
+        self._versions = None
+        self._reconciler = None
+
+    def _load_snapshot(self):
+        """الاستعلامات الوحيدة للوحة التحكم - تنفذ مرة واحدة لكل المشاهدين"""
+        today = datetime.now().date()
+        day_start = datetime.combine(today, datetime.min.time())
+        count, revenue = db.session.query(
+            db.func.count(Sale.id), db.func.coalesce(db.func.sum(Sale.total_amount), 0)
+        ).filter(Sale.sale_date >= day_start).one()
+        recent = Sale.query.order_by(Sale.sale_date.desc()).limit(RECENT_SALES_LIMIT).all()
+        return {
+            'day': today.isoformat(),
+            'total_sales_today': count,
+            'total_revenue_today': float(revenue),
+            'total_products': Product.query.count(),
+            'low_stock_products': Product.query.filter(Product.quantity <= LOW_STOCK_THRESHOLD).count(),
+            'recent_sales': [sale_summary(sale) for sale in recent]
+        }
+
+    def snapshot(self, max_age=None, versions=None):
+        """ملخص اللوحة الحالي؛ يعاد تحميله عند بداية يوم جديد أو إذا كان أقدم من max_age
+
+        versions: أرقام إصدار البيانات الحالية؛ إذا اختلفت عن التي حمل عندها الملخص فقد كتبت عملية أخرى
+        (عامل gunicorn آخر) بيانات لا يراها هذا الملخص، فيعاد تحميله
+        """
+        with self._lock:
+            stale = (self._snapshot is None
+                     or self._snapshot['day'] != datetime.now().date().isoformat()
+                     or (max_age is not None and time.monotonic() - self._loaded_at > max_age)
+                     or (versions is not None and versions != self._versions))
+            if stale:
+                self._snapshot = self._load_snapshot()
+                self._loaded_at = time.monotonic()
+                self._versions = versions
+            return dict(self._snapshot)
+
+    def _broadcast(self, event, data):
+        message = f"event: {event}\ndata: {json.dumps(data, default=_json_default, ensure_ascii=False)}\n\n"
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(message)
+            except queue.Full:
+                # مشاهد بطيء: نفصله بدلاً من تراكم الرسائل في الذاكرة
+                self.unsubscribe(subscriber)
+
+    def sale_completed(self, sale, crossed_low_stock=()):
+        """تحديث الملخص تدريجياً بعد إتمام بيع ونشره"""
+        summary = sale_summary(sale)
+        try:
+            self.snapshot()
+            with self._lock:
+                snapshot = self._snapshot
+                # إذا حمل الملخص بعد حفظ البيع فهو يشمله بالفعل
+                if not any(recent['id'] == sale.id for recent in snapshot['recent_sales']):
+                    snapshot['total_sales_today'] += 1
+                    snapshot['total_revenue_today'] += sale.total_amount
+                    snapshot['low_stock_products'] += len(crossed_low_stock)
+                    snapshot['recent_sales'] = ([summary] + snapshot['recent_sales'])[:RECENT_SALES_LIMIT]
+                counters = {key: value for key, value in snapshot.items() if key != 'recent_sales'}
+        except Exception as e:
+            logging.error(f"خطأ في تحديث ملخص لوحة التحكم: {str(e)}")
+            return
+        self._broadcast('sale', {'sale': summary, 'counters': counters})
+        for product in crossed_low_stock:
+            self._broadcast('low_stock', product)
+
+    def stock_changed(self, product, old_quantity):
+        """نشر تغير المخزون عند عبور حد المخزون القليل في أي اتجاه"""
+        was_low = old_quantity <= LOW_STOCK_THRESHOLD
+        is_low = product.quantity <= LOW_STOCK_THRESHOLD
+        if was_low == is_low:
+            return
+        with self._lock:
+            if self._snapshot is not None:
+                self._snapshot['low_stock_products'] += 1 if is_low else -1
+        if is_low:
+            self._broadcast('low_stock', low_stock_payload(product))
+        self.publish_counters()
+
+    def refresh(self):
+        """إعادة تحميل الملخص بعد تغيير لا يمكن حسابه تدريجياً (إضافة أو حذف منتج)"""
+        with self._lock:
+            self._snapshot = None
+        try:
+            self._broadcast('snapshot', self.snapshot())
+        except Exception as e:
+            logging.error(f"خطأ في تحديث ملخص لوحة التحكم: {str(e)}")
+
+    def publish_counters(self):
+        snapshot = self.snapshot()
+        snapshot.pop('recent_sales')
+        self._broadcast('counters', snapshot)
+
+    def subscribe(self):
+        subscriber = queue.Queue(maxsize=self.max_queue)
+        with self._lock:
+            self._subscribers.add(subscriber)
+            if self._reconciler is None or not self._reconciler.is_alive():
+                self._reconciler = threading.Thread(target=self._reconcile_loop, daemon=True)
+                self._reconciler.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def _reconcile_loop(self):
+        """إعادة حساب الملخص دورياً لالتقاط مبيعات العمال الآخرين (مرة لكل العملية)"""
+        while True:
+            time.sleep(self.reconcile_interval)
+            with self._lock:
+                if not self._subscribers:
+                    self._reconciler = None
+                    return
+                previous = self._snapshot
+            try:
+                with app.app_context(), branch_context(self.branch):
+                    current = self.snapshot(max_age=self.reconcile_interval / 2)
+            except Exception as e:
+                logging.error(f"خطأ في مزامنة لوحة التحكم: {str(e)}")
+                continue
+            if current != previous:
+                self._broadcast('snapshot', current)
+
+    def stream(self, subscriber, initial):
+        """مولد رسائل SSE لمشاهد واحد؛ initial هو الملخص المحسوب داخل الطلب"""
+        try:
+            yield f"retry: 5000\nevent: snapshot\ndata: {json.dumps(initial, default=_json_default, ensure_ascii=False)}\n\n"
+            while True:
+                try:
+                    yield subscriber.get(timeout=self.keepalive_interval)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+        finally:
+            self.unsubscribe(subscriber)
+
+
+def low_stock_payload(product):
+    return {
+        'id': product.id,
+        'product_id': product.product_id,
+        'name': product.name,
+        'quantity': product.quantity
+    }
+
+
+# الناشر العام للوحة التحكم (ناشر لكل فرع)
+dashboard_publisher = BranchLocal(DashboardPublisher)
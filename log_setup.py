@@ -0,0 +1,168 @@
+"""
+إعداد السجلات (logging)
+- السجلات تمر عبر QueueHandler إلى خيط منفصل يكتبها، فلا ينتظر الطلب الكتابة على stderr
+- كل سطر JSON فيه رقم الطلب (X-Request-ID) ومدته
+- مستوى عام INFO ومستويات لكل وحدة (SQLAlchemy و werkzeug على WARNING افتراضياً)
+- طلبات مسح المنتجات كثيرة جداً، فيسجل جزء منها فقط (إلا البطيئة أو الفاشلة)
+
+الإعداد:
+    MARKET_LOG_LEVEL=INFO
+    MARKET_LOG_LEVELS='{"sqlalchemy.engine": "INFO", "escpos": "DEBUG"}'
+    MARKET_LOG_FORMAT=json            # أو text للتطوير
+    MARKET_LOG_SAMPLE=0.01            # نسبة طلبات المسح المسجلة
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from flask import g, has_request_context, request
+
+DEFAULT_LEVELS = {
+    'sqlalchemy': 'WARNING',
+    'werkzeug': 'WARNING',
+    'urllib3': 'WARNING',
+    'PIL': 'WARNING',
+}
+
+# نقاط الطلبات التي يسجل جزء منها فقط
+SAMPLED_ENDPOINTS = {'get_product_by_qr', 'job_status'}
+
+# الطلبات الأبطأ من هذا تسجل دائماً
+SLOW_REQUEST_MS = 500
+
+request_log = logging.getLogger('market.requests')
+
+# حقول LogRecord الأساسية؛ أي حقل آخر جاء من extra=... ويضاف لسطر JSON
+_RECORD_FIELDS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime', 'request_id'}
+
+
+class RequestIdFilter(logging.Filter):
+    """إضافة رقم الطلب للسجل في خيط الطلب نفسه (قبل وضعه في الطابور)"""
+
+    def filter(self, record):
+        if not hasattr(record, 'request_id'):
+            record.request_id = g.get('request_id') if has_request_context() else None
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        if record.request_id:
+            entry['request_id'] = record.request_id
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class LogPipeline:
+    """طابور السجلات وخيط الكتابة"""
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.queue_handler = QueueHandler(queue.SimpleQueue())
+        self.queue_handler.addFilter(RequestIdFilter())
+        self.listener = None
+
+    def start(self):
+        self.listener = QueueListener(self.queue_handler.queue, self.handler, respect_handler_level=True)
+        self.listener.start()
+
+    def stop(self):
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+    def restart_after_fork(self):
+        # خيط الكتابة لا ينتقل مع fork (عمال gunicorn)، فينشأ خيط وطابور جديدان في العملية الابنة
+        # (ما بقي في طابور الأب يكتبه الأب نفسه)
+        self.queue_handler.queue = queue.SimpleQueue()
+        self.listener = None
+        self.start()
+
+
+_pipeline = None
+
+
+def parse_levels(raw):
+    levels = dict(DEFAULT_LEVELS)
+    if raw:
+        try:
+            levels.update(json.loads(raw))
+        except ValueError:
+            sys.stderr.write(f"Invalid MARKET_LOG_LEVELS setting: {raw}\n")
+    return levels
+
+
+def configure_logging():
+    """تهيئة السجلات مرة واحدة عند تحميل التطبيق"""
+    global _pipeline
+    if _pipeline is not None:
+        return
+
+    handler = logging.StreamHandler(sys.stderr)
+    if os.environ.get('MARKET_LOG_FORMAT', 'json') == 'json':
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s'))
+
+    _pipeline = LogPipeline(handler)
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(_pipeline.queue_handler)
+    root.setLevel(os.environ.get('MARKET_LOG_LEVEL', 'INFO').upper())
+    for name, level in parse_levels(os.environ.get('MARKET_LOG_LEVELS')).items():
+        logging.getLogger(name).setLevel(str(level).upper())
+
+    _pipeline.start()
+    atexit.register(_pipeline.stop)
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=_pipeline.restart_after_fork)
+
+
+def init_request_logging(app):
+    """رقم لكل طلب وسطر سجل بمدته"""
+    sample_rate = float(os.environ.get('MARKET_LOG_SAMPLE', 0.01))
+
+    @app.before_request
+    def start_request_log():
+        g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex[:16]
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def finish_request_log(response):
+        started = g.get('request_started')
+        if started is None:
+            return response
+        response.headers['X-Request-ID'] = g.request_id
+        duration_ms = (time.perf_counter() - started) * 1000
+        if (request.endpoint in SAMPLED_ENDPOINTS and response.status_code < 500
+                and duration_ms < SLOW_REQUEST_MS and random.random() >= sample_rate):
+            return response
+        if request_log.isEnabledFor(logging.INFO):
+            request_log.info('%s %s %s', request.method, request.path, response.status_code, extra={
+                'status': response.status_code,
+                'duration_ms': round(duration_ms, 2),
+                'endpoint': request.endpoint,
+                'branch': g.get('branch'),
+            })
+        return response
@@ -5,11 +5,29 @@ class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
     password_hash = db.Column(db.String(256), nullable=False)
+    branch_code = db.Column(db.String(50))  # None = main branch
+    head_office = db.Column(db.Boolean, default=False)  # may switch branches and see consolidated reports
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     def __repr__(self):
         return f'<User {self.username}>'
 
+class DeviceToken(db.Model):
+    """Long-lived API token for a scanner or till; only a keyed hash of the token is stored"""
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    token_hash = db.Column(db.String(64), unique=True, nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    branch_code = db.Column(db.String(50))  # None = branch of the issuing user
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_used_at = db.Column(db.DateTime)
+    revoked_at = db.Column(db.DateTime)
+
+    user = db.relationship('User', backref='device_tokens', lazy=True)
+
+    def __repr__(self):
+        return f'<DeviceToken {self.name}>'
+
 class Product(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     product_id = db.Column(db.String(50), unique=True, nullable=False)  # Product ID from Excel
@@ -20,12 +38,38 @@ class Product(db.Model):
     qr_code_path = db.Column(db.String(200))
     date_added = db.Column(db.DateTime, nullable=False)  # Date from Excel
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
     excel_source = db.Column(db.String(200))  # Track Excel file source
 
     def __repr__(self):
         return f'<Product {self.name}>'
 
+class ProductTombstone(db.Model):
+    """Deleted products, kept so offline tills can drop them on the next delta sync"""
+    id = db.Column(db.Integer, primary_key=True)
+    product_pk = db.Column(db.Integer, nullable=False)  # Product.id of the deleted row
+    product_id = db.Column(db.String(50), nullable=False)
+    deleted_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+
+    def __repr__(self):
+        return f'<ProductTombstone {self.product_id}>'
+
+class Customer(db.Model):
+    """Customer directory keyed by normalized phone; lifetime totals are updated at checkout"""
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(200), nullable=False)
+    name_key = db.Column(db.String(200), nullable=False, index=True)  # Normalized name for prefix search
+    phone = db.Column(db.String(50))
+    phone_key = db.Column(db.String(20), unique=True, nullable=False, index=True)  # Digits only, local format
+    sale_count = db.Column(db.Integer, nullable=False, default=0)
+    total_spent = db.Column(db.Float, nullable=False, default=0)
+    first_purchase_at = db.Column(db.DateTime)
+    last_purchase_at = db.Column(db.DateTime, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<Customer {self.name}>'
+
 class Sale(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     customer_name = db.Column(db.String(200))
@@ -35,16 +79,26 @@ class Sale(db.Model):
     invoice_path = db.Column(db.String(200))
     print_date = db.Column(db.DateTime)  # Date when invoice was printed
     payment_method = db.Column(db.String(50), default='نقدي')  # Cash or other payment methods
+    client_ref = db.Column(db.String(64), unique=True, index=True)  # Till-generated ID for offline replay
+    customer_id = db.Column(db.Integer, db.ForeignKey('customer.id'))
+    cashier_id = db.Column(db.Integer)  # User.id; no FK because branch tables may live in another database
+    # Receipt lines as printed at checkout (JSON); deferred so sale lists never load it
+    receipt_snapshot = db.deferred(db.Column(db.Text))
+    
+    customer = db.relationship('Customer', lazy=True)
     
     # Relationship with sale items
     items = db.relationship('SaleItem', backref='sale', lazy=True, cascade='all, delete-orphan')
 
+    # Customer history, newest first, without sorting all of the customer's sales
+    __table_args__ = (db.Index('ix_sale_customer_date', 'customer_id', 'sale_date'),)
+
     def __repr__(self):
         return f'<Sale {self.id} - {self.total_amount}>'
 
 class SaleItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    sale_id = db.Column(db.Integer, db.ForeignKey('sale.id'), nullable=False)
+    sale_id = db.Column(db.Integer, db.ForeignKey('sale.id'), nullable=False, index=True)
     product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
     quantity = db.Column(db.Integer, nullable=False)
     unit_price = db.Column(db.Float, nullable=False)
@@ -55,3 +109,100 @@ class SaleItem(db.Model):
 
     def __repr__(self):
         return f'<SaleItem {self.product_id} - {self.quantity}>'
+
+class SaleArchive(db.Model):
+    """Index of read-only monthly archive databases holding closed months of sales"""
+    id = db.Column(db.Integer, primary_key=True)
+    period_start = db.Column(db.DateTime, nullable=False, unique=True)
+    period_end = db.Column(db.DateTime, nullable=False)  # exclusive
+    path = db.Column(db.String(300), nullable=False)
+    sale_count = db.Column(db.Integer, nullable=False, default=0)
+    first_sale_id = db.Column(db.Integer)
+    last_sale_id = db.Column(db.Integer)
+    total_amount = db.Column(db.Float, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<SaleArchive {self.period_start:%Y-%m}>'
+
+class DayClose(db.Model):
+    """Immutable end-of-day Z-report; sales on a closed business date can no longer change"""
+    id = db.Column(db.Integer, primary_key=True)
+    business_date = db.Column(db.Date, nullable=False, unique=True)
+    closed_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    closed_by = db.Column(db.Integer)  # User.id, None when closed from the CLI
+    sale_count = db.Column(db.Integer, nullable=False)
+    item_count = db.Column(db.Integer, nullable=False)
+    total_amount = db.Column(db.Float, nullable=False)
+    first_sale_id = db.Column(db.Integer)
+    last_sale_id = db.Column(db.Integer)
+    report = db.Column(db.Text, nullable=False)  # JSON breakdowns by payment method, category and cashier
+    checksum = db.Column(db.String(64), nullable=False)  # sha256 of report, also used as ETag
+
+    def __repr__(self):
+        return f'<DayClose {self.business_date}>'
+
+class PriceChange(db.Model):
+    """Bulk price change for a category or a list of product IDs, applied now or at effective_at"""
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)  # percent, amount or set
+    value = db.Column(db.Float, nullable=False)
+    category = db.Column(db.String(100))  # None with product_ids, or both None for every product
+    product_ids = db.Column(db.Text)  # Newline-separated Product.product_id values
+    effective_at = db.Column(db.DateTime, nullable=False)  # UTC
+    status = db.Column(db.String(20), nullable=False, default='scheduled')  # scheduled, applied, cancelled
+    applied_at = db.Column(db.DateTime)
+    affected_count = db.Column(db.Integer)
+    created_by = db.Column(db.Integer)  # User.id
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (db.Index('ix_price_change_due', 'status', 'effective_at'),)
+
+    def __repr__(self):
+        return f'<PriceChange {self.id} {self.kind} {self.value} {self.status}>'
+
+class IdSequence(db.Model):
+    """Counter for generated codes (e.g. Product.product_id); workers reserve blocks of values from it"""
+    name = db.Column(db.String(50), primary_key=True)
+    next_value = db.Column(db.BigInteger, nullable=False, default=1)
+
+    def __repr__(self):
+        return f'<IdSequence {self.name}={self.next_value}>'
+
+class DataVersion(db.Model):
+    """Per-branch counters bumped on every write to a group of tables, used to invalidate cached pages"""
+    name = db.Column(db.String(50), primary_key=True)  # 'products' or 'sales'
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f'<DataVersion {self.name}={self.version}>'
+
+class Job(db.Model):
+    """Long-running operation (import, export, QR regeneration) executed by the background job runner"""
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, done, failed, cancelled
+    params = db.Column(db.Text)  # JSON
+    dedupe_key = db.Column(db.String(100))  # Same key cannot be queued or running twice
+    branch_code = db.Column(db.String(50), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    total_rows = db.Column(db.Integer)
+    processed_rows = db.Column(db.Integer, nullable=False, default=0)
+    error_count = db.Column(db.Integer, nullable=False, default=0)
+    errors = db.Column(db.Text)  # JSON list of the first row errors
+    message = db.Column(db.Text)
+    result_path = db.Column(db.String(300))
+    cancel_requested = db.Column(db.Boolean, nullable=False, default=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('uq_job_active_dedupe', 'dedupe_key', unique=True,
+                 sqlite_where=db.text("status IN ('queued', 'running')"),
+                 postgresql_where=db.text("status IN ('queued', 'running')")),
+    )
+
+    def __repr__(self):
+        return f'<Job {self.id} {self.kind} {self.status}>'
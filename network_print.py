@@ -0,0 +1,208 @@
+"""
+الطباعة على عدة طابعات شبكية في نفس الوقت
+كل بيع يرسل كبيانات ESC/POS خام عبر TCP (المنفذ 9100) لكل الطابعات بالتوازي مع مهلة لكل طابعة
+قواعد التوجيه حسب الفئة: طابعة بدون فئات تطبع الفاتورة كاملة، وطابعة بفئات تطبع قائمة تجهيز بأصنافها فقط
+
+الإعداد عبر متغير البيئة MARKET_NETWORK_PRINTERS (JSON)، مثال:
+    [{"name": "الكاشير", "host": "192.168.1.50"},
+     {"name": "المبردات", "host": "192.168.1.51", "categories": ["ألبان", "مجمدات"], "timeout": 3}]
+"""
+
+import asyncio
+import json
+import logging
+import os
+
+import click
+
+from app import app
+from direct_print import print_system
+
+RAW_PRINT_PORT = 9100
+DEFAULT_TIMEOUT = 5.0
+
+ESC_INIT = b'\x1b@'
+FEED_AND_CUT = b'\n\n\n\x1dV\x00'
+
+
+class NetworkPrinter:
+    def __init__(self, name, host, port=RAW_PRINT_PORT, timeout=DEFAULT_TIMEOUT, categories=None, encoding='utf-8',
+                 raster=True):
+        self.name = name
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        # None = الفاتورة كاملة، وإلا قائمة تجهيز بأصناف هذه الفئات فقط
+        self.categories = set(categories) if categories else None
+        self.encoding = encoding
+        # raster: الإرسال كصورة نقطية (العربية صحيحة)، وإلا نص خام بالترميز المحدد
+        self.raster = raster
+
+    def items_for(self, sale_data):
+        if self.categories is None:
+            return sale_data['items']
+        return [item for item in sale_data['items'] if item.get('category') in self.categories]
+
+    def __repr__(self):
+        return f'<NetworkPrinter {self.name} {self.host}:{self.port}>'
+
+
+def load_network_printers():
+    """قراءة الطابعات الشبكية من متغير البيئة"""
+    raw = os.environ.get('MARKET_NETWORK_PRINTERS', '').strip()
+    if not raw:
+        return []
+    try:
+        return [NetworkPrinter(**options) for options in json.loads(raw)]
+    except (ValueError, TypeError) as e:
+        logging.error(f"Invalid MARKET_NETWORK_PRINTERS setting: {str(e)}")
+        return []
+
+
+def pick_list_text(sale_data, items, printer_name):
+    """قائمة تجهيز مختصرة لطابعة قسم (المخزن، المبردات...)"""
+    lines = [
+        "=" * 40,
+        f"قائمة تجهيز - {printer_name}",
+        f"فاتورة رقم: {sale_data['id']}",
+        f"التاريخ: {sale_data['date']} {sale_data['time']}",
+        "-" * 40,
+    ]
+    for item in items:
+        lines.append(f"{item['name'][:30]:<30} {item['quantity']:>6}")
+    lines.append("=" * 40)
+    return "\n".join(lines)
+
+
+def pick_list_lines(sale_data, items, printer_name):
+    """نفس قائمة التجهيز بتخطيط الإيصال النقطي (receipt_raster)"""
+    from receipt_raster import LARGE_SIZE
+    lines = [
+        ('center', f"قائمة تجهيز - {printer_name}", LARGE_SIZE),
+        ('right', f"فاتورة رقم: {sale_data['id']}"),
+        ('right', f"التاريخ: {sale_data['date']} {sale_data['time']}"),
+        ('rule',),
+    ]
+    for item in items:
+        lines.append(('row', item['name'], str(item['quantity']), ''))
+    lines.append(('rule',))
+    return lines
+
+
+async def send_raw(printer, data):
+    """إرسال بيانات خام لطابعة واحدة وإرجاع (نجاح، رسالة)"""
+    async def send():
+        reader, writer = await asyncio.open_connection(printer.host, printer.port)
+        try:
+            writer.write(data)
+            await writer.drain()
+        finally:
+            writer.close()
+            await writer.wait_closed()
+
+    try:
+        await asyncio.wait_for(send(), printer.timeout)
+        return True, f"تمت الطباعة على {printer.name}"
+    except asyncio.TimeoutError:
+        logging.error(f"Network printer {printer.name} timed out after {printer.timeout}s")
+        return False, f"انتهت مهلة الطابعة {printer.name}"
+    except OSError as e:
+        logging.error(f"Network printer {printer.name} failed: {str(e)}")
+        return False, f"تعذر الاتصال بالطابعة {printer.name}"
+
+
+class NetworkPrintDispatcher:
+    def __init__(self, printers=None):
+        self.printers = printers if printers is not None else load_network_printers()
+
+    def jobs_for(self, sale_data):
+        """بيانات ESC/POS لكل طابعة لها أصناف في هذا البيع"""
+        jobs = []
+        for printer in self.printers:
+            items = printer.items_for(sale_data)
+            if not items:
+                continue
+            if printer.raster:
+                # Pillow و escpos يحملان عند أول طباعة نقطية فقط
+                from receipt_raster import receipt_renderer, receipt_lines, raster_bytes
+                if printer.categories is None:
+                    lines = receipt_lines(sale_data)
+                else:
+                    lines = pick_list_lines(sale_data, items, printer.name)
+                jobs.append((printer, ESC_INIT + raster_bytes(receipt_renderer.render(lines))))
+                continue
+            if printer.categories is None:
+                text = print_system.generate_arabic_invoice(sale_data)
+            else:
+                text = pick_list_text(sale_data, items, printer.name)
+            jobs.append((printer, ESC_INIT + text.encode(printer.encoding, errors='replace') + FEED_AND_CUT))
+        return jobs
+
+    async def dispatch(self, jobs):
+        results = await asyncio.gather(*(send_raw(printer, data) for printer, data in jobs))
+        return {printer.name: result for (printer, _), result in zip(jobs, results)}
+
+    def print_sale(self, sale_data):
+        """الطباعة على كل الطابعات المعنية بالتوازي؛ يرجع {اسم الطابعة: (نجاح، رسالة)}"""
+        jobs = self.jobs_for(sale_data)
+        if not jobs:
+            return {}
+        return asyncio.run(self.dispatch(jobs))
+
+
+class StandInPrinter:
+    """طابعة وهمية على المنفذ المحلي تجمع ما يصلها - للتجربة بدون طابعات حقيقية"""
+
+    def __init__(self):
+        self.received = []
+        self._server = None
+
+    async def _handle(self, reader, writer):
+        self.received.append(await reader.read())
+        writer.close()
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, '127.0.0.1', 0)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+
+# موزع الطباعة الشبكية العام
+network_printers = NetworkPrintDispatcher()
+
+
+@app.cli.command('network-print-check')
+def network_print_check_command():
+    """Print a sample sale on local stand-in printers and show what each one received."""
+    sale_data = {
+        'id': 'TEST001', 'date': '2025-01-01', 'time': '12:00:00',
+        'customer_name': 'عميل تجريبي', 'customer_phone': '', 'total': 95.0,
+        'items': [
+            {'name': 'أرز', 'quantity': 2, 'unit_price': 30.0, 'total_price': 60.0, 'category': 'بقالة'},
+            {'name': 'لبن', 'quantity': 1, 'unit_price': 35.0, 'total_price': 35.0, 'category': 'ألبان'},
+        ]
+    }
+
+    async def run():
+        receipt, cold = StandInPrinter(), StandInPrinter()
+        dispatcher = NetworkPrintDispatcher([
+            NetworkPrinter('receipt', '127.0.0.1', await receipt.start(), timeout=2, raster=False),
+            NetworkPrinter('cold-store', '127.0.0.1', await cold.start(), timeout=2, categories=['ألبان'], raster=False),
+            # منفذ مغلق لإظهار فشل طابعة دون تعطيل الباقي
+            NetworkPrinter('offline', '127.0.0.1', 1, timeout=2, raster=False),
+        ])
+        results = await dispatcher.dispatch(dispatcher.jobs_for(sale_data))
+        await asyncio.sleep(0.1)
+        await receipt.stop()
+        await cold.stop()
+        return results, {'receipt': receipt.received, 'cold-store': cold.received}
+
+    results, received = asyncio.run(run())
+    for name, (success, message) in results.items():
+        click.echo(f"{name}: {'OK' if success else 'FAILED'} - {message}")
+        for data in received.get(name, []):
+            click.echo(f"  received {len(data)} bytes")
+            click.echo(data.decode('utf-8', errors='replace'))
@@ -0,0 +1,173 @@
+"""
+تغيير الأسعار بالجملة وقوائم الأسعار المجدولة
+- تغيير بنسبة مئوية أو بمبلغ أو سعر ثابت لفئة أو لقائمة أكواد منتجات، بأمر UPDATE واحد في معاملة واحدة
+- التغيير المجدول يطبق عند effective_at بأمر flask apply-price-changes (من cron أو بـ --interval)
+- تحديث updated_at مع السعر يجعل الكتالوج الثنائي ومزامنة الأجهزة تلتقط المنتجات المتغيرة، وزيادة إصدار
+  المنتجات تلغي الصفحات المخزنة، ورموز QR (وفيها السعر) يعاد توليدها للمنتجات المشمولة في عملية خلفية
+"""
+
+import re
+import time
+from datetime import datetime, timezone
+
+import click
+import sqlalchemy as sa
+
+from app import app, db
+from models import PriceChange, Product
+from branches import branch_context, branch_names, current_branch
+from render_cache import bump_versions
+
+KINDS = {'percent': 'نسبة مئوية', 'amount': 'مبلغ', 'set': 'سعر ثابت'}
+
+# حجم كل جزء من قائمة الأكواد في شرط IN (حد متغيرات SQLite)
+ID_CHUNK = 500
+
+
+def parse_product_ids(raw):
+    """أكواد المنتجات مفصولة بأسطر أو فواصل أو مسافات (بدون تكرار)"""
+    return list(dict.fromkeys(part for part in re.split(r'[\s,،]+', raw or '') if part))
+
+
+def local_to_utc(value):
+    """وقت من نموذج datetime-local (بتوقيت الخادم) إلى UTC كما تخزن باقي التواريخ"""
+    return datetime.fromisoformat(value).astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def price_expression(kind, value):
+    """السعر الجديد كتعبير SQL محسوب من السعر الحالي لكل صف"""
+    if kind == 'percent':
+        price = Product.price * (1 + value / 100.0)
+    elif kind == 'amount':
+        price = Product.price + value
+    else:
+        price = sa.literal(value)
+    price = sa.func.round(sa.cast(price, sa.Numeric(12, 4)), 2)
+    return sa.case((price < 0, 0), else_=price)
+
+
+def change_scopes(change):
+    """شروط المنتجات المشمولة بالتغيير (قائمة الأكواد تقسم إلى أجزاء)"""
+    if change.product_ids:
+        ids = parse_product_ids(change.product_ids)
+        return [Product.product_id.in_(ids[start:start + ID_CHUNK]) for start in range(0, len(ids), ID_CHUNK)]
+    return [Product.category == change.category]
+
+
+def scope_product_ids(change):
+    """أرقام المنتجات المشمولة (لإعادة توليد رموز QR)"""
+    ids = []
+    for scope in change_scopes(change):
+        ids.extend(db.session.execute(sa.select(Product.id).where(scope)).scalars())
+    return sorted(ids)
+
+
+def create_price_change(kind, value, category=None, product_ids=None, effective_at=None, user_id=None):
+    """تسجيل تغيير أسعار وتطبيقه فوراً إذا لم يحدد موعد؛ يرجع (نجاح، رسالة)"""
+    if kind not in KINDS:
+        return False, "نوع التغيير غير صحيح"
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return False, "القيمة غير صحيحة"
+    if kind == 'percent' and value <= -100:
+        return False, "لا يمكن تخفيض السعر بنسبة 100% أو أكثر"
+    if kind == 'set' and value < 0:
+        return False, "السعر لا يمكن أن يكون سالباً"
+
+    ids = parse_product_ids(product_ids)
+    if not ids and not category:
+        return False, "اختر فئة أو أدخل أكواد المنتجات"
+
+    now = datetime.utcnow()
+    change = PriceChange(
+        kind=kind,
+        value=value,
+        category=None if ids else category,
+        product_ids='\n'.join(ids) if ids else None,
+        effective_at=effective_at or now,
+        created_by=user_id
+    )
+    db.session.add(change)
+    db.session.commit()
+
+    if change.effective_at > now:
+        return True, f"تمت جدولة تغيير الأسعار في {change.effective_at:%Y-%m-%d %H:%M} UTC"
+    return apply_price_change(change)
+
+
+def apply_price_change(change):
+    """تطبيق التغيير على كل المنتجات المشمولة في معاملة واحدة؛ يرجع (نجاح، رسالة)"""
+    now = datetime.utcnow()
+    # حجز التغيير داخل نفس المعاملة حتى لا يطبق مرتين من عمليتين
+    claimed = db.session.execute(
+        sa.update(PriceChange)
+        .where(PriceChange.id == change.id, PriceChange.status == 'scheduled')
+        .values(status='applied', applied_at=now)
+    ).rowcount
+    if not claimed:
+        db.session.rollback()
+        return False, "تم تطبيق هذا التغيير أو إلغاؤه بالفعل"
+
+    started = time.perf_counter()
+    new_price = price_expression(change.kind, change.value)
+    affected = 0
+    for scope in change_scopes(change):
+        affected += db.session.execute(
+            sa.update(Product).where(scope).values(price=new_price, updated_at=now),
+            execution_options={'synchronize_session': False}
+        ).rowcount
+    db.session.execute(sa.update(PriceChange).where(PriceChange.id == change.id)
+                       .values(affected_count=affected))
+    # التحديث بدون ORM لا يمر على after_flush، فنزيد إصدار المنتجات هنا
+    bump_versions(db.session, {'products'})
+    db.session.commit()
+    elapsed_ms = (time.perf_counter() - started) * 1000
+
+    if affected:
+        refresh_qr_codes(change)
+    return True, f"تم تحديث أسعار {affected} منتج ({elapsed_ms:.0f} ms)"
+
+
+def refresh_qr_codes(change):
+    """رموز QR تحتوي السعر، فيعاد توليدها للمنتجات المشمولة في الخلفية"""
+    from jobs import job_runner
+    job_runner.submit('regenerate_qr', {'price_change_id': change.id},
+                      dedupe_key=f"qr:{current_branch()}:price:{change.id}")
+
+
+def cancel_price_change(change):
+    """إلغاء تغيير مجدول لم يطبق بعد؛ يرجع (نجاح، رسالة)"""
+    cancelled = db.session.execute(
+        sa.update(PriceChange)
+        .where(PriceChange.id == change.id, PriceChange.status == 'scheduled')
+        .values(status='cancelled')
+    ).rowcount
+    db.session.commit()
+    if not cancelled:
+        return False, "لا يمكن إلغاء تغيير تم تطبيقه"
+    return True, "تم إلغاء تغيير الأسعار المجدول"
+
+
+def apply_due_price_changes():
+    """تطبيق التغييرات التي حان موعدها بترتيب مواعيدها؛ يرجع [(نجاح، رسالة)]"""
+    due = (PriceChange.query
+           .filter(PriceChange.status == 'scheduled', PriceChange.effective_at <= datetime.utcnow())
+           .order_by(PriceChange.effective_at, PriceChange.id)
+           .all())
+    return [apply_price_change(change) for change in due]
+
+
+@app.cli.command('apply-price-changes')
+@click.option('--interval', default=0, help='Check again every N minutes instead of running once.')
+def apply_price_changes_command(interval):
+    """Apply scheduled price changes whose effective time has passed."""
+    while True:
+        for code in branch_names():
+            with branch_context(code):
+                for success, message in apply_due_price_changes():
+                    click.echo(f"[{code}] {message}", err=not success)
+                db.session.remove()
+        if not interval:
+            return
+        time.sleep(interval * 60)
@@ -0,0 +1,139 @@
+"""
+إرسال بيانات الطباعة دون ملفات مؤقتة
+البيانات تمرر مباشرة إلى stdin لأمر الطباعة (lp / lpr / Out-Printer) مع مهلة محددة،
+أو إلى طابعة عبر مقبس (socket://host:port كما في CUPS) باتصال يبقى مفتوحاً بين الفواتير
+
+الإعداد:
+    MARKET_PRINT_URI=socket://192.168.1.50:9100   # اختياري، وإلا أمر الطباعة في النظام
+    MARKET_PRINT_TIMEOUT=10                        # ثوانٍ لكل مهمة طباعة
+"""
+
+import logging
+import os
+import platform
+import socket
+import subprocess
+import threading
+import time
+from collections import namedtuple
+from urllib.parse import urlsplit
+
+PRINT_TIMEOUT = float(os.environ.get('MARKET_PRINT_TIMEOUT', 10))
+
+# نتيجة مهمة طباعة: returncode لأمر الطباعة (None للمقبس أو عند انتهاء المهلة)
+PrintResult = namedtuple('PrintResult', ['success', 'transport', 'returncode', 'timed_out', 'error', 'elapsed_ms'])
+
+
+class SpoolerTransport:
+    """تمرير البيانات إلى أمر الطباعة في نظام التشغيل عبر stdin"""
+
+    def __init__(self, system=None, timeout=PRINT_TIMEOUT):
+        self.system = system or platform.system()
+        self.timeout = timeout
+        self.name = {'Windows': 'out-printer', 'Darwin': 'lpr'}.get(self.system, 'lp')
+
+    def command(self, printer_name=None, options=None):
+        options = options or {}
+        if self.system == 'Windows':
+            # اسم الطابعة يمرر كمتغير بيئة حتى لا يدخل نص الأمر
+            target = '-Name $env:MARKET_PRINT_TARGET' if printer_name else ''
+            return ['powershell', '-NoProfile', '-NonInteractive', '-Command',
+                    f'[Console]::InputEncoding = [Text.Encoding]::UTF8; $input | Out-Printer {target}']
+        if self.system == 'Darwin':
+            cmd = ['lpr']
+            if printer_name:
+                cmd += ['-P', printer_name]
+        else:
+            cmd = ['lp', '-s']
+            if printer_name:
+                cmd += ['-d', printer_name]
+        for key, value in options.items():
+            cmd += ['-o', f'{key}={value}']
+        return cmd
+
+    def send(self, data, printer_name=None, options=None):
+        started = time.perf_counter()
+        env = None
+        if self.system == 'Windows' and printer_name:
+            env = dict(os.environ, MARKET_PRINT_TARGET=printer_name)
+        try:
+            result = subprocess.run(self.command(printer_name, options), input=data, capture_output=True,
+                                    timeout=self.timeout, env=env)
+        except subprocess.TimeoutExpired:
+            # subprocess.run يوقف العملية قبل رفع الاستثناء
+            return PrintResult(False, self.name, None, True, f'timed out after {self.timeout}s',
+                               (time.perf_counter() - started) * 1000)
+        except OSError as e:
+            return PrintResult(False, self.name, None, False, str(e), (time.perf_counter() - started) * 1000)
+        error = result.stderr.decode('utf-8', errors='replace').strip()
+        return PrintResult(result.returncode == 0, self.name, result.returncode, False, error,
+                           (time.perf_counter() - started) * 1000)
+
+
+class SocketTransport:
+    """إرسال خام إلى طابعة شبكية باتصال واحد يعاد استخدامه"""
+
+    def __init__(self, host, port=9100, timeout=PRINT_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.name = f'socket://{host}:{port}'
+        self._sock = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        if self._sock is None:
+            self._sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        return self._sock
+
+    def close(self):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+            self._sock = None
+
+    def send(self, data, printer_name=None, options=None):
+        started = time.perf_counter()
+        with self._lock:
+            # محاولة ثانية باتصال جديد إذا أغلقت الطابعة الاتصال القديم
+            for attempt in range(2):
+                try:
+                    self._connection().sendall(data)
+                    return PrintResult(True, self.name, None, False, '', (time.perf_counter() - started) * 1000)
+                except socket.timeout:
+                    self.close()
+                    return PrintResult(False, self.name, None, True, f'timed out after {self.timeout}s',
+                                       (time.perf_counter() - started) * 1000)
+                except OSError as e:
+                    self.close()
+                    if attempt == 1:
+                        return PrintResult(False, self.name, None, False, str(e),
+                                           (time.perf_counter() - started) * 1000)
+
+
+def load_print_transport():
+    """وسيلة الطباعة حسب MARKET_PRINT_URI، وإلا أمر الطباعة في النظام"""
+    uri = os.environ.get('MARKET_PRINT_URI', '').strip()
+    if uri:
+        parts = urlsplit(uri)
+        if parts.scheme == 'socket' and parts.hostname:
+            return SocketTransport(parts.hostname, parts.port or 9100)
+        logging.error(f"Unsupported MARKET_PRINT_URI: {uri}")
+    return SpoolerTransport()
+
+
+def send_to_printer(data, printer_name=None, options=None):
+    """طباعة بيانات (نص أو bytes) وإرجاع PrintResult؛ الفشل يسجل هنا"""
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    result = print_transport.send(data, printer_name, options)
+    if not result.success:
+        logging.error(f"Print via {result.transport} failed (exit {result.returncode}, "
+                      f"timed out: {result.timed_out}): {result.error}")
+    return result
+
+
+# وسيلة الطباعة العامة
+print_transport = load_print_transport()
@@ -2,7 +2,8 @@ import subprocess
 import os
 import platform
 import logging
-from datetime import datetime
+
+from print_transport import send_to_printer
 
 def print_invoice_direct(invoice_path, printer_name=None):
     """Print invoice directly to printer"""
@@ -53,7 +54,7 @@ def print_invoice_direct(invoice_path, printer_name=None):
             return False, "نظام التشغيل غير مدعوم للطباعة المباشرة"
         
         if result.returncode == 0:
-            logging.info(f"Invoice {invoice_path} printed successfully")
+            logging.info("Invoice %s printed successfully", invoice_path)
             return True, "تم إرسال الملف للطباعة بنجاح"
         else:
             logging.error(f"Print failed: {result.stderr}")
@@ -117,37 +118,15 @@ def print_receipt_thermal(sale_data, printer_name=None):
         # Create simple thermal receipt format
         receipt_text = generate_thermal_receipt_text(sale_data)
         
-        # Save as temporary text file
-        temp_file = f"static/temp/receipt_{sale_data['id']}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
-        os.makedirs(os.path.dirname(temp_file), exist_ok=True)
-        
-        with open(temp_file, 'w', encoding='utf-8') as f:
-            f.write(receipt_text)
-        
-        # Print using system command
-        system = platform.system()
-        
-        if system == "Linux":
-            if printer_name:
-                result = subprocess.run([
-                    "lp", "-d", printer_name, "-o", "cpi=12", "-o", "lpi=8", temp_file
-                ], capture_output=True, text=True)
-            else:
-                result = subprocess.run([
-                    "lp", "-o", "cpi=12", "-o", "lpi=8", temp_file
-                ], capture_output=True, text=True)
-        else:
-            # Fallback to regular printing
-            return print_invoice_direct(temp_file, printer_name)
-        
-        # Clean up temp file
-        if os.path.exists(temp_file):
-            os.remove(temp_file)
+        # Stream the receipt straight to the spooler (no temp file under static/)
+        result = send_to_printer(receipt_text, printer_name, {'cpi': 12, 'lpi': 8})
         
-        if result.returncode == 0:
+        if result.success:
             return True, "تم طباعة الإيصال الحراري بنجاح"
+        elif result.timed_out:
+            return False, "انتهت مهلة طباعة الإيصال"
         else:
-            return False, f"خطأ في طباعة الإيصال: {result.stderr}"
+            return False, f"خطأ في طباعة الإيصال: {result.error}"
             
     except Exception as e:
         logging.error(f"Thermal print error: {str(e)}")
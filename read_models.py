@@ -0,0 +1,130 @@
+"""
+طبقة قراءة خفيفة للقوائم والتصدير
+- صفحات العرض (قائمة المنتجات، التقارير، أزرار البيع السريع) والتصدير تحتاج أعمدة فقط وليس كائنات ORM:
+  استعلام أعمدة يرجع صفوفاً (Row: tuple بأسماء الأعمدة، تقرأ في القوالب كـ product.name)
+  دون identity map أو تتبع تغييرات في الجلسة
+- المنتجات تقرأ على دفعات بالمفتاح (id > آخر رقم)، فلا تحمل القائمة كلها في الذاكرة، وكل دفعة استعلام
+  مستقل فيمكن عمل commit بين الدفعات (نقاط حفظ التقدم في التصدير)
+- عدد عناصر كل بيع يحسب في نفس الاستعلام بدلاً من تحميل sale.items لكل بيع
+- التعديل والعلاقات (إعادة الطباعة، تعديل منتج) تبقى على نماذج ORM
+
+    flask read-benchmark --rows 10000     # الوقت والذاكرة لكل 10 آلاف صف مقارنة بـ .all()
+"""
+
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import click
+import sqlalchemy as sa
+from sqlalchemy.orm import Session, load_only
+
+from app import app, db
+from models import Customer, Product, Sale, SaleItem
+
+# عدد الصفوف في كل دفعة
+READ_BATCH = 1000
+
+PRODUCT_COLUMNS = (Product.id, Product.product_id, Product.name, Product.price, Product.quantity, Product.category,
+                   Product.qr_code_path, Product.date_added, Product.created_at, Product.updated_at)
+
+# أزرار الإضافة السريعة في شاشة البيع
+QUICK_ADD_COLUMNS = (Product.id, Product.product_id, Product.name, Product.price)
+
+
+def product_rows(*criteria, columns=PRODUCT_COLUMNS, batch=READ_BATCH, session=None):
+    """صفوف المنتجات بترتيب Product.id على دفعات؛ columns يجب أن تبدأ بـ Product.id"""
+    session = session or db.session
+    last_id = 0
+    while True:
+        rows = session.execute(sa.select(*columns)
+                               .where(Product.id > last_id, *criteria)
+                               .order_by(Product.id)
+                               .limit(batch)).all()
+        yield from rows
+        if len(rows) < batch:
+            return
+        last_id = rows[-1].id
+
+
+def product_count(*criteria, session=None):
+    session = session or db.session
+    return session.execute(sa.select(sa.func.count(Product.id)).where(*criteria)).scalar()
+
+
+def sale_rows(start=None, end=None, session=None):
+    """صفوف المبيعات في الفترة (الأحدث أولاً) مع عدد العناصر في عمود item_count"""
+    session = session or db.session
+    # ربط وتجميع وليس استعلاماً فرعياً لكل بيع: يعمل بسرعة حتى في الأرشيفات القديمة بلا فهرس على sale_id
+    statement = (sa.select(Sale.id, Sale.customer_id, Sale.customer_name, Sale.customer_phone, Sale.total_amount,
+                           Sale.payment_method, Sale.sale_date, Sale.print_date,
+                           sa.func.count(SaleItem.id).label('item_count'))
+                 .outerjoin(SaleItem, SaleItem.sale_id == Sale.id)
+                 .group_by(Sale.id))
+    if start:
+        statement = statement.where(Sale.sale_date >= start)
+    if end:
+        statement = statement.where(Sale.sale_date <= end)
+    return session.execute(statement.order_by(Sale.sale_date.desc())).all()
+
+
+@app.cli.command('read-benchmark')
+@click.option('--rows', default=10000, show_default=True, help='Products and sales to generate.')
+def read_benchmark_command(rows):
+    """Compare ORM .all() with column rows for the product list and sales report on a scratch database."""
+    workdir = tempfile.mkdtemp(prefix='read-bench-')
+    engine = sa.create_engine(f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+    db.metadata.create_all(engine, tables=[Customer.__table__, Product.__table__, Sale.__table__, SaleItem.__table__])
+    now = datetime.utcnow()
+    with engine.begin() as conn:
+        conn.execute(sa.insert(Product), [
+            {'product_id': f"B{i:07d}", 'name': f"منتج تجريبي {i}", 'price': 10 + i % 90, 'quantity': i % 40,
+             'category': f"فئة {i % 12}", 'qr_code_path': f"static/qr_codes/B{i:07d}.png", 'date_added': now,
+             'created_at': now, 'updated_at': now} for i in range(rows)])
+        conn.execute(sa.insert(Sale), [
+            {'customer_name': f"عميل {i}", 'customer_phone': f"010{i:08d}", 'total_amount': 30.0,
+             'sale_date': now, 'payment_method': 'نقدي'} for i in range(rows)])
+        conn.execute(sa.insert(SaleItem), [
+            {'sale_id': 1 + i // 3, 'product_id': 1 + i % rows, 'quantity': 1, 'unit_price': 10.0, 'total_price': 10.0}
+            for i in range(rows * 3)])
+
+    def consume_products(products):
+        # ما يقرؤه قالب قائمة المنتجات من كل صف
+        return sum(len(p.name) + len(p.product_id) + len(p.category) + p.quantity for p in products
+                   if p.price >= 0 and p.date_added is not None)
+
+    def consume_sales(sales, count_items):
+        return sum(count_items(s) + len(s.customer_name or '') for s in sales if s.total_amount >= 0)
+
+    cases = [
+        ('products: ORM .all()', lambda s: consume_products(s.query(Product).all())),
+        ('products: load_only', lambda s: consume_products(
+            s.execute(sa.select(Product).options(load_only(*PRODUCT_COLUMNS))).scalars().all())),
+        ('products: rows', lambda s: consume_products(s.execute(sa.select(*PRODUCT_COLUMNS)).all())),
+        ('products: row batches', lambda s: consume_products(product_rows(session=s))),
+        ('sales: ORM + items', lambda s: consume_sales(s.query(Sale).order_by(Sale.sale_date.desc()).all(),
+                                                       lambda sale: len(sale.items))),
+        ('sales: rows', lambda s: consume_sales(sale_rows(session=s), lambda sale: sale.item_count)),
+    ]
+    click.echo(f"{rows} products, {rows} sales")
+    click.echo(f"{'':<24}{'ms/10k':>10}{'peak KiB/10k':>16}")
+    try:
+        for label, case in cases:
+            with Session(engine) as session:
+                started = time.perf_counter()
+                case(session)
+                elapsed = time.perf_counter() - started
+            # الذاكرة في تشغيل منفصل لأن tracemalloc يبطئ التنفيذ
+            with Session(engine) as session:
+                tracemalloc.start()
+                case(session)
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+            scale = 10000 / rows
+            click.echo(f"{label:<24}{elapsed * 1000 * scale:>10.1f}{peak / 1024 * scale:>16.0f}")
+    finally:
+        engine.dispose()
+        shutil.rmtree(workdir, ignore_errors=True)
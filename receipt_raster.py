@@ -0,0 +1,211 @@
+"""
+رسم الإيصالات كصورة نقطية للطابعات الحرارية
+معظم الطابعات الحرارية لا تطبع العربية كنص، فنرسم الإيصال بـ Pillow كصورة أبيض وأسود بعرض نقاط الطابعة
+ونرسله بأوامر ESC/POS النقطية. النصوص المتكررة (الرأس والتذييل وأسماء المنتجات) ترسم مرة واحدة وتحفظ في الذاكرة
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from PIL import Image, ImageDraw, ImageFont, features
+
+try:
+    import arabic_reshaper
+    from bidi.algorithm import get_display
+except ImportError:  # تشكيل احتياطي عند عدم توفر libraqm
+    arabic_reshaper = None
+
+# عرض الطباعة بالنقاط: 576 لورق 80 مم و 384 لورق 58 مم (203 نقطة/بوصة)
+RECEIPT_DOT_WIDTH = int(os.environ.get('MARKET_RECEIPT_WIDTH', 576))
+
+NORMAL_SIZE = 24
+LARGE_SIZE = 34
+MARGIN = 8
+
+# عدد القطع المرسومة المحفوظة (نصوص وأسطر كاملة)
+ATLAS_SIZE = 4096
+
+FONT_CANDIDATES = [
+    '/usr/share/fonts/truetype/noto/NotoNaskhArabic-Regular.ttf',
+    '/usr/share/fonts/truetype/noto/NotoSansArabic-Regular.ttf',
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',
+    'C:\\Windows\\Fonts\\tahoma.ttf',
+    'C:\\Windows\\Fonts\\arial.ttf',
+    '/System/Library/Fonts/Supplemental/Arial.ttf',
+]
+
+
+def find_font():
+    path = os.environ.get('MARKET_RECEIPT_FONT')
+    if path:
+        return path
+    for candidate in FONT_CANDIDATES:
+        if os.path.exists(candidate):
+            return candidate
+    return None
+
+
+def receipt_lines(sale_data):
+    """تخطيط الإيصال بنفس محتوى generate_arabic_invoice"""
+    lines = [
+        ('center', "سوق المصطفى التجاري", LARGE_SIZE),
+        ('center', "Al-Mustafa Commercial Market", NORMAL_SIZE),
+        ('center', "شارع الجامعة، القاهرة، مصر", NORMAL_SIZE),
+        ('center', "هاتف: 01234567890", NORMAL_SIZE),
+        ('rule',),
+        ('right', f"فاتورة رقم: {sale_data['id']}"),
+        ('right', f"التاريخ: {sale_data['date']}"),
+        ('right', f"الوقت: {sale_data['time']}"),
+    ]
+    if sale_data.get('customer_name'):
+        lines.append(('right', f"العميل: {sale_data['customer_name']}"))
+    if sale_data.get('customer_phone'):
+        lines.append(('right', f"الهاتف: {sale_data['customer_phone']}"))
+
+    lines += [('rule',), ('row', "المنتج", "الكمية", "السعر"), ('rule',)]
+    for item in sale_data['items']:
+        lines.append(('row', item['name'], str(item['quantity']), f"{item['total_price']:.2f}"))
+    lines += [
+        ('rule',),
+        ('right', f"المجموع الكلي: {sale_data['total']:.2f} جنيه مصري"),
+        ('rule',),
+        ('center', "شكراً لتعاملكم معنا", NORMAL_SIZE),
+        ('center', "نتمنى لكم يوماً سعيداً", NORMAL_SIZE),
+        ('space',),
+    ]
+    return lines
+
+
+class ReceiptRenderer:
+    def __init__(self, width=RECEIPT_DOT_WIDTH, font_path=None, atlas_size=ATLAS_SIZE):
+        self.width = width
+        self.font_path = font_path or find_font()
+        self.atlas_size = atlas_size
+        self.raqm = features.check('raqm')
+        self._fonts = {}
+        self._atlas = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.last_render_ms = 0.0
+        if self.font_path is None:
+            logging.error("No Arabic-capable font found for raster receipts; set MARKET_RECEIPT_FONT")
+        if not self.raqm and arabic_reshaper is None:
+            logging.warning("Neither libraqm nor arabic-reshaper/python-bidi is available; Arabic will not be shaped")
+
+    def _font(self, size):
+        font = self._fonts.get(size)
+        if font is None:
+            if self.font_path:
+                layout = ImageFont.Layout.RAQM if self.raqm else ImageFont.Layout.BASIC
+                font = ImageFont.truetype(self.font_path, size, layout_engine=layout)
+            else:
+                font = ImageFont.load_default(size)
+            self._fonts[size] = font
+        return font
+
+    def _cached(self, key, draw):
+        with self._lock:
+            image = self._atlas.get(key)
+            if image is not None:
+                self._atlas.move_to_end(key)
+                self.hits += 1
+                return image
+        image = draw()
+        with self._lock:
+            self.misses += 1
+            self._atlas[key] = image
+            if len(self._atlas) > self.atlas_size:
+                self._atlas.popitem(last=False)
+        return image
+
+    def _line_height(self, size):
+        ascent, descent = self._font(size).getmetrics()
+        return ascent + descent
+
+    def text(self, text, size=NORMAL_SIZE):
+        """صورة نص واحد بعرضه الفعلي (مشكّل ومن اليمين لليسار)"""
+        def draw():
+            font = self._font(size)
+            if self.raqm:
+                options = {'direction': 'rtl'}
+                shaped = text
+            else:
+                options = {}
+                shaped = get_display(arabic_reshaper.reshape(text)) if arabic_reshaper else text
+            width = max(1, min(self.width - 2 * MARGIN, int(font.getlength(shaped, **options)) + 1))
+            image = Image.new('1', (width, self._line_height(size)), 1)
+            ImageDraw.Draw(image).text((0, 0), shaped, font=font, fill=0, **options)
+            return image
+        return self._cached(('text', text, size), draw)
+
+    def line(self, spec):
+        """سطر كامل بعرض الطابعة؛ الأسطر الثابتة (الرأس، الفواصل، التذييل) تحفظ كاملة"""
+        kind = spec[0]
+        if kind == 'row':
+            # صفوف المنتجات تتغير أرقامها، فتركب من قطع محفوظة بدلاً من حفظ السطر كله
+            return self._compose(spec)
+        return self._cached(('line',) + spec, lambda: self._compose(spec))
+
+    def _compose(self, spec):
+        kind = spec[0]
+        if kind == 'space':
+            return Image.new('1', (self.width, self._line_height(NORMAL_SIZE)), 1)
+        if kind == 'rule':
+            image = Image.new('1', (self.width, 12), 1)
+            ImageDraw.Draw(image).line([(MARGIN, 6), (self.width - MARGIN, 6)], fill=0, width=2)
+            return image
+
+        size = spec[2] if kind == 'center' else NORMAL_SIZE
+        image = Image.new('1', (self.width, self._line_height(size) + 4), 1)
+        if kind == 'center':
+            fragment = self.text(spec[1], size)
+            image.paste(fragment, ((self.width - fragment.width) // 2, 2))
+        elif kind == 'right':
+            fragment = self.text(spec[1], size)
+            image.paste(fragment, (self.width - MARGIN - fragment.width, 2))
+        elif kind == 'row':
+            # الاسم يميناً، الكمية في المنتصف، السعر يساراً
+            name, quantity, price = (self.text(value) for value in spec[1:4])
+            name_space = self.width * 11 // 20
+            image.paste(name.crop((name.width - min(name.width, name_space), 0, name.width, name.height)),
+                        (self.width - MARGIN - min(name.width, name_space), 2))
+            image.paste(quantity, (self.width * 3 // 10 - quantity.width // 2, 2))
+            image.paste(price, (MARGIN, 2))
+        return image
+
+    def render(self, lines):
+        """رسم الإيصال كاملاً كصورة 1-bit بعرض نقاط الطابعة"""
+        started = time.perf_counter()
+        images = [self.line(spec) for spec in lines]
+        receipt = Image.new('1', (self.width, sum(image.height for image in images)), 1)
+        y = 0
+        for image in images:
+            receipt.paste(image, (0, y))
+            y += image.height
+        self.last_render_ms = (time.perf_counter() - started) * 1000
+        return receipt
+
+    def stats(self):
+        return {
+            'cached': len(self._atlas),
+            'hits': self.hits,
+            'misses': self.misses,
+            'last_render_ms': round(self.last_render_ms, 2),
+        }
+
+
+def raster_bytes(image):
+    """أوامر ESC/POS النقطية للصورة (للإرسال الخام إلى طابعة شبكية)"""
+    from escpos.printer import Dummy
+    printer = Dummy()
+    printer.image(image, impl='bitImageRaster')
+    printer.cut()
+    return printer.output
+
+
+# الرسام العام للإيصالات (الذاكرة مشتركة بين كل الطلبات)
+receipt_renderer = ReceiptRenderer()
@@ -0,0 +1,178 @@
+"""
+التخزين المؤقت لعرض الصفحات
+- ذاكرة Jinja للقوالب المترجمة على القرص (تبقى بعد إعادة تشغيل العمال)
+- أجزاء الصفحات الثقيلة (صفوف المنتجات، آخر المبيعات، جدول التقارير) تحفظ مع رقم إصدار البيانات
+- رقم الإصدار يزيد تلقائياً بعد commit كل كتابة على المنتجات أو المبيعات، فتتغير المفاتيح ولا نحتاج لمسح الذاكرة
+- الصفحات التي لم تتغير ترد بـ 304 عبر ETag و Last-Modified
+"""
+
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+import sqlalchemy as sa
+from flask import g, has_app_context, make_response, request, session, Response
+from jinja2 import FileSystemBytecodeCache
+from markupsafe import Markup
+
+from app import app, db
+from models import DataVersion
+from branches import BranchSession, branch_engine, current_branch
+
+# الجداول ← مجموعة الإصدار التي تزيد عند الكتابة عليها
+VERSIONED_TABLES = {
+    'product': 'products',
+    'product_tombstone': 'products',
+    'sale': 'sales',
+    'sale_item': 'sales',
+}
+
+FRAGMENT_CACHE_SIZE = 256
+
+_bytecode_dir = os.path.join(app.instance_path, 'jinja_cache')
+os.makedirs(_bytecode_dir, exist_ok=True)
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache(_bytecode_dir)
+
+
+def bump_versions(session, names):
+    """تسجيل مجموعات الإصدار التي تغيرت؛ الزيادة نفسها تتم بعد commit
+
+    زيادة الإصدار داخل معاملة البيع كانت تقفل نفس صف data_version حتى commit، فتنتظر كل عمليات البيع
+    المتزامنة في الفرع بعضها (Postgres). بعد commit لا يقرأ أحد الإصدار الجديد قبل البيانات الجديدة،
+    وأسوأ ما يحدث بين الخطوتين صفحة أحدث من إصدارها، لا صفحة قديمة بإصدار جديد
+    """
+    pending = session.info.setdefault('_pending_versions', {})
+    pending.setdefault(current_branch(), set()).update(names)
+
+
+def _apply_versions(code, names):
+    """زيادة أرقام الإصدار في معاملة قصيرة مستقلة على قاعدة بيانات الفرع"""
+    table = DataVersion.__table__
+    now = datetime.utcnow()
+    with branch_engine(db, code).begin() as conn:
+        for name in sorted(names):
+            result = conn.execute(table.update().where(table.c.name == name)
+                                  .values(version=table.c.version + 1, updated_at=now))
+            if result.rowcount == 0:
+                conn.execute(table.insert().values(name=name, version=1, updated_at=now))
+
+
+@sa.event.listens_for(BranchSession, 'after_flush')
+def _bump_on_flush(session, flush_context):
+    names = set()
+    for obj in list(session.new) + list(session.deleted) + [obj for obj in session.dirty if session.is_modified(obj)]:
+        name = VERSIONED_TABLES.get(sa.inspect(obj).mapper.local_table.name)
+        if name:
+            names.add(name)
+    if names:
+        bump_versions(session, names)
+
+
+@sa.event.listens_for(BranchSession, 'after_commit')
+def _bump_after_commit(session):
+    pending = session.info.pop('_pending_versions', None)
+    if not pending:
+        return
+    for code, names in pending.items():
+        try:
+            _apply_versions(code, names)
+        except Exception as e:
+            # البيانات محفوظة؛ الصفحات المخزنة تتحدث مع الكتابة التالية
+            logging.error(f"Data version bump for {code} failed: {str(e)}")
+    if has_app_context():
+        g.pop('_data_versions', None)
+
+
+@sa.event.listens_for(BranchSession, 'after_soft_rollback')
+def _discard_versions(session, previous_transaction):
+    # التراجع عن المعاملة كلها (وليس savepoint) يلغي ما سجل فيها
+    if previous_transaction.parent is None:
+        session.info.pop('_pending_versions', None)
+
+
+def data_versions():
+    """{الاسم: (الإصدار، وقت آخر تعديل)} للفرع الحالي - استعلام واحد لكل طلب"""
+    versions = g.get('_data_versions')
+    if versions is None:
+        rows = db.session.execute(sa.select(DataVersion.name, DataVersion.version, DataVersion.updated_at))
+        versions = {name: (version, updated_at) for name, version, updated_at in rows}
+        g._data_versions = versions
+    return versions
+
+
+def data_version(name):
+    return data_versions().get(name, (0, None))[0]
+
+
+class FragmentCache:
+    def __init__(self, max_entries=FRAGMENT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get_or_render(self, key, render):
+        with self._lock:
+            html = self._entries.get(key)
+            if html is not None:
+                self._entries.move_to_end(key)
+                return html
+        html = render()
+        with self._lock:
+            self._entries[key] = html
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return html
+
+
+# ذاكرة الأجزاء العامة للعملية (المفتاح يتضمن الفرع ورقم الإصدار)
+fragment_cache = FragmentCache()
+
+
+def cached_fragment(name, *key, caller):
+    """الاستخدام في القالب: {% call cached_fragment('product_rows', data_version('products')) %}...{% endcall %}"""
+    return Markup(fragment_cache.get_or_render((current_branch(), name) + key, caller))
+
+
+app.add_template_global(cached_fragment)
+app.add_template_global(data_version)
+
+
+def cached_page(depends, key, render):
+    """عرض الصفحة أو الرد بـ 304 إذا لم تتغير البيانات التي تعتمد عليها
+
+    depends: مجموعات الإصدار ('products', 'sales')
+    key: باقي ما يغير الصفحة (معاملات الرابط، التاريخ...)
+    render: دالة تنفذ الاستعلامات وتعرض القالب - لا تستدعى عند 304
+    """
+    # رسائل flash تظهر مرة واحدة، فلا يجوز تخزين الصفحة التي تحتويها
+    if '_flashes' in session:
+        response = make_response(render())
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+
+    versions = data_versions()
+    state = [versions.get(name, (0, None)) for name in depends]
+    etag = hashlib.sha1(repr((request.path, current_branch(), session.get('user_id'),
+                              [version for version, _ in state], key)).encode()).hexdigest()
+    modified = [updated_at for _, updated_at in state if updated_at]
+    last_modified = max(modified).replace(microsecond=0) if modified else None
+
+    if request.if_none_match:
+        not_modified = request.if_none_match.contains(etag)
+    else:
+        # Last-Modified وحده لا يميز المستخدم أو معاملات الرابط، فيقبل فقط مع نفس المفتاح الثابت
+        not_modified = (not key and last_modified is not None and request.if_modified_since is not None
+                        and last_modified <= request.if_modified_since.replace(tzinfo=None))
+    if not_modified:
+        response = Response(status=304)
+    else:
+        response = make_response(render())
+
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
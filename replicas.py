@@ -0,0 +1,167 @@
+"""
+نسخ القراءة فقط للتقارير
+- التقارير الطويلة والتصدير لا تقرأ من قاعدة البيانات التي يكتب فيها البيع
+- Postgres: رابط نسخة متزامنة (MARKET_REPLICA_URL للقاعدة الرئيسية، و replica_url لكل فرع في MARKET_BRANCHES)
+- SQLite: ملف لقطة في instance/replicas ينسخ بـ backup API كل MARKET_SNAPSHOT_MINUTES دقيقة
+  (0 = معطل والتقارير تقرأ من القاعدة الأساسية)
+- المسار أو العملية يختار القراءة من النسخة بـ replica_reads()، والجلسة توجه استعلامات SELECT فقط إليها
+
+    @app.route('/reports')
+    @login_required
+    @replica_reads()
+    def reports(): ...
+
+    flask refresh-snapshots --interval 5     # تحديث اللقطات من عملية منفصلة بدلاً من طلبات التقارير
+"""
+
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import click
+import sqlalchemy as sa
+from flask import current_app, g
+from sqlalchemy.pool import NullPool
+
+from app import app, db
+from backup import online_copy
+from branches import branch_engine, branch_names, current_branch
+
+SNAPSHOT_DIR = os.path.join(app.instance_path, 'replicas')
+SNAPSHOT_MINUTES = float(os.environ.get('MARKET_SNAPSHOT_MINUTES', 0))
+
+# أقل مدة بين فحصين لعمر اللقطة
+CHECK_INTERVAL = 10
+
+
+@contextmanager
+def replica_reads():
+    """قراءات الجلسة داخل هذا النطاق تذهب لنسخة القراءة إن وجدت؛ يستخدم أيضاً كمزخرف للمسارات"""
+    previous = g.get('read_replica', False)
+    g.read_replica = True
+    try:
+        yield
+    finally:
+        g.read_replica = previous
+
+
+def snapshot_path(code):
+    return os.path.join(SNAPSHOT_DIR, f"{code}.db")
+
+
+class ReplicaRouter:
+    """محركات نسخ القراءة لكل قاعدة بيانات، تنشأ عند أول تقرير"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._engines = {}
+        self._checked = {}
+        self._refresh_locks = {}
+
+    def engine(self, code):
+        """محرك القراءة للفرع، أو None للقراءة من القاعدة الأساسية"""
+        url = current_app.config.get('MARKET_REPLICA_URLS', {}).get(code)
+        if url is None:
+            if not SNAPSHOT_MINUTES or branch_engine(db, code).dialect.name != 'sqlite':
+                return None
+            self.ensure_fresh(code)
+        engine = self._engines.get(code)
+        if engine is None:
+            with self._lock:
+                engine = self._engines.get(code)
+                if engine is None:
+                    engine = self._engines[code] = self._create_engine(code, url)
+        return engine
+
+    def _create_engine(self, code, url):
+        if url is not None:
+            # نفس خيارات الأساسية (مخطط الفرع في Postgres)
+            return sa.create_engine(url, execution_options=branch_engine(db, code).get_execution_options())
+        # بدون تجميع اتصالات: كل اتصال يفتح أحدث ملف لقطة بعد استبداله
+        return sa.create_engine(f"sqlite:///file:{snapshot_path(code)}?mode=ro&uri=true", poolclass=NullPool)
+
+    def ensure_fresh(self, code):
+        now = time.monotonic()
+        if now - self._checked.get(code, 0) < CHECK_INTERVAL:
+            return
+        self._checked[code] = now
+        as_of = snapshot_time(code)
+        if as_of is None or datetime.utcnow() - as_of > timedelta(minutes=SNAPSHOT_MINUTES):
+            self.refresh_snapshot(code)
+
+    def refresh_snapshot(self, code):
+        """نسخ القاعدة الأساسية إلى ملف اللقطة ثم استبداله دفعة واحدة"""
+        with self._lock:
+            refresh_lock = self._refresh_locks.setdefault(code, threading.Lock())
+        path = snapshot_path(code)
+        # طلب واحد يحدث اللقطة والباقي يقرأ اللقطة الحالية (أو ينتظر أول لقطة)
+        if not refresh_lock.acquire(blocking=not os.path.exists(path)):
+            return False
+        try:
+            os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+            temp_path = f"{path}.{os.getpid()}.tmp"
+            started = datetime.utcnow()
+            online_copy(branch_engine(db, code).url.database, temp_path)
+            os.replace(temp_path, path)
+            # وقت الملف = وقت بداية النسخ، وهو ما تعرضه صفحة التقارير
+            stamp = (started - datetime(1970, 1, 1)).total_seconds()
+            os.utime(path, (stamp, stamp))
+            return True
+        except Exception as e:
+            logging.error(f"Snapshot refresh for {code} failed: {str(e)}")
+            return False
+        finally:
+            refresh_lock.release()
+
+
+replica_router = ReplicaRouter()
+
+
+def replica_engine(code):
+    return replica_router.engine(code)
+
+
+def snapshot_time(code):
+    path = snapshot_path(code)
+    if not os.path.exists(path):
+        return None
+    return datetime(1970, 1, 1) + timedelta(seconds=os.path.getmtime(path))
+
+
+def replica_status(code=None):
+    """مصدر بيانات التقارير ووقتها (UTC) للعرض؛ None إذا كانت التقارير تقرأ من القاعدة الأساسية"""
+    code = code or current_branch()
+    engine = replica_engine(code)
+    if engine is None:
+        return None
+    if engine.dialect.name == 'sqlite':
+        return {'kind': 'snapshot', 'as_of': snapshot_time(code)}
+    try:
+        with engine.connect() as conn:
+            lag = conn.execute(sa.text("SELECT now() - pg_last_xact_replay_timestamp()")).scalar()
+    except Exception as e:
+        logging.error(f"Replica lag check for {code} failed: {str(e)}")
+        lag = None
+    # None: النسخة ليست في وضع استرجاع (أو لم تستقبل شيئاً بعد)
+    return {'kind': 'replica', 'as_of': datetime.utcnow() - lag if lag is not None else None}
+
+
+@app.cli.command('refresh-snapshots')
+@click.option('--interval', default=0, help='Repeat every N minutes instead of running once.')
+def refresh_snapshots_command(interval):
+    """Copy each SQLite database to its read-only reporting snapshot."""
+    while True:
+        for code in branch_names():
+            if branch_engine(db, code).dialect.name != 'sqlite':
+                continue
+            started = time.perf_counter()
+            if replica_router.refresh_snapshot(code):
+                click.echo(f"[{code}] snapshot refreshed ({(time.perf_counter() - started) * 1000:.0f} ms)")
+            else:
+                click.echo(f"[{code}] snapshot refresh failed", err=True)
+        if not interval:
+            return
+        time.sleep(interval * 60)
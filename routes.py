@@ -1,15 +1,62 @@
-from flask import render_template, request, redirect, url_for, session, flash, jsonify
+from flask import render_template, request, redirect, url_for, session, flash, jsonify, Response, g, abort, send_file
 from werkzeug.security import check_password_hash, generate_password_hash
 from app import app, db
-from models import User, Product, Sale, SaleItem
+from models import User, Product, Sale, Customer, DeviceToken, Job, DayClose, PriceChange
 from direct_print import print_system
+from network_print import network_printers
+from forecasting import stock_forecaster
+from top_sellers import top_sellers, quick_add_products
+from live_updates import dashboard_publisher
+from branches import DEFAULT_BRANCH, branch_names, current_branch
+from auth import login_required, issue_device_token, revoke_device_token
+from branch_reports import consolidated_report
+from archive import archived_sales, find_sale
+from assets import asset_file, IMMUTABLE_CACHE
+from render_cache import cached_page, bump_versions, data_version
+from customers import search_customers, customer_payload
+from jobs import job_runner, job_payload
+from day_close import close_day, unclosed_days, z_report_pdf
+from pricing import KINDS, create_price_change, cancel_price_change, local_to_utc
+from bulk_products import new_product_ids, bulk_create_products, queue_missing_qr_codes
+from replicas import replica_reads, replica_status
+from read_models import product_rows, product_count, sale_rows
+from sale_journal import (sale_journal, journal_enabled, new_sale_record, apply_sales, load_stock, receipt_data,
+                          load_receipt, receipt_from_sale)
+from catalog_sync import build_snapshot, build_changes, parse_cursor, record_tombstone, binary_catalog, negotiate_encoding
 import os
-from datetime import datetime
+import logging
+import hashlib
+import sqlalchemy as sa
+from datetime import datetime, date
 import json
-import qrcode
 from io import BytesIO
 import base64
 
+@app.before_request
+def select_branch():
+    # كل طلب يعمل على قسم بيانات فرع المستخدم
+    branch = session.get('branch', DEFAULT_BRANCH)
+    g.branch = branch if branch in branch_names() else DEFAULT_BRANCH
+
+@app.context_processor
+def inject_branches():
+    return {'branch_names': branch_names(), 'current_branch': g.get('branch', DEFAULT_BRANCH)}
+
+@app.route('/assets/<path:filename>')
+def asset(filename):
+    # الملفات ذات البصمة لا تتغير أبداً، فتخزن في المتصفح بلا انتهاء
+    found = asset_file(filename, request.headers.get('Accept-Encoding'))
+    if found is None:
+        abort(404)
+    
+    path, encoding, mimetype = found
+    response = send_file(path, mimetype=mimetype, conditional=True)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = IMMUTABLE_CACHE
+    return response
+
 @app.route('/')
 def index():
     if 'user_id' in session:
@@ -27,6 +74,8 @@ def login():
         if user and check_password_hash(user.password_hash, password):
             session['user_id'] = user.id
             session['username'] = user.username
+            session['branch'] = user.branch_code or DEFAULT_BRANCH
+            session['head_office'] = bool(user.head_office)
             flash('تم تسجيل الدخول بنجاح', 'success')
             return redirect(url_for('dashboard'))
         else:
@@ -41,52 +90,77 @@ def logout():
     return redirect(url_for('login'))
 
 @app.route('/dashboard')
+@login_required
 def dashboard():
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
-    
-    # إحصائيات اليوم
-    today = datetime.now().date()
-    today_sales = Sale.query.filter(
-        Sale.sale_date >= datetime.combine(today, datetime.min.time())
-    ).all()
-    
-    total_sales_today = len(today_sales)
-    total_revenue_today = sum(sale.total_amount for sale in today_sales)
-    total_products = Product.query.count()
-    low_stock_products = Product.query.filter(Product.quantity <= 5).count()
-    
-    # آخر 5 مبيعات
-    recent_sales = Sale.query.order_by(Sale.sale_date.desc()).limit(5).all()
-    
-    return render_template('dashboard.html',
-                         total_sales_today=total_sales_today,
-                         total_revenue_today=total_revenue_today,
-                         total_products=total_products,
-                         low_stock_products=low_stock_products,
-                         recent_sales=recent_sales)
+    # إحصائيات اليوم من الملخص المشترك بدلاً من الاستعلام في كل تحميل؛ يعاد تحميله إذا تغيرت البيانات
+    # من عامل آخر بعد بنائه
+    stats = dashboard_publisher.snapshot(max_age=dashboard_publisher.reconcile_interval,
+                                         versions=(data_version('products'), data_version('sales')))
+    
+    def render():
+        at_risk_products = stock_forecaster.at_risk_count()
+        
+        return render_template('dashboard.html',
+                             total_sales_today=stats['total_sales_today'],
+                             total_revenue_today=stats['total_revenue_today'],
+                             total_products=stats['total_products'],
+                             low_stock_products=stats['low_stock_products'],
+                             at_risk_products=at_risk_products,
+                             recent_sales=stats['recent_sales'])
+    
+    # محتوى الملخص نفسه في المفتاح: ما يعرضه هذا العامل هو ما يحدد ETag
+    summary = (stats['total_sales_today'], stats['total_revenue_today'], stats['total_products'],
+               stats['low_stock_products'], [sale['id'] for sale in stats['recent_sales']])
+    return cached_page(('products', 'sales'), (datetime.now().date().isoformat(), summary), render)
+
+@app.route('/dashboard/stream')
+@login_required(api=True)
+def dashboard_stream():
+    initial = dashboard_publisher.snapshot()
+    subscriber = dashboard_publisher.subscribe()
+    response = Response(dashboard_publisher.stream(subscriber, initial), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/low_stock_report')
+@login_required
+def low_stock_report():
+    sort_by = request.args.get('sort', 'days_left')
+    descending = request.args.get('order') == 'desc'
+    show_all = request.args.get('all') == '1'
+    
+    report = stock_forecaster.low_stock_report(sort_by=sort_by,
+                                               descending=descending,
+                                               only_at_risk=not show_all)
+    
+    return render_template('low_stock_report.html',
+                         report=report,
+                         sort_by=sort_by,
+                         descending=descending,
+                         show_all=show_all,
+                         lead_time_days=stock_forecaster.lead_time_days,
+                         cover_days=stock_forecaster.cover_days)
 
 @app.route('/products')
+@login_required
 def products():
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
-    
-    products = Product.query.all()
-    return render_template('products.html', products=products)
+    # صفوف أعمدة تقرأ على دفعات أثناء العرض فقط (لا استعلام إذا كان جزء الجدول مخزناً)
+    return cached_page(('products',), (),
+                       lambda: render_template('products.html', products=product_rows(),
+                                               product_count=product_count()))
 
 @app.route('/add_product', methods=['GET', 'POST'])
+@login_required
 def add_product():
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
-    
     if request.method == 'POST':
         name = request.form.get('name')
         price = float(request.form.get('price'))
         quantity = int(request.form.get('quantity'))
         category = request.form.get('category')
         
-        # إنشاء Product ID فريد
-        product_id = f"P{datetime.now().strftime('%Y%m%d%H%M%S')}"
+        # إنشاء Product ID فريد (من مجموعة أرقام محجوزة لهذه العملية)
+        product_id = new_product_ids(1)[0]
         
         product = Product(
             product_id=product_id,
@@ -97,39 +171,50 @@ def add_product():
             date_added=datetime.utcnow()
         )
         
-        db.session.add(product)
-        db.session.commit()
+        # إنشاء QR Code قبل الحفظ (يعتمد على الكود وليس رقم الصف) فيحفظ المنتج مرة واحدة
+        try:
+            product.qr_code_path = generate_qr_code(product)
+        except Exception as e:
+            logging.error(f"QR generation failed for {product_id}: {str(e)}")
         
-        # إنشاء QR Code
-        qr_path = generate_qr_code(product)
-        product.qr_code_path = qr_path
+        db.session.add(product)
         db.session.commit()
+        if product.qr_code_path is None:
+            queue_missing_qr_codes()
+        dashboard_publisher.refresh()
         
         flash('تم إضافة المنتج بنجاح', 'success')
         return redirect(url_for('products'))
     
     return render_template('add_product.html')
 
+@app.route('/api/products/bulk', methods=['POST'])
+@login_required(api=True)
+def bulk_create():
+    data = request.get_json(silent=True) or {}
+    rows = data.get('products')
+    if not isinstance(rows, list) or not rows:
+        return jsonify({'success': False, 'errors': ['أرسل قائمة المنتجات في products']}), 400
+    
+    codes, errors = bulk_create_products(rows, source=data.get('source'))
+    if errors:
+        return jsonify({'success': False, 'errors': errors}), 400
+    return jsonify({'success': True, 'created': len(codes), 'product_ids': codes})
+
 @app.route('/sales')
+@login_required
 def sales():
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
-    
     return redirect(url_for('qr_sales'))  # توجه إلى صفحة المبيعات بـ QR
 
 @app.route('/qr_sales')
+@login_required
 def qr_sales():
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
-    
-    products = Product.query.filter(Product.quantity > 0).all()
-    return render_template('qr_sales.html', products=products)
+    # أزرار الإضافة السريعة: الأكثر مبيعاً لهذا الكاشير وهذا الوقت من اليوم
+    return render_template('qr_sales.html', quick_products=quick_add_products(g.user_id))
 
 @app.route('/get_product_by_qr/<product_id>')
+@login_required(api=True, devices=True)
 def get_product_by_qr(product_id):
-    if 'user_id' not in session:
-        return jsonify({'error': 'غير مصرح'}), 401
-    
     product = Product.query.filter_by(product_id=product_id).first()
     if product:
         return jsonify({
@@ -143,74 +228,80 @@ def get_product_by_qr(product_id):
     
     return jsonify({'error': 'المنتج غير موجود'}), 404
 
+@app.route('/api/catalog/snapshot')
+@login_required(api=True, devices=True)
+def catalog_snapshot():
+    return jsonify(build_snapshot())
+
+@app.route('/api/catalog/changes')
+@login_required(api=True, devices=True)
+def catalog_changes():
+    try:
+        since = parse_cursor(request.args.get('since'))
+    except ValueError:
+        return jsonify({'error': 'مؤشر مزامنة غير صالح'}), 400
+    
+    return jsonify(build_changes(since))
+
+@app.route('/api/catalog/catalog.bin')
+@login_required(api=True, devices=True)
+def catalog_binary():
+    encoding = negotiate_encoding(request.headers.get('Accept-Encoding'))
+    data, etag = binary_catalog.get(encoding)
+    
+    response = Response(data, mimetype='application/octet-stream')
+    if encoding != 'identity':
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.set_etag(etag)
+    # يدعم If-None-Match والتحميل الجزئي عبر Range
+    return response.make_conditional(request, accept_ranges=True, complete_length=len(data))
+
 @app.route('/process_sale', methods=['POST'])
+@login_required(devices=True)
 def process_sale():
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
-    
     customer_name = request.form.get('customer_name', '')
     customer_phone = request.form.get('customer_phone', '')
     cart_items = request.form.get('cart_items')
+    client_ref = request.form.get('client_ref') or None
+    # المبيعات المؤجلة من نقاط البيع غير المتصلة تعاد بطلبات JSON
+    wants_json = request.accept_mimetypes.best == 'application/json'
     
     if not cart_items:
+        if wants_json:
+            return jsonify({'success': False, 'message': 'لا توجد منتجات في سلة التسوق'}), 400
         flash('لا توجد منتجات في سلة التسوق', 'error')
         return redirect(url_for('qr_sales'))
     
-    cart_data = json.loads(cart_items)
-    total_amount = 0
+    # تجاهل إعادة إرسال نفس البيع
+    if client_ref:
+        existing_sale = Sale.query.filter_by(client_ref=client_ref).first()
+        if existing_sale:
+            if wants_json:
+                return jsonify({'success': True, 'sale_id': existing_sale.id, 'duplicate': True})
+            flash(f'تم تسجيل هذا البيع مسبقاً (فاتورة رقم {existing_sale.id})', 'info')
+            return redirect(url_for('qr_sales'))
+        if journal_enabled() and sale_journal.is_pending(client_ref):
+            if wants_json:
+                return jsonify({'success': True, 'client_ref': client_ref, 'pending': True, 'duplicate': True})
+            flash('تم تسجيل هذا البيع مسبقاً', 'info')
+            return redirect(url_for('qr_sales'))
     
-    # إنشاء بيانات البيع
-    sale = Sale(
-        customer_name=customer_name,
-        customer_phone=customer_phone,
-        total_amount=0  # سيتم تحديثه
-    )
-    
-    db.session.add(sale)
-    db.session.flush()  # للحصول على ID
-    
-    # إضافة عناصر البيع
-    sale_items_data = []
-    for item in cart_data:
-        product = Product.query.get(item['product_id'])
-        if product and product.quantity >= item['quantity']:
-            # تقليل الكمية
-            product.quantity -= item['quantity']
-            
-            # إنشاء عنصر البيع
-            sale_item = SaleItem(
-                sale_id=sale.id,
-                product_id=product.id,
-                quantity=item['quantity'],
-                unit_price=product.price,
-                total_price=product.price * item['quantity']
-            )
-            
-            total_amount += sale_item.total_price
-            db.session.add(sale_item)
-            
-            # حفظ بيانات العنصر للطباعة
-            sale_items_data.append({
-                'name': product.name,
-                'quantity': item['quantity'],
-                'unit_price': product.price,
-                'total_price': sale_item.total_price
-            })
-    
-    # تحديث إجمالي البيع
-    sale.total_amount = total_amount
-    db.session.commit()
+    cart_data = json.loads(cart_items)
+    record = new_sale_record(db.session, customer_name, customer_phone, cart_data, client_ref, g.user_id)
     
-    # تحضير بيانات الفاتورة للطباعة
-    sale_data = {
-        'id': sale.id,
-        'date': sale.sale_date.strftime('%Y-%m-%d'),
-        'time': sale.sale_date.strftime('%H:%M:%S'),
-        'customer_name': customer_name,
-        'customer_phone': customer_phone,
-        'total': total_amount,
-        'items': sale_items_data
-    }
+    if journal_enabled():
+        # البيع محفوظ في اليومية على القرص، ويدخل قاعدة البيانات مع الدفعة التالية
+        record = sale_journal.submit(record, lambda product_ids: load_stock(db.session, product_ids))
+        sale = None
+        sale_data = receipt_data(record, record['client_ref'][:8].upper())
+    else:
+        sale, crossed_low_stock = apply_sales(db.session, [record])[0]
+        db.session.commit()
+        stock_forecaster.invalidate()
+        top_sellers.invalidate()
+        sale_data = receipt_data(record, sale.id)
     
     # طباعة الفاتورة مباشرة
     try:
@@ -223,34 +314,72 @@ def process_sale():
         
         if success:
             # تحديث تاريخ الطباعة
-            sale.print_date = datetime.utcnow()
-            db.session.commit()
-            flash(f'تم إتمام البيع وطباعة الفاتورة: {message}', 'success')
+            if sale is None:
+                sale_journal.mark_printed(record['client_ref'])
+            else:
+                sale.print_date = datetime.utcnow()
+                db.session.commit()
+            category, message = 'success', f'تم إتمام البيع وطباعة الفاتورة: {message}'
         else:
-            flash(f'تم إتمام البيع ولكن فشلت الطباعة: {message}', 'warning')
+            category, message = 'warning', f'تم إتمام البيع ولكن فشلت الطباعة: {message}'
             
     except Exception as e:
-        flash(f'تم إتمام البيع ولكن حدث خطأ في الطباعة: {str(e)}', 'warning')
+        category, message = 'warning', f'تم إتمام البيع ولكن حدث خطأ في الطباعة: {str(e)}'
+    
+    # نسخ إضافية على الطابعات الشبكية (الكاشير، المخزن، المبردات...) بالتوازي
+    if network_printers.printers:
+        results = network_printers.print_sale(sale_data)
+        failed = [name for name, (printed, _) in results.items() if not printed]
+        if failed:
+            category = 'warning'
+            message += f" - تعذرت الطباعة على: {', '.join(failed)}"
+    
+    if sale is None:
+        # تحديث اللوحة والتوقعات يتم من خيط اليومية بعد إدخال الدفعة
+        if wants_json:
+            return jsonify({'success': True, 'client_ref': record['client_ref'], 'pending': True, 'message': message})
+        flash(message, category)
+        return redirect(url_for('qr_sales'))
+    
+    dashboard_publisher.sale_completed(sale, crossed_low_stock)
     
+    if wants_json:
+        return jsonify({'success': True, 'sale_id': sale.id, 'message': message})
+    
+    flash(message, category)
     return redirect(url_for('qr_sales'))
 
 @app.route('/reports')
+@login_required
 def reports():
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
-    
     # تصفية حسب التاريخ
     start_date = request.args.get('start_date')
     end_date = request.args.get('end_date')
     
-    query = Sale.query
+    # تقرير يوم مغلق محسوب مسبقاً
+    if start_date and start_date == end_date and DayClose.query.filter_by(
+            business_date=datetime.strptime(start_date, '%Y-%m-%d').date()).first():
+        return redirect(url_for('z_report', business_date=start_date))
+    
+    # الصفحة المخزنة تتغير أيضاً مع وقت نسخة القراءة التي حسبت منها
+    replica = replica_status()
+    as_of = replica['as_of'].strftime('%Y-%m-%d %H:%M') if replica and replica['as_of'] else None
+    return cached_page(('sales',), (start_date, end_date, as_of),
+                       lambda: render_reports(start_date, end_date, replica))
+
+@replica_reads()
+def render_reports(start_date, end_date, replica=None):
+    start = datetime.strptime(start_date, '%Y-%m-%d') if start_date else None
+    end = datetime.strptime(end_date + ' 23:59:59', '%Y-%m-%d %H:%M:%S') if end_date else None
     
-    if start_date:
-        query = query.filter(Sale.sale_date >= datetime.strptime(start_date, '%Y-%m-%d'))
-    if end_date:
-        query = query.filter(Sale.sale_date <= datetime.strptime(end_date + ' 23:59:59', '%Y-%m-%d %H:%M:%S'))
+    # صفوف للعرض مع عدد العناصر، بدلاً من تحميل sale.items لكل بيع
+    sales = sale_rows(start, end)
     
-    sales = query.order_by(Sale.sale_date.desc()).all()
+    # إضافة المبيعات من الأرشيفات التي تغطي الفترة فقط؛ العرض الافتراضي (بلا بداية) يقرأ القاعدة الحية فقط
+    # حتى لا يفتح كل الأرشيفات
+    archived = archived_sales(start, end) if start else []
+    if archived:
+        sales = sorted(sales + archived, key=lambda sale: sale.sale_date, reverse=True)
     
     # إحصائيات
     total_sales = len(sales)
@@ -261,21 +390,125 @@ def reports():
                          total_sales=total_sales,
                          total_revenue=total_revenue,
                          start_date=start_date,
+                         end_date=end_date,
+                         replica=replica)
+
+@app.route('/day_close', methods=['GET', 'POST'])
+@login_required
+def day_close():
+    if request.method == 'POST':
+        try:
+            business_date = datetime.strptime(request.form.get('business_date', ''), '%Y-%m-%d').date()
+        except ValueError:
+            flash('تاريخ غير صحيح', 'error')
+            return redirect(url_for('day_close'))
+        success, message = close_day(business_date, g.user_id)
+        # صفحة التقرير تخزن في المتصفح، فالرسالة تعرض هنا وليس فيها
+        flash(message, 'success' if success else 'error')
+        return redirect(url_for('day_close'))
+    
+    closes = DayClose.query.order_by(DayClose.business_date.desc()).limit(60).all()
+    return render_template('day_close.html', closes=closes, open_days=unclosed_days())
+
+def _closed_day(business_date):
+    try:
+        business_date = date.fromisoformat(business_date)
+    except ValueError:
+        abort(404)
+    return DayClose.query.filter_by(business_date=business_date).first_or_404()
+
+@app.route('/z_report/<business_date>')
+@login_required
+def z_report(business_date):
+    close = _closed_day(business_date)
+    # التقرير لا يتغير بعد الإغلاق، لكن الرابط لا يحدد الفرع: يتحقق المتصفح في كل مرة (304 غالباً)
+    # والفرع جزء من ETag حتى لا يعرض تقرير فرع آخر بعد تبديل الفرع
+    etag = f"{current_branch()}-{close.checksum}"
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = app.make_response(render_template('z_report.html', close=close, report=json.loads(close.report)))
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+@app.route('/z_report/<business_date>.pdf')
+@login_required
+def z_report_download(business_date):
+    close = _closed_day(business_date)
+    try:
+        path = z_report_pdf(close)
+    except Exception as e:
+        flash(f'تعذر إنشاء ملف PDF: {str(e)}', 'error')
+        return redirect(url_for('day_close'))
+    response = send_file(path, mimetype='application/pdf', as_attachment=True,
+                         download_name=f"z_report_{business_date}.pdf", conditional=True)
+    # ETag الملف من مساره، والمسار يحتوي على الفرع
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+@app.route('/api/customers/search')
+@login_required(api=True, devices=True)
+def customers_search():
+    # الإكمال التلقائي لبيانات العميل في شاشة البيع
+    query = request.args.get('q', '').strip()
+    return jsonify({'customers': [customer_payload(customer) for customer in search_customers(query)]})
+
+@app.route('/customers/<int:customer_id>')
+@login_required
+def customer_profile(customer_id):
+    customer = Customer.query.get_or_404(customer_id)
+    # الإجماليات محفوظة في سجل العميل، فلا نقرأ إلا آخر المبيعات
+    recent_sales = (Sale.query.filter_by(customer_id=customer.id)
+                    .order_by(Sale.sale_date.desc())
+                    .limit(20)
+                    .all())
+    return render_template('customer.html', customer=customer, recent_sales=recent_sales)
+
+@app.route('/switch_branch', methods=['POST'])
+@login_required
+def switch_branch():
+    branch = request.form.get('branch', DEFAULT_BRANCH)
+    if not session.get('head_office'):
+        flash('غير مسموح بتغيير الفرع', 'error')
+    elif branch not in branch_names():
+        flash('الفرع غير موجود', 'error')
+    else:
+        session['branch'] = branch
+        flash(f'تم الانتقال إلى {branch_names()[branch]}', 'success')
+    
+    return redirect(request.referrer or url_for('dashboard'))
+
+@app.route('/branch_reports')
+@login_required
+@replica_reads()
+def branch_reports():
+    if not session.get('head_office'):
+        flash('هذا التقرير متاح للإدارة فقط', 'error')
+        return redirect(url_for('reports'))
+    
+    start_date = request.args.get('start_date')
+    end_date = request.args.get('end_date')
+    start = datetime.strptime(start_date, '%Y-%m-%d') if start_date else None
+    end = datetime.strptime(end_date + ' 23:59:59', '%Y-%m-%d %H:%M:%S') if end_date else None
+    
+    branches, totals = consolidated_report(start, end)
+    
+    return render_template('branch_reports.html',
+                         branches=branches,
+                         totals=totals,
+                         start_date=start_date,
                          end_date=end_date)
 
 @app.route('/print_setup')
+@login_required
 def print_setup():
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
-    
     system_info = print_system.get_system_info()
     return render_template('print_setup.html', system_info=system_info)
 
 @app.route('/setup_thermal_printer', methods=['POST'])
+@login_required(api=True, devices=True)
 def setup_thermal_printer():
-    if 'user_id' not in session:
-        return jsonify({'error': 'غير مصرح'}), 401
-    
     printer_type = request.form.get('printer_type', 'usb')
     
     success = print_system.setup_thermal_printer(printer_type)
@@ -285,11 +518,42 @@ def setup_thermal_printer():
     else:
         return jsonify({'success': False, 'message': 'فشل في إعداد الطابعة الحرارية'})
 
+@app.route('/devices', methods=['GET', 'POST'])
+@login_required
+def devices():
+    new_token = None
+    
+    if request.method == 'POST':
+        name = request.form.get('name', '').strip()
+        if not name:
+            flash('يرجى إدخال اسم الجهاز', 'error')
+        else:
+            user = db.session.get(User, session['user_id'])
+            device, new_token = issue_device_token(user, name, g.branch)
+            flash(f'تم إنشاء رمز الجهاز {device.name} - انسخه الآن فلن يظهر مرة أخرى', 'success')
+    
+    query = DeviceToken.query
+    if not session.get('head_office'):
+        query = query.filter_by(user_id=session['user_id'])
+    tokens = query.order_by(DeviceToken.created_at.desc()).all()
+    
+    return render_template('devices.html', tokens=tokens, new_token=new_token)
+
+@app.route('/devices/<int:token_id>/revoke', methods=['POST'])
+@login_required
+def revoke_device(token_id):
+    device = DeviceToken.query.get_or_404(token_id)
+    if device.user_id != session['user_id'] and not session.get('head_office'):
+        flash('غير مسموح بإلغاء هذا الرمز', 'error')
+        return redirect(url_for('devices'))
+    
+    success, message = revoke_device_token(device)
+    flash(message, 'success' if success else 'error')
+    return redirect(url_for('devices'))
+
 @app.route('/test_print')
+@login_required
 def test_print():
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
-    
     # بيانات اختبار
     test_data = {
         'id': 'TEST001',
@@ -322,6 +586,8 @@ def test_print():
 
 def generate_qr_code(product):
     """إنشاء QR Code للمنتج"""
+    import qrcode
+    
     # بيانات QR Code
     qr_data = json.dumps({
         'product_id': product.product_id,
@@ -351,67 +617,159 @@ def generate_qr_code(product):
     
     return qr_path
 
+@app.route('/import_excel', methods=['GET', 'POST'])
+@login_required
+def import_excel():
+    if request.method == 'POST':
+        excel_file = request.files.get('excel_file')
+        extension = os.path.splitext(excel_file.filename)[1].lower() if excel_file else ''
+        if extension not in ('.xlsx', '.xls'):
+            flash('يرجى اختيار ملف إكسيل (.xlsx أو .xls)', 'error')
+            return redirect(url_for('import_excel'))
+        
+        # الملف يحفظ باسم بصمته، فرفع نفس الملف مرتين لا يبدأ استيراداً ثانياً
+        data = excel_file.read()
+        digest = hashlib.sha256(data).hexdigest()
+        upload_dir = os.path.join(app.instance_path, 'uploads')
+        os.makedirs(upload_dir, exist_ok=True)
+        path = os.path.join(upload_dir, digest + extension)
+        if not os.path.exists(path):
+            with open(path, 'wb') as f:
+                f.write(data)
+        
+        job, created = job_runner.submit('import_products', {'path': path, 'filename': excel_file.filename},
+                                         dedupe_key=f"import:{g.branch}:{digest}")
+        if not created:
+            flash('هذا الملف قيد الاستيراد بالفعل', 'info')
+        return redirect(url_for('import_excel', job=job.id))
+    
+    job = Job.query.filter_by(id=request.args.get('job', type=int), branch_code=g.branch).first()
+    recent_jobs = (Job.query.filter_by(branch_code=g.branch)
+                   .order_by(Job.created_at.desc())
+                   .limit(10)
+                   .all())
+    return render_template('import_excel.html', job=job and job_payload(job), recent_jobs=recent_jobs)
+
+@app.route('/export_current_products', methods=['POST'])
+@login_required
+def export_current_products():
+    job, created = job_runner.submit('export_products', dedupe_key=f"export:{g.branch}")
+    return redirect(url_for('import_excel', job=job.id))
+
+@app.route('/regenerate_qr_codes', methods=['POST'])
+@login_required
+def regenerate_qr_codes():
+    job, created = job_runner.submit('regenerate_qr', dedupe_key=f"qr:{g.branch}")
+    return redirect(url_for('import_excel', job=job.id))
+
+@app.route('/download_sample_excel')
+@login_required
+def download_sample_excel():
+    return send_file(os.path.join(app.root_path, 'static', 'samples', 'sample_products.xlsx'), as_attachment=True)
+
+@app.route('/jobs/<int:job_id>')
+@login_required(api=True)
+def job_status(job_id):
+    job = Job.query.filter_by(id=job_id, branch_code=g.branch).first_or_404()
+    return jsonify(job_payload(job))
+
+@app.route('/jobs/<int:job_id>/cancel', methods=['POST'])
+@login_required(api=True)
+def cancel_job(job_id):
+    job = Job.query.filter_by(id=job_id, branch_code=g.branch).first_or_404()
+    success, message = job_runner.cancel(job)
+    return jsonify({'success': success, 'message': message})
+
+@app.route('/jobs/<int:job_id>/download')
+@login_required
+def download_job_result(job_id):
+    job = Job.query.filter_by(id=job_id, branch_code=g.branch).first_or_404()
+    if job.status != 'done' or not job.result_path or not os.path.exists(job.result_path):
+        abort(404)
+    return send_file(job.result_path, as_attachment=True)
+
+@app.route('/pricing', methods=['GET', 'POST'])
+@login_required
+def pricing():
+    if request.method == 'POST':
+        effective_at = request.form.get('effective_at')
+        try:
+            effective_at = local_to_utc(effective_at) if effective_at else None
+        except ValueError:
+            flash('موعد التطبيق غير صحيح', 'error')
+            return redirect(url_for('pricing'))
+        
+        success, message = create_price_change(
+            request.form.get('kind'),
+            request.form.get('value'),
+            category=request.form.get('category') or None,
+            product_ids=request.form.get('product_ids'),
+            effective_at=effective_at,
+            user_id=g.user_id
+        )
+        flash(message, 'success' if success else 'error')
+        return redirect(url_for('pricing'))
+    
+    categories = [category for (category,) in
+                  db.session.query(Product.category).distinct().order_by(Product.category)]
+    changes = PriceChange.query.order_by(PriceChange.created_at.desc()).limit(50).all()
+    return render_template('pricing.html', categories=categories, changes=changes, kinds=KINDS)
+
+@app.route('/pricing/<int:change_id>/cancel', methods=['POST'])
+@login_required
+def cancel_pricing(change_id):
+    success, message = cancel_price_change(PriceChange.query.get_or_404(change_id))
+    flash(message, 'success' if success else 'error')
+    return redirect(url_for('pricing'))
+
 @app.route('/edit_product/<int:product_id>', methods=['GET', 'POST'])
+@login_required
 def edit_product(product_id):
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
-    
     product = Product.query.get_or_404(product_id)
     
     if request.method == 'POST':
+        old_quantity = product.quantity
         product.name = request.form.get('name')
         product.price = float(request.form.get('price'))
         product.quantity = int(request.form.get('quantity'))
         product.category = request.form.get('category')
         
         db.session.commit()
+        stock_forecaster.invalidate()
+        dashboard_publisher.stock_changed(product, old_quantity)
         flash('تم تحديث المنتج بنجاح', 'success')
         return redirect(url_for('products'))
     
     return render_template('edit_product.html', product=product)
 
 @app.route('/delete_product/<int:product_id>', methods=['POST'])
+@login_required
 def delete_product(product_id):
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
-    
     product = Product.query.get_or_404(product_id)
     
     # Delete QR code file if exists
     if product.qr_code_path and os.path.exists(product.qr_code_path):
         os.remove(product.qr_code_path)
     
+    record_tombstone(product)
     db.session.delete(product)
     db.session.commit()
+    dashboard_publisher.refresh()
     
     flash(f'تم حذف المنتج "{product.name}" بنجاح', 'success')
     return redirect(url_for('products'))
 
 @app.route('/reprint_invoice/<int:sale_id>', methods=['POST'])
+@login_required
 def reprint_invoice(sale_id):
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
-    
-    sale = Sale.query.get_or_404(sale_id)
-    
-    # Prepare sale data for printing
-    sale_data = {
-        'id': sale.id,
-        'date': sale.sale_date.strftime('%Y-%m-%d'),
-        'time': sale.sale_date.strftime('%H:%M:%S'),
-        'customer_name': sale.customer_name,
-        'customer_phone': sale.customer_phone,
-        'total': sale.total_amount,
-        'items': []
-    }
-    
-    for item in sale.items:
-        sale_data['items'].append({
-            'name': item.product.name,
-            'quantity': item.quantity,
-            'unit_price': item.unit_price,
-            'total_price': item.total_price
-        })
+    # الفاتورة كما طبعت عند البيع (أسماء المنتجات وقتها) بقراءة واحدة بدون أصناف أو منتجات
+    sale_data = load_receipt(db.session, sale_id)
+    is_archived = False
+    if sale_data is None:
+        sale, is_archived = find_sale(sale_id)
+        if sale is None:
+            abort(404)
+        sale_data = receipt_from_sale(sale)
     
     # Print invoice
     try:
@@ -421,9 +779,11 @@ def reprint_invoice(sale_id):
             success, message = print_system.print_standard_invoice(sale_data)
         
         if success:
-            # Update print date
-            sale.print_date = datetime.utcnow()
-            db.session.commit()
+            # Update print date (archived sales are read-only)
+            if not is_archived:
+                db.session.execute(sa.update(Sale).where(Sale.id == sale_id).values(print_date=datetime.utcnow()))
+                bump_versions(db.session, {'sales'})
+                db.session.commit()
             flash(f'تم إعادة طباعة الفاتورة: {message}', 'success')
         else:
             flash(f'فشلت إعادة الطباعة: {message}', 'error')
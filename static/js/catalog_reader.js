@@ -0,0 +1,120 @@
+// Reader for the compact binary catalog served at /api/catalog/catalog.bin
+// (format documented in catalog_format.py). Columns are viewed in place as
+// typed arrays; lookups binary-search the sorted product_id column.
+
+const BinaryCatalog = (function() {
+    const MAGIC = 'MKCT';
+    const FORMAT_VERSION = 1;
+    const HEADER_SIZE = 16;
+    const ENTRY_SIZE = 28;
+    const COL_U32 = 1, COL_I32 = 2, COL_STR = 3, COL_DICT = 4;
+    const decoder = new TextDecoder('utf-8');
+    const encoder = new TextEncoder();
+
+    function stringColumn(buffer, offset, count) {
+        const offsets = new Uint32Array(buffer, offset, count + 1);
+        const bytes = new Uint8Array(buffer, offset + 4 * (count + 1));
+        return {
+            raw: index => bytes.subarray(offsets[index], offsets[index + 1]),
+            get: index => decoder.decode(bytes.subarray(offsets[index], offsets[index + 1]))
+        };
+    }
+
+    function dictColumn(buffer, offset, count) {
+        const codes = new Uint16Array(buffer, offset, count);
+        const dictOffset = offset + 2 * count + ((4 - (2 * count) % 4) % 4);
+        const dictCount = new Uint32Array(buffer, dictOffset, 1)[0];
+        const strings = stringColumn(buffer, dictOffset + 4, dictCount);
+        const values = [];
+        for (let i = 0; i < dictCount; i++) values.push(strings.get(i));
+        return { get: index => values[codes[index]] };
+    }
+
+    function compareBytes(a, b) {
+        const length = Math.min(a.length, b.length);
+        for (let i = 0; i < length; i++) {
+            if (a[i] !== b[i]) return a[i] - b[i];
+        }
+        return a.length - b.length;
+    }
+
+    function parse(buffer) {
+        const view = new DataView(buffer);
+        const magic = String.fromCharCode(...new Uint8Array(buffer, 0, 4));
+        if (magic !== MAGIC) throw new Error('not a catalog file');
+        if (view.getUint16(4, true) !== FORMAT_VERSION) throw new Error('unsupported catalog version');
+        const rowCount = view.getUint32(8, true);
+        const columnCount = view.getUint16(12, true);
+
+        const columns = {};
+        for (let i = 0; i < columnCount; i++) {
+            const entry = HEADER_SIZE + i * ENTRY_SIZE;
+            const name = decoder.decode(new Uint8Array(buffer, entry, 16)).replace(/\0+$/, '');
+            const type = view.getUint8(entry + 16);
+            const offset = view.getUint32(entry + 20, true);
+            if (type === COL_STR) columns[name] = stringColumn(buffer, offset, rowCount);
+            else if (type === COL_DICT) columns[name] = dictColumn(buffer, offset, rowCount);
+            else if (type === COL_U32) columns[name] = new Uint32Array(buffer, offset, rowCount);
+            else if (type === COL_I32) columns[name] = new Int32Array(buffer, offset, rowCount);
+        }
+
+        function row(index) {
+            return {
+                id: columns.id[index],
+                product_id: columns.product_id.get(index),
+                name: columns.name.get(index),
+                price: columns.price_cents[index] / 100,
+                quantity: columns.quantity[index],
+                category: columns.category.get(index)
+            };
+        }
+
+        function findIndex(productId) {
+            const target = encoder.encode(String(productId));
+            let low = 0, high = rowCount;
+            while (low < high) {
+                const mid = (low + high) >>> 1;
+                if (compareBytes(columns.product_id.raw(mid), target) < 0) low = mid + 1;
+                else high = mid;
+            }
+            if (low < rowCount && compareBytes(columns.product_id.raw(low), target) === 0) return low;
+            return -1;
+        }
+
+        return {
+            length: rowCount,
+            row: row,
+            lookup: productId => {
+                const index = findIndex(productId);
+                return index < 0 ? null : row(index);
+            },
+            lookupById: id => {
+                const index = columns.id.indexOf(Number(id));
+                return index < 0 ? null : row(index);
+            }
+        };
+    }
+
+    let current = null;
+    let etag = null;
+
+    // التحميل يستخدم ETag؛ المتصفح يفك ضغط gzip/zstd تلقائياً
+    function load(url) {
+        const headers = etag ? { 'If-None-Match': etag } : {};
+        return fetch(url || '/api/catalog/catalog.bin', { headers: headers }).then(response => {
+            if (response.status === 304 && current) return current;
+            if (!response.ok) throw new Error('HTTP ' + response.status);
+            etag = response.headers.get('ETag');
+            return response.arrayBuffer().then(buffer => {
+                current = parse(buffer);
+                return current;
+            });
+        });
+    }
+
+    return {
+        parse: parse,
+        load: load,
+        current: () => current
+    };
+})();
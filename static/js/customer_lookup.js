@@ -0,0 +1,79 @@
+// Customer autocomplete for the checkout forms: suggests known customers
+// while typing a name or phone number and fills both fields on selection.
+
+const CustomerLookup = (function() {
+    const MIN_CHARS = 2;
+    const DELAY_MS = 150;
+
+    function attach(nameInput, phoneInput) {
+        [nameInput, phoneInput].forEach(input => {
+            if (!input) return;
+            const list = document.createElement('div');
+            list.className = 'list-group position-absolute w-100 shadow-sm d-none';
+            list.style.zIndex = 1050;
+            input.parentElement.classList.add('position-relative');
+            input.parentElement.appendChild(list);
+            input.setAttribute('autocomplete', 'off');
+
+            let timer = null;
+            let lastQuery = '';
+            input.addEventListener('input', function() {
+                clearTimeout(timer);
+                const query = input.value.trim();
+                if (query.length < MIN_CHARS) {
+                    hide(list);
+                    return;
+                }
+                timer = setTimeout(() => {
+                    lastQuery = query;
+                    fetch('/api/customers/search?q=' + encodeURIComponent(query))
+                        .then(response => response.ok ? response.json() : { customers: [] })
+                        .then(data => {
+                            // ignore answers to an older query
+                            if (query === lastQuery) show(list, data.customers);
+                        })
+                        .catch(() => hide(list));
+                }, DELAY_MS);
+            });
+            input.addEventListener('blur', () => setTimeout(() => hide(list), 200));
+
+            list.addEventListener('click', function(event) {
+                const item = event.target.closest('[data-name]');
+                if (!item) return;
+                if (nameInput) nameInput.value = item.dataset.name;
+                if (phoneInput) phoneInput.value = item.dataset.phone;
+                hide(list);
+            });
+        });
+    }
+
+    function show(list, customers) {
+        list.innerHTML = '';
+        customers.forEach(customer => {
+            const item = document.createElement('button');
+            item.type = 'button';
+            item.className = 'list-group-item list-group-item-action d-flex justify-content-between';
+            item.dataset.name = customer.name;
+            item.dataset.phone = customer.phone || '';
+            const name = document.createElement('span');
+            name.textContent = customer.name;
+            const phone = document.createElement('small');
+            phone.className = 'text-muted';
+            phone.dir = 'ltr';
+            phone.textContent = customer.phone || '';
+            item.append(name, phone);
+            list.appendChild(item);
+        });
+        list.classList.toggle('d-none', customers.length === 0);
+    }
+
+    function hide(list) {
+        list.classList.add('d-none');
+    }
+
+    return { attach };
+})();
+
+document.addEventListener('DOMContentLoaded', function() {
+    CustomerLookup.attach(document.getElementById('customerName'), document.getElementById('customerPhone'));
+});
@@ -0,0 +1,172 @@
+// Local catalog copy for tills: resolves scans from IndexedDB and queues
+// sales made while the back office is unreachable.
+
+const OfflineCatalog = (function() {
+    const DB_NAME = 'market-catalog';
+    const DB_VERSION = 1;
+    const SYNC_VERSION = 1;
+    let dbPromise = null;
+
+    function openDb() {
+        if (dbPromise) return dbPromise;
+        dbPromise = new Promise((resolve, reject) => {
+            const request = indexedDB.open(DB_NAME, DB_VERSION);
+            request.onupgradeneeded = function() {
+                const db = request.result;
+                const products = db.createObjectStore('products', { keyPath: 'product_id' });
+                products.createIndex('id', 'id', { unique: true });
+                db.createObjectStore('meta', { keyPath: 'key' });
+                db.createObjectStore('outbox', { keyPath: 'client_ref' });
+            };
+            request.onsuccess = () => resolve(request.result);
+            request.onerror = () => reject(request.error);
+        });
+        return dbPromise;
+    }
+
+    function run(storeNames, mode, work) {
+        return openDb().then(db => new Promise((resolve, reject) => {
+            const tx = db.transaction(storeNames, mode);
+            let result;
+            Promise.resolve(work(tx)).then(value => { result = value; });
+            tx.oncomplete = () => resolve(result);
+            tx.onerror = () => reject(tx.error);
+            tx.onabort = () => reject(tx.error);
+        }));
+    }
+
+    function requestValue(request) {
+        return new Promise((resolve, reject) => {
+            request.onsuccess = () => resolve(request.result);
+            request.onerror = () => reject(request.error);
+        });
+    }
+
+    function getCursor() {
+        return run(['meta'], 'readonly', tx => requestValue(tx.objectStore('meta').get('cursor')))
+            .then(entry => (entry && entry.version === SYNC_VERSION) ? entry.value : null);
+    }
+
+    function fetchJson(url) {
+        return fetch(url, { headers: { 'Accept': 'application/json' } }).then(response => {
+            if (!response.ok) throw new Error('HTTP ' + response.status);
+            return response.json();
+        });
+    }
+
+    function loadSnapshot() {
+        return fetchJson('/api/catalog/snapshot').then(data => run(['products', 'meta'], 'readwrite', tx => {
+            const products = tx.objectStore('products');
+            products.clear();
+            data.products.forEach(product => products.put(product));
+            tx.objectStore('meta').put({ key: 'cursor', value: data.cursor, version: data.version });
+        }));
+    }
+
+    function applyChanges(data) {
+        return run(['products', 'meta'], 'readwrite', tx => {
+            const products = tx.objectStore('products');
+            data.deleted.forEach(code => products.delete(code));
+            data.updated.forEach(product => products.put(product));
+            tx.objectStore('meta').put({ key: 'cursor', value: data.cursor, version: data.version });
+        });
+    }
+
+    function sync() {
+        return getCursor().then(cursor => {
+            if (!cursor) return loadSnapshot();
+            return fetchJson('/api/catalog/changes?since=' + encodeURIComponent(cursor)).then(data => {
+                if (data.full_resync || data.version !== SYNC_VERSION) return loadSnapshot();
+                return applyChanges(data);
+            });
+        });
+    }
+
+    function findByCode(code) {
+        return run(['products'], 'readonly', tx => requestValue(tx.objectStore('products').get(String(code))));
+    }
+
+    function findById(id) {
+        return run(['products'], 'readonly',
+            tx => requestValue(tx.objectStore('products').index('id').get(Number(id))));
+    }
+
+    // خصم الكميات المباعة محلياً حتى تصل المزامنة التالية
+    function reserveStock(cartItems) {
+        return run(['products'], 'readwrite', tx => {
+            const index = tx.objectStore('products').index('id');
+            cartItems.forEach(item => {
+                index.get(item.product_id).onsuccess = function(event) {
+                    const product = event.target.result;
+                    if (product) {
+                        product.quantity = Math.max(0, product.quantity - item.quantity);
+                        tx.objectStore('products').put(product);
+                    }
+                };
+            });
+        });
+    }
+
+    function newClientRef() {
+        if (window.crypto && crypto.randomUUID) return crypto.randomUUID();
+        return Date.now().toString(36) + '-' + Math.random().toString(36).slice(2);
+    }
+
+    function queueSale(sale) {
+        return run(['outbox'], 'readwrite', tx => {
+            tx.objectStore('outbox').put(Object.assign({ queued_at: new Date().toISOString() }, sale));
+        }).then(() => reserveStock(sale.cart_items));
+    }
+
+    function pendingCount() {
+        return run(['outbox'], 'readonly', tx => requestValue(tx.objectStore('outbox').count()));
+    }
+
+    function postSale(sale) {
+        const body = new URLSearchParams({
+            customer_name: sale.customer_name || '',
+            customer_phone: sale.customer_phone || '',
+            cart_items: JSON.stringify(sale.cart_items),
+            client_ref: sale.client_ref
+        });
+        return fetch('/process_sale', {
+            method: 'POST',
+            headers: { 'Accept': 'application/json' },
+            body: body
+        }).catch(error => {
+            // فشل الاتصال نفسه (وليس رفض الخادم) يعني أن البيع يجب أن ينتظر
+            error.offline = true;
+            throw error;
+        }).then(response => {
+            if (!response.ok) throw new Error('HTTP ' + response.status);
+            return response.json();
+        });
+    }
+
+    // إعادة إرسال المبيعات المؤجلة بالترتيب؛ client_ref يمنع التكرار على الخادم
+    function replayOutbox() {
+        return run(['outbox'], 'readonly', tx => requestValue(tx.objectStore('outbox').getAll()))
+            .then(sales => {
+                sales.sort((a, b) => a.queued_at.localeCompare(b.queued_at));
+                let sent = 0;
+                return sales.reduce((chain, sale) => chain
+                    .then(() => postSale(sale))
+                    .then(() => run(['outbox'], 'readwrite', tx => tx.objectStore('outbox').delete(sale.client_ref)))
+                    .then(() => { sent++; }), Promise.resolve())
+                    .then(() => sent);
+            });
+    }
+
+    return {
+        sync: sync,
+        findByCode: findByCode,
+        findById: findById,
+        newClientRef: newClientRef,
+        queueSale: queueSale,
+        reserveStock: reserveStock,
+        pendingCount: pendingCount,
+        submitSale: postSale,
+        replayOutbox: replayOutbox,
+        supported: 'indexedDB' in window
+    };
+})();
@@ -0,0 +1,143 @@
+"""
+الأكثر مبيعاً لأزرار الإضافة السريعة في شاشة البيع
+- درجة لكل منتج تتناقص مع الزمن (نصف عمر أسبوع)، محسوبة لكل المبيعات ولكل فترة من اليوم ولكل كاشير
+- المبيعات الجديدة فقط تقرأ (SaleItem.id بعد آخر عنصر تمت معالجته) كما في forecasting.py
+- التناقص محسوب بطريقة forward decay: وزن البيع يكبر مع وقته بدلاً من إنقاص كل الدرجات القديمة،
+  والترتيب لا يتغير؛ عند كبر الأوزان يعاد ضبط نقطة البداية مرة واحدة
+- الترتيب من الذاكرة، ثم قراءة المنتجات المرشحة فقط بالمفتاح لاستبعاد النافد منها
+"""
+
+import logging
+import math
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from itertools import islice
+
+import sqlalchemy as sa
+
+from app import db
+from models import Product, Sale, SaleItem
+from branches import BranchLocal
+from read_models import QUICK_ADD_COLUMNS, product_rows
+
+QUICK_ADD_COUNT = 6
+
+# ساعات كل فترة من اليوم (بتوقيت UTC كما تخزن تواريخ البيع)
+DAYPART_HOURS = 4
+
+# إعادة ضبط نقطة البداية عندما يتجاوز أس الوزن هذه القيمة
+MAX_EXPONENT = 50
+
+
+class TopSellers:
+    def __init__(self, half_life_days=7, history_days=28, refresh_interval=30):
+        self.history_days = history_days
+        self.refresh_interval = refresh_interval
+        self._tau = half_life_days * 86400 / math.log(2)
+
+        self._lock = threading.Lock()
+        self._scores = defaultdict(lambda: defaultdict(float))   # النطاق -> {Product.id: درجة}
+        self._totals = defaultdict(float)                         # النطاق -> مجموع الدرجات
+        self._epoch = None
+        self._last_item_id = 0
+        self._last_refresh = 0.0
+
+    @staticmethod
+    def daypart(hour):
+        return hour // DAYPART_HOURS
+
+    def _exponent(self, when):
+        return (when - self._epoch).total_seconds() / self._tau
+
+    def _rebase(self, when):
+        """نقل نقطة البداية إلى when وتصغير كل الدرجات بنفس النسبة"""
+        factor = math.exp(-self._exponent(when))
+        for scores in self._scores.values():
+            for product_id in scores:
+                scores[product_id] *= factor
+        for scope in self._totals:
+            self._totals[scope] *= factor
+        self._epoch = when
+
+    def _ingest(self):
+        """إضافة عناصر البيع الجديدة فقط مجمعة حسب المنتج والكاشير والساعة"""
+        now = datetime.utcnow()
+        if self._epoch is None:
+            self._epoch = now
+        day_col = sa.func.date(Sale.sale_date)
+        hour_col = sa.extract('hour', Sale.sale_date)
+        rows = db.session.execute(
+            sa.select(SaleItem.product_id, Sale.cashier_id, day_col, hour_col,
+                      sa.func.sum(SaleItem.quantity), sa.func.max(SaleItem.id))
+            .join(Sale, Sale.id == SaleItem.sale_id)
+            .where(SaleItem.id > self._last_item_id)
+            .where(Sale.sale_date >= now - timedelta(days=self.history_days))
+            .group_by(SaleItem.product_id, Sale.cashier_id, day_col, hour_col)
+        ).all()
+        if not rows:
+            return
+
+        if self._exponent(now) > MAX_EXPONENT:
+            self._rebase(now)
+        for product_id, cashier_id, day, hour, quantity, _ in rows:
+            hour = int(hour)
+            when = datetime.strptime(str(day), '%Y-%m-%d') + timedelta(hours=hour, minutes=30)
+            weight = (quantity or 0) * math.exp(self._exponent(when))
+            for scope in (('all',), ('daypart', self.daypart(hour)), ('cashier', cashier_id)):
+                self._scores[scope][product_id] += weight
+                self._totals[scope] += weight
+        self._last_item_id = max(self._last_item_id, max(row[5] for row in rows))
+
+    def refresh(self, force=False):
+        now = time.monotonic()
+        with self._lock:
+            if not force and now - self._last_refresh < self.refresh_interval:
+                return
+            try:
+                self._ingest()
+                self._last_refresh = now
+            except Exception as e:
+                logging.error(f"خطأ في تحديث الأكثر مبيعاً: {str(e)}")
+
+    def invalidate(self):
+        """قراءة المبيعات الجديدة في الطلب التالي"""
+        self._last_refresh = 0.0
+
+    def ranking(self, cashier_id=None, hour=None, limit=QUICK_ADD_COUNT * 3):
+        """أرقام المنتجات الأكثر مبيعاً؛ كل نطاق (الكل، الفترة، الكاشير) بنفس الوزن بعد قسمته على مجموعه"""
+        self.refresh()
+        scopes = [('all',)]
+        if hour is not None:
+            scopes.append(('daypart', self.daypart(hour)))
+        if cashier_id is not None:
+            scopes.append(('cashier', cashier_id))
+
+        combined = defaultdict(float)
+        with self._lock:
+            for scope in scopes:
+                total = self._totals.get(scope)
+                if not total:
+                    continue
+                for product_id, score in self._scores[scope].items():
+                    combined[product_id] += score / total
+        return sorted(combined, key=combined.get, reverse=True)[:limit]
+
+
+# الأكثر مبيعاً (نسخة لكل فرع)
+top_sellers = BranchLocal(lambda code: TopSellers())
+
+
+def quick_add_products(cashier_id=None, limit=QUICK_ADD_COUNT):
+    """منتجات أزرار الإضافة السريعة: الأكثر مبيعاً المتوفرة في المخزون"""
+    ranked = top_sellers.ranking(cashier_id, datetime.utcnow().hour, limit * 3)
+    in_stock = {product.id: product for product in
+                product_rows(Product.id.in_(ranked), Product.quantity > 0, columns=QUICK_ADD_COLUMNS)} if ranked else {}
+    products = [in_stock[product_id] for product_id in ranked if product_id in in_stock][:limit]
+    if len(products) < limit:
+        # فرع جديد بلا مبيعات: أي منتجات متوفرة (بحد أقصى العدد المطلوب وليس الكتالوج كله)
+        missing = limit - len(products)
+        products += islice(product_rows(Product.quantity > 0, Product.id.notin_([product.id for product in products]),
+                                        columns=QUICK_ADD_COLUMNS, batch=missing), missing)
+    return products
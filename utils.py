@@ -1,20 +1,13 @@
-import qrcode
 import os
-from io import BytesIO
-from PIL import Image
-from reportlab.lib.pagesizes import A4
-from reportlab.lib import colors
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-from reportlab.pdfgen import canvas
-from reportlab.lib.units import inch
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
 from datetime import datetime
 import json
 
+# qrcode and reportlab are imported on first use to keep app start-up fast
+
 def generate_qr_code(product):
     """Generate QR code for a product"""
+    import qrcode
+    
     # Create QR code data
     qr_data = json.dumps({
         'id': product.id,
@@ -48,6 +41,12 @@ def generate_qr_code(product):
 
 def generate_invoice_pdf(sale):
     """Generate PDF invoice for a sale"""
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib import colors
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+    from reportlab.lib.units import inch
+    
     # Create invoices directory if it doesn't exist
     invoice_dir = "static/invoices"
     if not os.path.exists(invoice_dir):
@@ -173,3 +172,51 @@ def generate_invoice_pdf(sale):
     doc.build(elements)
     
     return filepath
+
+def generate_z_report_pdf(report, filepath):
+    """Render an end-of-day Z-report (dict from day_close.build_report) to PDF"""
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib import colors
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+    
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    doc = SimpleDocTemplate(filepath, pagesize=A4)
+    styles = getSampleStyleSheet()
+    title_style = ParagraphStyle('ZTitle', parent=styles['Heading1'], fontSize=18, alignment=1,
+                                 fontName='Helvetica-Bold')
+    header_style = ParagraphStyle('ZHeader', parent=styles['Heading2'], fontSize=13, spaceBefore=15,
+                                  alignment=2, fontName='Helvetica-Bold')
+    normal_style = ParagraphStyle('ZNormal', parent=styles['Normal'], fontSize=10, alignment=2,
+                                  fontName='Helvetica')
+    
+    def section(title, header, rows):
+        elements.append(Paragraph(title, header_style))
+        table = Table([header] + rows)
+        table.setStyle(TableStyle([
+            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+            ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
+            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+            ('GRID', (0, 0), (-1, -1), 1, colors.black),
+        ]))
+        elements.append(table)
+    
+    elements = [
+        Paragraph("Z-Report / تقرير إغلاق اليوم", title_style),
+        Paragraph(f"Business date: {report['business_date']}", normal_style),
+        Paragraph(f"Sales: {report['sale_count']} | Items: {report['item_count']} | "
+                  f"Total: {report['total_amount']:.2f} EGP", normal_style),
+        Paragraph(f"Invoices: #{report['first_sale_id'] or '-'} - #{report['last_sale_id'] or '-'}", normal_style),
+        Spacer(1, 10),
+    ]
+    section("Payment methods", ['Total', 'Sales', 'Method'],
+            [[f"{row['total']:.2f}", row['sale_count'], row['method']] for row in report['by_payment']])
+    section("Categories", ['Total', 'Quantity', 'Category'],
+            [[f"{row['total']:.2f}", row['quantity'], row['category']] for row in report['by_category']])
+    section("Cashiers", ['Total', 'Sales', 'Cashier'],
+            [[f"{row['total']:.2f}", row['sale_count'], row['cashier']] for row in report['by_cashier']])
+    
+    doc.build(elements)
+    return filepath